@@ -0,0 +1,228 @@
+#!/usr/bin/env python
+#-*- coding:utf-8 -*-
+
+# asyncio interface to the converters of NAFFoLiAPy
+# Licensed under GPLv3
+
+'''
+Conversions for asyncio applications. A conversion takes from a fraction of a second to minutes of CPU time, which
+would hold up every other task if it ran on the event loop, so these coroutines run it in an executor and only wait
+for it:
+
+    folia = await naf2folia_async(payload)
+    naf = await folia2naf_async(payload, executor=executor)
+
+The default executor of the event loop is a thread pool, which keeps the event loop free, but the conversions still
+take turns on the GIL; a process pool (see create_executor()) runs as many at the same time as it has workers. Many
+documents are converted with as_completed(), which yields every result as soon as it is ready:
+
+    async for conversion in as_completed(documents, executor=executor, concurrency=8):
+        if conversion.error is None:
+            send(conversion.index, conversion.data)
+
+Documents are passed as bytes, as file objects or asyncio StreamReaders to read them from, or as paths, and may be
+compressed (see naffoliapy.compression). The result is returned as bytes, or written to a file object or asyncio
+StreamWriter. Failed conversions raise ConversionError. This module needs Python 3.6 or later.
+'''
+
+from __future__ import print_function, unicode_literals, division, absolute_import
+
+import os
+import sys
+import asyncio
+import collections
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, wait
+
+from naffoliapy import compression
+from naffoliapy.diagnostics import WarningCollector
+
+CONVERTERS = ('naf2folia', 'folia2naf')
+
+#the options of the converters, besides compress
+OPTIONS = {
+    'naf2folia': ('docid', 'layers', 'bulk', 'validate', 'direct'),
+    'folia2naf': (),
+}
+
+
+class ConversionError(Exception):
+    pass
+
+#Result of a conversion by as_completed(): the position of the document in the input, the converted document (bytes),
+#the summary of the warnings (see WarningCollector.summary()) and the exception if the conversion failed
+Conversion = collections.namedtuple('Conversion', ('index', 'data', 'warnings', 'error'))
+
+
+def _preload():
+    #Runs in every new worker process, so the first conversion does not pay for the imports
+    from naffoliapy import naf2folia, folia2naf
+    naf2folia.preload()
+    folia2naf.preload()
+    return os.getpid()
+
+def create_executor(kind='process', workers=None):
+    """
+    Creates an executor to run conversions in
+    :param kind: 'process' for a pool of worker processes, which run conversions at the same time, 'thread' for a pool of threads, which take turns (str)
+    :param workers: number of workers, defaults to the number of CPUs (int)
+    :return: a concurrent.futures.Executor, for a process pool its workers have done the imports the conversions need
+    """
+    workers = workers or os.cpu_count() or 1
+    if kind == 'process':
+        executor = ProcessPoolExecutor(max_workers=workers)
+        wait([ executor.submit(_preload) for _ in range(workers) ])
+        return executor
+    elif kind == 'thread':
+        return ThreadPoolExecutor(max_workers=workers)
+    raise ValueError("Unknown kind of executor: " + str(kind) + ", choose from process, thread")
+
+def _convert(converter, payload, options):
+    #Runs in the executor, with its own collector as a collector can not be passed to a worker process
+    collector = WarningCollector()
+    try:
+        if isinstance(payload, str):
+            with open(payload, 'rb') as f:
+                payload = f.read()
+        if converter == 'naf2folia':
+            from naffoliapy.naf2folia import naf2folia_bytes
+            data = naf2folia_bytes(payload, options.get('docid'), options.get('layers'), collector, options.get('bulk', False), options.get('validate', True), options.get('direct', False))
+        else:
+            from naffoliapy.folia2naf import folia2naf_bytes
+            data = folia2naf_bytes(payload, collector)
+        data = compression.compress(data, options.get('compress'))
+    except Exception as e:
+        #not every exception can be passed back from a worker process (lxml's keep their error log)
+        raise ConversionError(e.__class__.__name__ + ": " + str(e))
+    return data, collector.summary()
+
+async def _read(document):
+    #The input document as bytes, or as a path for the executor to read
+    if isinstance(document, (bytes, bytearray, memoryview)):
+        return bytes(document)
+    elif isinstance(document, str) or hasattr(document, '__fspath__'):
+        return os.fspath(document)
+    elif isinstance(document, asyncio.StreamReader):
+        return await document.read()
+    elif hasattr(document, 'read'):
+        return await asyncio.get_event_loop().run_in_executor(None, document.read)
+    raise TypeError("Expected a document as bytes, a file object, an asyncio.StreamReader or a path, got " + type(document).__name__)
+
+async def _write(output, data):
+    if isinstance(output, asyncio.StreamWriter):
+        output.write(data)
+        await output.drain()
+    else:
+        await asyncio.get_event_loop().run_in_executor(None, output.write, data)
+
+def _options(converter, options):
+    if converter not in CONVERTERS:
+        raise ValueError("Unknown converter: " + str(converter) + ", choose from " + ', '.join(CONVERTERS))
+    unknown = set(options) - set(OPTIONS[converter]) - {'compress'}
+    if unknown:
+        raise TypeError(converter + " does not have the option(s) " + ', '.join(sorted(unknown)))
+    if options.get('layers') is not None and not isinstance(options['layers'], str):
+        #a set (LAYERS) is passed to a worker process as a list
+        options['layers'] = sorted(options['layers'])
+    return options
+
+async def convert_async(converter, document, output=None, collector=None, executor=None, **options):
+    """
+    Converts a document in an executor, without blocking the event loop
+    :param converter: 'naf2folia' or 'folia2naf'
+    :param document: the input document: bytes, a binary file object or asyncio.StreamReader to read it from, or a path (str)
+    :param output: a binary file object or asyncio.StreamWriter to write the converted document to, None to return it
+    :param collector: a naffoliapy.diagnostics.WarningCollector to add the warnings to, if not specified the first warnings of every kind are written to stderr
+    :param executor: a concurrent.futures.Executor to convert in (see create_executor()), None for the default executor of the event loop
+    :param options: for naf2folia: docid, layers, bulk, validate and direct (see naffoliapy.naf2folia.naf2folia_bytes()); for both: compress, the compression format of the output
+    :return: the converted document (bytes), if no output is given
+    :raises ConversionError: the conversion failed
+    """
+    options = _options(converter, options)
+    payload = await _read(document)
+    data, summary = await asyncio.get_event_loop().run_in_executor(executor, _convert, converter, payload, options)
+    warnings = collector if collector is not None else WarningCollector(stream=sys.stderr)
+    warnings.update(summary)
+    if collector is None:
+        warnings.flush()
+    if output is None:
+        return data
+    await _write(output, data)
+
+async def naf2folia_async(document, docid=None, layers=None, output=None, collector=None, executor=None, **options):
+    """
+    Converts a NAF document to FoLiA in an executor, without blocking the event loop, see convert_async()
+    :param document: the NAF document: bytes, a binary file object or asyncio.StreamReader to read it from, or a path (str)
+    :param docid: the ID for the FoLiA document, will be derived from the public ID of the NAF document if not specified (str)
+    :param layers: names of the layers to convert, None for all (see naffoliapy.naf2folia.naf2folia())
+    :return: the FoLiA document (bytes), if no output is given
+    """
+    return await convert_async('naf2folia', document, output, collector, executor, docid=docid, layers=layers, **options)
+
+async def folia2naf_async(document, output=None, collector=None, executor=None, **options):
+    """
+    Converts a FoLiA document to NAF in an executor, without blocking the event loop, see convert_async()
+    :param document: the FoLiA document: bytes, a binary file object or asyncio.StreamReader to read it from, or a path (str)
+    :return: the NAF document (bytes), if no output is given
+    """
+    return await convert_async('folia2naf', document, output, collector, executor, **options)
+
+async def as_completed(documents, converter='naf2folia', executor=None, concurrency=None, **options):
+    """
+    Converts many documents, at most a number at the same time, and yields every result as soon as it is ready.
+    The next documents are only taken from the input, and started, as results are taken, so a consumer that falls
+    behind holds up the conversions rather than results piling up. When the iterator is closed (aclose(), or when it
+    is garbage collected after the consumer broke out of the loop) or its consumer is cancelled, the conversions that
+    did not start yet are cancelled; those that are running are finished by the executor and dropped.
+    :param documents: the input documents, an iterable or asynchronous iterable of anything convert_async() takes
+    :param converter: 'naf2folia' or 'folia2naf'
+    :param executor: a concurrent.futures.Executor to convert in (see create_executor()), None for the default executor of the event loop
+    :param concurrency: maximum number of documents being converted or waiting to be taken, defaults to the number of CPUs (int)
+    :param options: conversion options, see convert_async()
+    :return: asynchronous iterator of Conversion tuples, in the order they complete; a failed conversion has the exception as error
+    """
+    options = _options(converter, options)
+    concurrency = concurrency or os.cpu_count() or 1
+    loop = asyncio.get_event_loop()
+    if hasattr(documents, '__aiter__'):
+        iterator = documents.__aiter__()
+        async def take():
+            return await iterator.__anext__()
+    else:
+        iterator = iter(documents)
+        async def take():
+            try:
+                return next(iterator)
+            except StopIteration:
+                raise StopAsyncIteration
+
+    async def convert(index, document):
+        try:
+            payload = await _read(document)
+            data, summary = await loop.run_in_executor(executor, _convert, converter, payload, options)
+            return Conversion(index, data, summary, None)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            return Conversion(index, None, None, e)
+
+    running = set()
+    index = 0
+    exhausted = False
+    try:
+        while True:
+            while not exhausted and len(running) < concurrency:
+                try:
+                    document = await take()
+                except StopAsyncIteration:
+                    exhausted = True
+                    break
+                running.add(asyncio.ensure_future(convert(index, document)))
+                index += 1
+            if not running:
+                break
+            done, running = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+            for future in done:
+                yield future.result()
+    finally:
+        for future in running:
+            future.cancel()
@@ -0,0 +1,216 @@
+#!/usr/bin/env python
+#-*- coding:utf-8 -*-
+
+# Batch conversion of whole corpora for NAFFoLiAPy
+# Licensed under GPLv3
+
+from __future__ import print_function, unicode_literals, division, absolute_import
+
+import sys
+import os
+import io
+import glob
+import time
+import hashlib
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from naffoliapy import compression
+
+
+def is_glob(path):
+    return any(c in path for c in '*?[')
+
+def _find_in_directory(directory, extensions):
+    #Recursively find all documents in a directory, in a stable order
+    for root, dirs, files in os.walk(directory):
+        dirs.sort()
+        for filename in sorted(files):
+            if filename.startswith('.'):
+                continue
+            if extensions and not compression.split_extension(filename)[0].endswith(extensions):
+                continue
+            filepath = os.path.join(root, filename)
+            yield filepath, os.path.relpath(filepath, directory)
+
+def collect_inputs(paths, extensions=None):
+    """
+    Expands input files, directories and glob patterns to a list of input documents
+    :param paths: list of paths, directories are searched recursively (list of str)
+    :param extensions: filename extensions that documents found in directories must have, not counting a compression extension (.gz, .xz, .zst), None for all files (tuple of str)
+    :return: list of (inputfile, relative path) tuples, the relative path is used to mirror the input tree in the output directory
+    """
+    inputs = []
+    loosefiles = []
+    for path in paths:
+        if is_glob(path):
+            matches = sorted(glob.glob(path, recursive=True))
+            if not matches:
+                print("WARNING: Pattern " + path + " does not match any files",file=sys.stderr)
+        else:
+            matches = [path]
+        for match in matches:
+            if os.path.isdir(match):
+                inputs += list(_find_in_directory(match, extensions))
+            elif os.path.isfile(match):
+                loosefiles.append(match)
+            else:
+                raise IOError("No such file or directory: " + match)
+
+    if loosefiles:
+        #files passed explicitly are placed relative to the deepest directory they have in common
+        dirs = [ os.path.dirname(os.path.abspath(filepath)).split(os.sep) for filepath in loosefiles ]
+        root = os.sep.join(os.path.commonprefix(dirs)) or os.sep
+        inputs += [ (filepath, os.path.relpath(os.path.abspath(filepath), root)) for filepath in loosefiles ]
+
+    seen = {}
+    for inputfile, relpath in inputs:
+        if relpath in seen:
+            raise ValueError("Input documents " + seen[relpath] + " and " + inputfile + " would be written to the same output file")
+        seen[relpath] = inputfile
+    return inputs
+
+def parse_shard(value):
+    """
+    Parses a shard specification
+    :param value: shard number and number of shards, i/N, numbered from 1 (str)
+    :return: tuple of the shard number and the number of shards (int, int)
+    :raises ValueError: the specification is not valid
+    """
+    try:
+        shard, shards = ( int(part) for part in value.split('/') )
+    except ValueError:
+        raise ValueError("Invalid shard " + value + ", expected i/N, e.g. 1/4 for the first of four shards")
+    if not 1 <= shard <= shards:
+        raise ValueError("Invalid shard " + value + ", the shard number must be from 1 to the number of shards")
+    return shard, shards
+
+def shard_of(relpath, shards):
+    """
+    Assigns an input document to a shard, by a hash of its relative path, so every machine dividing the same corpus assigns it to the same shard
+    :param relpath: path of the input document relative to its input root (str)
+    :param shards: number of shards (int)
+    :return: shard number, from 1 (int)
+    """
+    digest = hashlib.sha1(relpath.replace(os.sep, '/').encode('utf-8')).digest()
+    return int.from_bytes(digest[:8], 'big') % shards + 1
+
+def select_shard(inputs, shard, shards):
+    """
+    Selects the input documents of one shard, to divide the conversion of a corpus over several machines
+    :param inputs: list of (inputfile, relative path) tuples, as returned by collect_inputs()
+    :param shard: shard number, from 1 (int)
+    :param shards: number of shards (int)
+    :return: list of the (inputfile, relative path) tuples of the shard
+    """
+    return [ (inputfile, relpath) for inputfile, relpath in inputs if shard_of(relpath, shards) == shard ]
+
+def output_path(relpath, outputdir, strip_extensions, extension):
+    """
+    Computes the output file for an input document in the mirrored output tree
+    :param relpath: path of the input document relative to its input root (str)
+    :param outputdir: output directory (str)
+    :param strip_extensions: extensions to remove from the input filename, the first one that matches is removed, after a compression extension (tuple of str)
+    :param extension: extension to add to the output filename (str)
+    :return: output path (str)
+    """
+    relpath = compression.split_extension(relpath)[0]
+    for strip_extension in strip_extensions:
+        if relpath.endswith(strip_extension):
+            relpath = relpath[:-len(strip_extension)]
+            break
+    return os.path.join(outputdir, relpath + extension)
+
+
+def _run_job(function, inputfile, outputfile):
+    #Runs in a worker process; timing is done here so time spent waiting in the queue is not counted. What the
+    #conversion writes to stderr (its warnings) is written afterwards as one block headed by the input file, so the
+    #warnings of documents converted at the same time by other workers do not run together
+    begintime = time.time()
+    outputdir = os.path.dirname(outputfile)
+    stderr = sys.stderr
+    sys.stderr = messages = io.StringIO()
+    try:
+        if outputdir and not os.path.isdir(outputdir):
+            os.makedirs(outputdir)
+        function(inputfile, outputfile)
+        error = None
+    except Exception as e:
+        error = e.__class__.__name__ + ": " + str(e)
+    finally:
+        sys.stderr = stderr
+    if messages.getvalue():
+        stderr.write(inputfile + ":\n" + messages.getvalue())
+        stderr.flush()
+    return inputfile, outputfile, time.time() - begintime, error
+
+def _run_journaled_job(function, inputfile, outputfile):
+    #The checksums for the journal are also computed in the worker process
+    from naffoliapy.journal import checksums
+    result = _run_job(function, inputfile, outputfile)
+    if result[3] is not None:
+        return result, None
+    try:
+        return result, checksums(inputfile, outputfile)
+    except (IOError, OSError) as e:
+        return result[:3] + (e.__class__.__name__ + ": " + str(e),), None
+
+def convert_batch(jobs, function, workers=None, journal=None, timeout=None, maxmemory=None, recycle=None, quarantine=None, initializer=None):
+    """
+    Converts a batch of documents, spreading the work over a pool of worker processes
+    :param jobs: list of (inputfile, outputfile) tuples
+    :param function: conversion function, called with the input and output file, must be defined at module level so it can be passed to worker processes
+    :param workers: number of worker processes, defaults to the number of CPUs, 1 converts in the current process (unless there are limits)
+    :param journal: a naffoliapy.journal.Journal in which every converted document is recorded as soon as it is done, the documents it holds must be left out of the jobs first (see Journal.pending())
+    :param timeout: maximum time a document may take to convert, in seconds (float), see naffoliapy.supervisor
+    :param maxmemory: maximum resident set size of a worker process, in bytes (int), see naffoliapy.supervisor
+    :param recycle: replace every worker process after it converted this number of documents (int), see naffoliapy.supervisor
+    :param quarantine: a naffoliapy.supervisor.Quarantine for the documents that hit a limit
+    :param initializer: with limits, called in every new worker process before its first document (see naffoliapy.supervisor.convert_supervised())
+    :return: list of (inputfile, outputfile, duration, error) tuples, error is None on success (str)
+    """
+    if workers is None:
+        workers = os.cpu_count() or 1
+    run = _run_job if journal is None else _run_journaled_job
+    results = []
+
+    def done(result):
+        if journal is not None:
+            result, checksums = result
+            if checksums is not None:
+                journal.record(result[0], result[1], checksums)
+        results.append(result)
+
+    if timeout or maxmemory or recycle or quarantine is not None:
+        #documents whose worker is killed or dies are added to the results as failed, without a journal record
+        from naffoliapy.supervisor import convert_supervised
+        convert_supervised(jobs, run, function, workers, done, results.append, timeout, maxmemory, recycle, quarantine, initializer)
+    elif workers <= 1 or len(jobs) <= 1:
+        for inputfile, outputfile in jobs:
+            done(run(function, inputfile, outputfile))
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [ executor.submit(run, function, inputfile, outputfile) for inputfile, outputfile in jobs ]
+            for future in as_completed(futures):
+                done(future.result())
+    return results
+
+def print_summary(results, duration, slowest=10, stream=sys.stderr):
+    """
+    Prints a summary of a batch run: throughput, failures and the slowest documents
+    :param results: results as returned by convert_batch()
+    :param duration: wall-clock duration of the whole run, in seconds (float)
+    :param slowest: the number of slowest documents to list (int)
+    :param stream: the stream to write to
+    """
+    failures = [ result for result in results if result[3] is not None ]
+    print("Converted " + str(len(results) - len(failures)) + " of " + str(len(results)) + " documents in " + "%.2f" % duration + "s (" + "%.2f" % (len(results) / duration if duration else 0.0) + " documents/s), " + str(len(failures)) + " failed", file=stream)
+    if slowest:
+        ranked = sorted(results, key=lambda result: result[2], reverse=True)[:slowest]
+        if ranked:
+            print("Slowest documents:", file=stream)
+            for inputfile, _, documentduration, _ in ranked:
+                print("\t" + "%.2f" % documentduration + "s\t" + inputfile, file=stream)
+    if failures:
+        print("Failed documents:", file=stream)
+        for inputfile, _, _, error in failures:
+            print("\t" + inputfile + "\t" + error, file=stream)
@@ -0,0 +1,276 @@
+#!/usr/bin/env python
+#-*- coding:utf-8 -*-
+
+# Throughput benchmarks for NAFFoLiAPy
+# Licensed under GPLv3
+
+'''
+Benchmarks the converters on the corpora and examples that come with NAFFoLiAPy. Every suite is run in a fresh
+worker process, so the peak memory use reported is that of the suite alone. Results can be saved as a baseline,
+later runs can be checked against it to catch slowdowns after upgrading NAFFoLiAPy, pynlpl or KafNafParserPy:
+
+    $ python -m naffoliapy.benchmark --save baseline.json
+    $ python -m naffoliapy.benchmark --check baseline.json
+'''
+
+from __future__ import print_function, unicode_literals, division, absolute_import
+
+import sys
+import os
+import io
+import json
+import time
+import argparse
+import platform
+import shutil
+import tempfile
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
+ROOT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+#name => (converter, input directory relative to the repository root, extensions of the input documents)
+SUITES = OrderedDict([
+    ('meantime_english', ('naf2folia', 'corpora/meantime_english_naf', ('.xml',))),
+    ('meantime_dutch', ('naf2folia', 'corpora/meantime_dutch_naf', ('.naf',))),
+    ('examples_folia', ('folia2naf', 'examples', ('.folia.xml',))),
+])
+
+PERCENTILES = (50, 90, 95, 99)
+
+#metrics checked against the baseline: name => True if higher is better
+CHECKED_METRICS = OrderedDict([
+    ('tokens_per_second', True),
+    ('latency_p50', False),
+    ('latency_p95', False),
+    ('peak_memory', False),
+])
+
+
+def percentile(values, p):
+    """
+    Computes a percentile with the nearest-rank method
+    :param values: list of numbers
+    :param p: percentile, between 0 and 100
+    :return: the value at the percentile, None if there are no values
+    """
+    if not values:
+        return None
+    values = sorted(values)
+    rank = max(1, int(-(-p * len(values) // 100))) #ceil
+    return values[min(rank, len(values)) - 1]
+
+def _peak_memory():
+    #peak resident set size of the current process in bytes
+    import resource
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+def _count_naf_tokens(naffile):
+    from lxml import etree
+    count = 0
+    for _, node in etree.iterparse(naffile, tag='wf'):
+        count += 1
+        node.clear()
+    return count
+
+def _convert_naf2folia(inputfile, outputdir):
+    from naffoliapy.naf2folia import naf2folia, derive_docid
+    begintime = time.time()
+    foliadoc = naf2folia(inputfile, derive_docid(inputfile))
+    duration = time.time() - begintime
+    return duration, sum( 1 for _ in foliadoc.words() )
+
+def _convert_folia2naf(inputfile, outputdir):
+    from naffoliapy.folia2naf import convert_file_to_naf
+    outputfile = os.path.join(outputdir, os.path.basename(inputfile) + '.naf')
+    begintime = time.time()
+    convert_file_to_naf(inputfile, outputfile)
+    duration = time.time() - begintime
+    return duration, _count_naf_tokens(outputfile)
+
+CONVERTERS = {
+    'naf2folia': _convert_naf2folia,
+    'folia2naf': _convert_folia2naf,
+}
+
+def suite_inputs(name, root=ROOT_PATH):
+    """
+    Finds the input documents of a suite
+    :param name: name of the suite (see SUITES)
+    :param root: directory the input directories of the suites are relative to
+    :return: list of paths
+    """
+    from naffoliapy import batch
+    _, inputdir, extensions = SUITES[name]
+    return [ inputfile for inputfile, _ in batch.collect_inputs([os.path.join(root, inputdir)], extensions) ]
+
+def run_suite(converter, inputfiles, repeat=1, verbose=False):
+    """
+    Runs a benchmark suite in the current process
+    :param converter: name of the converter (see CONVERTERS)
+    :param inputfiles: list of input documents
+    :param repeat: number of times to convert every document, the fastest time counts (int)
+    :param verbose: show the warnings of the converter (bool)
+    :return: dictionary of metrics
+    """
+    convert = CONVERTERS[converter]
+    latencies = []
+    tokens = 0
+    failures = []
+    stderr = sys.stderr
+    if not verbose:
+        sys.stderr = io.open(os.devnull, 'w')
+    outputdir = tempfile.mkdtemp()
+    try:
+        for inputfile in inputfiles:
+            try:
+                durations = []
+                for _ in range(repeat):
+                    duration, count = convert(inputfile, outputdir)
+                    durations.append(duration)
+            except Exception as e:
+                failures.append(inputfile + ": " + e.__class__.__name__ + ": " + str(e))
+                continue
+            latencies.append(min(durations))
+            tokens += count
+    finally:
+        if not verbose:
+            sys.stderr.close()
+            sys.stderr = stderr
+        shutil.rmtree(outputdir)
+
+    total = sum(latencies)
+    metrics = OrderedDict()
+    metrics['converter'] = converter
+    metrics['documents'] = len(latencies)
+    metrics['failures'] = failures
+    metrics['tokens'] = tokens
+    metrics['duration'] = total
+    metrics['tokens_per_second'] = tokens / total if total else None
+    for p in PERCENTILES:
+        metrics['latency_p' + str(p)] = percentile(latencies, p)
+    metrics['latency_max'] = max(latencies) if latencies else None
+    metrics['peak_memory'] = _peak_memory()
+    return metrics
+
+def run_benchmarks(suites=None, repeat=1, verbose=False, root=ROOT_PATH):
+    """
+    Runs benchmark suites, each in a fresh worker process
+    :param suites: names of the suites to run, None for all (list of str)
+    :param repeat: number of times to convert every document, the fastest time counts (int)
+    :param verbose: show the warnings of the converters (bool)
+    :param root: directory the input directories of the suites are relative to
+    :return: dictionary with the environment and the metrics of every suite
+    """
+    results = OrderedDict()
+    results['environment'] = environment()
+    results['suites'] = OrderedDict()
+    for name in (suites or SUITES):
+        converter = SUITES[name][0]
+        inputfiles = suite_inputs(name, root)
+        with ProcessPoolExecutor(max_workers=1) as executor:
+            results['suites'][name] = executor.submit(run_suite, converter, inputfiles, repeat, verbose).result()
+    return results
+
+def environment():
+    """Returns the versions of Python and the libraries the benchmark results depend on"""
+    import pkg_resources
+    versions = OrderedDict()
+    versions['python'] = platform.python_version()
+    for package in ('NAFFoLiAPy', 'pynlpl', 'KafNafParserPy', 'lxml'):
+        try:
+            versions[package] = pkg_resources.get_distribution(package).version
+        except pkg_resources.DistributionNotFound:
+            versions[package] = None
+    versions['machine'] = platform.machine()
+    return versions
+
+def compare(results, baseline, tolerance=0.2):
+    """
+    Compares benchmark results with a baseline
+    :param results: results as returned by run_benchmarks()
+    :param baseline: earlier results
+    :param tolerance: relative change that is allowed before it counts as a regression (float)
+    :return: list of regressions, as human readable strings
+    """
+    regressions = []
+    for name, metrics in results['suites'].items():
+        if name not in baseline['suites']:
+            continue
+        basemetrics = baseline['suites'][name]
+        for metric, higherisbetter in CHECKED_METRICS.items():
+            value = metrics.get(metric)
+            basevalue = basemetrics.get(metric)
+            if not value or not basevalue:
+                continue
+            change = value / basevalue - 1
+            if (higherisbetter and change < -tolerance) or (not higherisbetter and change > tolerance):
+                regressions.append(name + ": " + metric + " went from " + _format(metric, basevalue) + " to " + _format(metric, value) + " (" + "%+.1f" % (change * 100) + "%)")
+        if len(metrics['failures']) > len(basemetrics['failures']):
+            regressions.append(name + ": " + str(len(metrics['failures'])) + " documents failed, was " + str(len(basemetrics['failures'])))
+    return regressions
+
+def _format(metric, value):
+    if value is None:
+        return '-'
+    elif metric.startswith('latency') or metric == 'duration':
+        return "%.3fs" % value
+    elif metric == 'peak_memory':
+        return "%.1fMB" % (value / 1024 / 1024)
+    elif metric == 'tokens_per_second':
+        return "%.0f" % value
+    return str(value)
+
+def print_report(results, stream=sys.stdout):
+    """
+    Prints a table of the benchmark results
+    :param results: results as returned by run_benchmarks()
+    :param stream: the stream to write to
+    """
+    columns = ['documents', 'tokens', 'duration', 'tokens_per_second'] + [ 'latency_p' + str(p) for p in PERCENTILES ] + ['latency_max', 'peak_memory']
+    print("\t".join(['suite'] + columns + ['failures']), file=stream)
+    for name, metrics in results['suites'].items():
+        print("\t".join([name] + [ _format(column, metrics[column]) for column in columns ] + [str(len(metrics['failures']))]), file=stream)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='naffoliapy-benchmark', description="Benchmarks the NAF/FoLiA converters on the bundled corpora and examples", formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('--suites', type=str,help="Comma separated list of suites to run. Choose from: " + ','.join(SUITES), action='store',default=','.join(SUITES),required=False)
+    parser.add_argument('--repeat', type=int,help="Convert every document this many times, the fastest time counts", action='store',default=1,required=False)
+    parser.add_argument('--save', type=str,help="Save the results as a baseline to this JSON file", action='store',default="",required=False)
+    parser.add_argument('--check', type=str,help="Compare the results with the baseline in this JSON file, exit with status 1 on regressions", action='store',default="",required=False)
+    parser.add_argument('--tolerance', type=float,help="Relative change of a metric that is allowed before it counts as a regression", action='store',default=0.2,required=False)
+    parser.add_argument('--json', help="Print the results as JSON rather than as a table", action='store_true',required=False)
+    parser.add_argument('--verbose', help="Show the warnings of the converters", action='store_true',required=False)
+    args = parser.parse_args(argv)
+
+    suites = [ name.strip() for name in args.suites.split(',') if name.strip() ]
+    for name in suites:
+        if name not in SUITES:
+            parser.error("Unknown suite: " + name + ". Choose from: " + ', '.join(SUITES))
+    baseline = None
+    if args.check:
+        with io.open(args.check, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+
+    results = run_benchmarks(suites, args.repeat, args.verbose)
+    if args.json:
+        print(json.dumps(results, indent=4))
+    else:
+        print_report(results)
+
+    if args.save:
+        with io.open(args.save, 'w', encoding='utf-8') as f:
+            f.write(json.dumps(results, indent=4, ensure_ascii=False))
+    if baseline is not None:
+        regressions = compare(results, baseline, args.tolerance)
+        for regression in regressions:
+            print("REGRESSION: " + regression, file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+        print("No regressions compared to " + args.check, file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
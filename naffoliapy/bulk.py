@@ -0,0 +1,208 @@
+#!/usr/bin/env python
+#-*- coding:utf-8 -*-
+
+# Bulk building of FoLiA documents for NAFFoLiAPy
+# Licensed under GPLv3
+
+'''
+Building a FoLiA document with deferred validation. pynlpl checks every element as it is appended: whether its
+parent accepts elements of its class and does not hold the maximum number of them yet (which counts the siblings
+every time) and whether a text content class is not used twice, and for every word added to a span annotation it
+searches the tree to place it among the others. For token-dense documents this takes a large part of the conversion.
+Within bulk_build() the checks are turned off for the current thread and the words are placed with a leaner search
+that gives the same order; validate() makes the skipped checks once, on the finished document:
+
+    with bulk_build():
+        foliadoc = build(...)
+    validate(foliadoc)
+
+The arguments of every element are still parsed and checked (set declarations, IDs) as they are created. The built
+document is the same as without bulk_build(); validate() can be left out for input that is known to convert to
+valid FoLiA. Other threads are not affected by the bulk build of one thread.
+'''
+
+from __future__ import print_function, unicode_literals, division, absolute_import
+
+import threading
+from contextlib import contextmanager
+from collections import defaultdict
+
+from naffoliapy.lazy import lazy_import
+
+folia = lazy_import('pynlpl.formats.folia')
+
+_state = threading.local()
+_lock = threading.Lock()
+_builds = 0 #number of bulk builds running in all threads, the methods are replaced while there are any
+_originals = {}
+
+
+def active():
+    """Returns True if the current thread is in a bulk build"""
+    return getattr(_state, 'depth', 0) > 0
+
+@contextmanager
+def bulk_build(enabled=True):
+    """
+    Context manager in which the current thread builds FoLiA documents without the checks on every added element,
+    can be nested
+    :param enabled: False to build with the checks as usual, for callers that make bulk building optional (bool)
+    """
+    if not enabled:
+        yield
+        return
+    global _builds
+    with _lock:
+        if _builds == 0:
+            _install()
+        _builds += 1
+    depth = getattr(_state, 'depth', 0)
+    _state.depth = depth + 1
+    try:
+        yield
+    finally:
+        _state.depth = depth
+        with _lock:
+            _builds -= 1
+            if _builds == 0:
+                _uninstall()
+
+def validate(foliadoc):
+    """
+    Makes the checks that are skipped in a bulk build on a finished FoLiA document, in one walk over it
+    :param foliadoc: folia.Document instance
+    :raises ValueError: an element holds a child of a class it does not accept
+    :raises folia.DuplicateAnnotationError: an element holds more children of a class (or of a class and set) than allowed, or text content of the same class twice
+    """
+    for element in foliadoc.data:
+        stack = [element]
+        while stack:
+            element = stack.pop()
+            #span annotations also hold the words they span, which belong to their sentence
+            children = [ child for child in element.data if isinstance(child, folia.AbstractElement) and child.parent is element ]
+            if children:
+                _validate_children(element, children)
+                stack.extend(children)
+
+def _validate_children(element, children):
+    Parentclass = element.__class__
+    classes = set()
+    textclasses = set()
+    for child in children:
+        Class = child.__class__
+        if Class not in classes:
+            classes.add(Class)
+            Parentclass.accepts(Class, True, element)
+        if Class is folia.TextContent:
+            if child.cls in textclasses:
+                raise folia.DuplicateAnnotationError("Can not add multiple text content elements with the same class (" + child.cls + ") to the same structural element!")
+            textclasses.add(child.cls)
+
+    limited = [ Class for Class in classes if Class.OCCURRENCES > 0 or (Class.OCCURRENCES_PER_SET > 0 and Class.REQUIRED_ATTRIBS and folia.Attrib.CLASS in Class.REQUIRED_ATTRIBS) ]
+    if not limited:
+        return
+    counts = _count(element)
+    for Class in limited:
+        if Class.OCCURRENCES > 0:
+            count = sum( n for (C, _), n in counts.items() if issubclass(C, Class) )
+            if count > Class.OCCURRENCES:
+                raise folia.DuplicateAnnotationError("Element " + Parentclass.__name__ + " " + _idnote(element) + " holds " + str(count) + " instances of " + Class.__name__ + ", the maximum is " + str(Class.OCCURRENCES))
+        if Class.OCCURRENCES_PER_SET > 0 and Class.REQUIRED_ATTRIBS and folia.Attrib.CLASS in Class.REQUIRED_ATTRIBS:
+            for set_ in { child.set for child in children if child.__class__ is Class and child.set }:
+                count = sum( n for (C, s), n in counts.items() if s == set_ and issubclass(C, Class) )
+                if count > Class.OCCURRENCES_PER_SET:
+                    raise folia.DuplicateAnnotationError("Element " + Parentclass.__name__ + " " + _idnote(element) + " holds " + str(count) + " instances of " + Class.__name__ + " in set " + set_ + ", the maximum is " + str(Class.OCCURRENCES_PER_SET))
+
+def _count(element):
+    """Counts the descendants of an element by class and set, as pynlpl counts them for its checks: authoritative elements only, without descending into structure elements"""
+    counts = defaultdict(int)
+    stack = list(element.data)
+    while stack:
+        e = stack.pop()
+        if isinstance(e, folia.AbstractElement) and not isinstance(e, folia.AbstractStructureElement) and getattr(e, 'auth', True):
+            counts[(e.__class__, e.set)] += 1
+            stack.extend(e.data)
+    return counts
+
+def _idnote(element):
+    return '(id=' + element.id + ')' if element.id else ''
+
+
+#Replacements of pynlpl's methods, they only differ from the originals in a bulk build
+
+def _addable(Class, parent, set=None, raiseexceptions=True):
+    if active():
+        return True
+    return _originals['addable'].__func__(Class, parent, set, raiseexceptions)
+
+def _append(self, child, *args, **kwargs):
+    #the common case, a class to create the child from, without formatting the docstring of append() and without addable()
+    if not active() or not isinstance(child, type) or kwargs.get('alternative'):
+        return _originals['append'](self, child, *args, **kwargs)
+    Class = child
+    if 'id' not in kwargs and 'generate_id_in' not in kwargs and ((Class.REQUIRED_ATTRIBS and (folia.Attrib.ID in Class.REQUIRED_ATTRIBS)) or Class.AUTO_GENERATE_ID):
+        kwargs['generate_id_in'] = self
+    child = Class(self.doc, *args, **kwargs)
+    self.data.append(child)
+    child.parent = self
+    child.postappend()
+    return child
+
+def _add(self, child, *args, **kwargs):
+    #add() only does more than append() for span annotations, which go in an annotation layer
+    if active() and isinstance(child, type) and not issubclass(child, folia.AbstractSpanAnnotation):
+        return self.append(child, *args, **kwargs)
+    return _originals['add'](self, child, *args, **kwargs)
+
+def _precedes(self, other):
+    #the same search as pynlpl's, depth first from the closest common ancestor, without its generic helpers. Like
+    #pynlpl's it fails at the first text it meets (a string has no depthfirstsearch()), which append() ignores, so
+    #the words of a span end up in the same order as without bulk_build()
+    if not active():
+        return _originals['precedes'](self, other)
+    if self.parent is other.parent and self.parent is not None:
+        ancestor = self.parent
+    else:
+        otherancestors = list(other.ancestors(folia.AbstractElement))
+        for ancestor in self.ancestors(folia.AbstractElement):
+            if any( ancestor is e for e in otherancestors ):
+                break
+        else:
+            raise Exception("Elements share no common ancestor")
+    stack = [ancestor]
+    while stack:
+        e = stack.pop()
+        if e is self:
+            return True
+        elif e is other:
+            return False
+        elif not isinstance(e, folia.AbstractElement):
+            raise AttributeError("'" + e.__class__.__name__ + "' object has no attribute 'depthfirstsearch'")
+        stack.extend(reversed(e.data))
+    raise Exception("Unable to find relation between elements! (shouldn't happen)")
+
+def _textcontent_postappend(self):
+    if active():
+        folia.AbstractElement.postappend(self)
+    else:
+        _originals['textcontent_postappend'](self)
+
+def _install():
+    _originals['addable'] = folia.AbstractElement.__dict__['addable']
+    _originals['append'] = folia.AbstractElement.append
+    _originals['add'] = folia.AbstractElement.add
+    _originals['precedes'] = folia.AbstractElement.precedes
+    _originals['textcontent_postappend'] = folia.TextContent.postappend
+    folia.AbstractElement.addable = classmethod(_addable)
+    folia.AbstractElement.append = _append
+    folia.AbstractElement.add = _add
+    folia.AbstractElement.precedes = _precedes
+    folia.TextContent.postappend = _textcontent_postappend
+
+def _uninstall():
+    folia.AbstractElement.addable = _originals['addable']
+    folia.AbstractElement.append = _originals['append']
+    folia.AbstractElement.add = _originals['add']
+    folia.AbstractElement.precedes = _originals['precedes']
+    folia.TextContent.postappend = _originals['textcontent_postappend']
+    _originals.clear()
@@ -0,0 +1,282 @@
+#!/usr/bin/env python
+#-*- coding:utf-8 -*-
+
+# Conversion cache for NAFFoLiAPy
+# Licensed under GPLv3
+
+'''
+On-disk cache of converted documents, so that repeated conversions of a corpus only convert the documents that
+changed. Entries are addressed by a hash of the input document, the converter version and the conversion options,
+so a changed document, a new version of the converter or other options never hit an outdated entry. The least
+recently used entries are removed when the cache grows beyond its size limit:
+
+    $ naf2folia --cache ~/.cache/naffoliapy --outputdir folia/ naf/
+    $ naffoliapy-cache verify ~/.cache/naffoliapy
+
+Every entry is stored as two files, named after its key: the output document (.data) and a JSON file with its
+checksum, size and the summary of the warnings of the conversion (.json).
+'''
+
+from __future__ import print_function, unicode_literals, division, absolute_import
+
+import sys
+import os
+import io
+import json
+import time
+import shutil
+import hashlib
+import tempfile
+import argparse
+
+CHUNKSIZE = 1024 * 1024
+
+
+def file_checksum(filename):
+    """Returns the SHA-256 checksum of a file (str)"""
+    checksum = hashlib.sha256()
+    with open(filename, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNKSIZE), b''):
+            checksum.update(chunk)
+    return checksum.hexdigest()
+
+def _remove(filename):
+    try:
+        os.unlink(filename)
+    except OSError:
+        #removed by another process sharing the cache
+        pass
+
+
+class ConversionCache(object):
+    """A directory of converted documents, addressed by the hash of their input and conversion"""
+
+    def __init__(self, directory, maxsize=None, link=False):
+        """
+        :param directory: directory of the cache, created if it does not exist (str)
+        :param maxsize: maximum total size of the cached documents in bytes, None for no limit (int)
+        :param link: hard link cached documents to the output file rather than copying them, the output must then never be modified in place (bool)
+        """
+        self.directory = directory
+        self.maxsize = maxsize
+        self.link = link
+        self._size = None #estimated total size, computed on the first addition
+        if not os.path.isdir(directory):
+            try:
+                os.makedirs(directory)
+            except OSError:
+                if not os.path.isdir(directory):
+                    raise
+
+    def key(self, inputfile, converter, version, options=None):
+        """
+        Computes the key of a conversion
+        :param inputfile: path to the input document (str)
+        :param converter: name of the converter (str)
+        :param version: version of the converter (str)
+        :param options: the conversion options that affect the output, must be serialisable to JSON (dict)
+        :return: key (str)
+        """
+        checksum = hashlib.sha256()
+        checksum.update(json.dumps([converter, version, options or {}], sort_keys=True).encode('utf-8'))
+        checksum.update(b'\0')
+        with open(inputfile, 'rb') as f:
+            for chunk in iter(lambda: f.read(CHUNKSIZE), b''):
+                checksum.update(chunk)
+        return checksum.hexdigest()
+
+    def path(self, key, extension):
+        #entries are spread over subdirectories so no directory gets too large
+        return os.path.join(self.directory, key[:2], key + extension)
+
+    def get(self, key, outputfile):
+        """
+        Writes the cached document for a key to the output file, if there is one
+        :param key: key as returned by key() (str)
+        :param outputfile: path to write the document to (str)
+        :return: the metadata of the entry (dict), None if the key is not in the cache
+        """
+        datafile = self.path(key, '.data')
+        try:
+            with io.open(self.path(key, '.json'), 'r', encoding='utf-8') as f:
+                metadata = json.load(f)
+            if self.link:
+                if os.path.exists(outputfile):
+                    os.unlink(outputfile)
+                os.link(datafile, outputfile)
+            else:
+                shutil.copyfile(datafile, outputfile)
+            os.utime(datafile, None) #most recently used
+        except (IOError, OSError, ValueError):
+            return None
+        return metadata
+
+    def put(self, key, outputfile, **metadata):
+        """
+        Adds a converted document to the cache, removing the least recently used entries if the cache gets too large
+        :param key: key as returned by key() (str)
+        :param outputfile: path to the converted document (str)
+        :param metadata: additional information to store with the document, must be serialisable to JSON
+        """
+        subdirectory = os.path.dirname(self.path(key, '.data'))
+        if not os.path.isdir(subdirectory):
+            try:
+                os.makedirs(subdirectory)
+            except OSError:
+                if not os.path.isdir(subdirectory):
+                    raise
+        metadata['key'] = key
+        metadata['size'] = os.path.getsize(outputfile)
+        metadata['sha256'] = file_checksum(outputfile)
+        metadata['created'] = time.time()
+        #written to temporary files first and moved in place, so other processes never see a partial entry
+        fd, tmpdata = tempfile.mkstemp(dir=subdirectory, suffix='.tmp')
+        os.close(fd)
+        fd, tmpmetadata = tempfile.mkstemp(dir=subdirectory, suffix='.tmp')
+        os.close(fd)
+        try:
+            shutil.copyfile(outputfile, tmpdata)
+            with io.open(tmpmetadata, 'w', encoding='utf-8') as f:
+                f.write(json.dumps(metadata, indent=4, ensure_ascii=False))
+            os.replace(tmpdata, self.path(key, '.data'))
+            os.replace(tmpmetadata, self.path(key, '.json'))
+        finally:
+            _remove(tmpdata)
+            _remove(tmpmetadata)
+        if self.maxsize is not None:
+            if self._size is None:
+                self._size = self.size()
+            else:
+                self._size += metadata['size']
+            if self._size > self.maxsize:
+                self.evict()
+
+    def entries(self):
+        """Returns the key, path to the document, size and time of last use of every entry, least recently used first"""
+        entries = []
+        for root, _, files in os.walk(self.directory):
+            for filename in files:
+                if filename.endswith('.data'):
+                    datafile = os.path.join(root, filename)
+                    try:
+                        stat = os.stat(datafile)
+                    except OSError:
+                        continue
+                    entries.append((filename[:-5], datafile, stat.st_size, stat.st_mtime))
+        entries.sort(key=lambda entry: entry[3])
+        return entries
+
+    def size(self):
+        """Returns the total size of the cached documents in bytes"""
+        return sum( size for _, _, size, _ in self.entries() )
+
+    def remove(self, key):
+        """Removes an entry"""
+        _remove(self.path(key, '.json'))
+        _remove(self.path(key, '.data'))
+
+    def evict(self, maxsize=None):
+        """
+        Removes the least recently used entries until the cache is no larger than its size limit
+        :param maxsize: size limit in bytes, defaults to the size limit of the cache (int)
+        :return: number of entries removed (int)
+        """
+        if maxsize is None:
+            maxsize = self.maxsize
+        entries = self.entries()
+        size = sum( size for _, _, size, _ in entries )
+        removed = 0
+        for key, _, entrysize, _ in entries:
+            if maxsize is None or size <= maxsize:
+                break
+            self.remove(key)
+            size -= entrysize
+            removed += 1
+        self._size = size
+        return removed
+
+    def verify(self, repair=False):
+        """
+        Checks the integrity of the cache: every document must match the checksum it was stored with and have its metadata
+        :param repair: remove the broken entries and leftover temporary files (bool)
+        :return: list of (key, problem) tuples, key is the filename for stray files
+        """
+        problems = []
+        for root, _, files in os.walk(self.directory):
+            for filename in sorted(files):
+                filepath = os.path.join(root, filename)
+                if filename.endswith('.tmp'):
+                    #only stale ones, the others may belong to a conversion that is still running
+                    if time.time() - os.path.getmtime(filepath) > 3600:
+                        problems.append((filename, "stale temporary file"))
+                        if repair:
+                            _remove(filepath)
+                    continue
+                key, extension = os.path.splitext(filename)
+                if extension == '.json':
+                    if os.path.exists(filepath) and not os.path.exists(os.path.join(root, key + '.data')): #may just have been removed as a broken entry
+                        problems.append((key, "document missing"))
+                        if repair:
+                            self.remove(key)
+                    continue
+                elif extension != '.data':
+                    problems.append((filename, "unknown file"))
+                    continue
+                problem = None
+                try:
+                    with io.open(os.path.join(root, key + '.json'), 'r', encoding='utf-8') as f:
+                        metadata = json.load(f)
+                except (IOError, OSError):
+                    problem = "metadata missing"
+                except ValueError:
+                    problem = "metadata corrupt"
+                else:
+                    if os.path.getsize(filepath) != metadata.get('size'):
+                        problem = "size mismatch"
+                    elif file_checksum(filepath) != metadata.get('sha256'):
+                        problem = "checksum mismatch"
+                if problem is not None:
+                    problems.append((key, problem))
+                    if repair:
+                        self.remove(key)
+        return problems
+
+    def clear(self):
+        """Removes all entries"""
+        for key, _, _, _ in self.entries():
+            self.remove(key)
+        self._size = 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='naffoliapy-cache', description="Manages the conversion cache of naf2folia and folia2naf (see --cache)")
+    parser.add_argument('command', choices=('verify', 'stats', 'evict', 'clear'), help="verify: check the checksums of all cached documents; stats: show the number and size of the entries; evict: remove the least recently used entries until the cache is no larger than --size; clear: remove all entries")
+    parser.add_argument('directory', help="Cache directory")
+    parser.add_argument('--repair', action='store_true', help="verify: remove broken entries")
+    parser.add_argument('--size', type=float, default=None, help="evict: maximum size of the cache in megabytes")
+    args = parser.parse_args(argv)
+
+    if not os.path.isdir(args.directory):
+        parser.error("No such directory: " + args.directory)
+    cache = ConversionCache(args.directory)
+    if args.command == 'verify':
+        problems = cache.verify(args.repair)
+        for key, problem in problems:
+            print(key + "\t" + problem + ("\t(removed)" if args.repair else ""))
+        print(str(len(problems)) + " problem(s) found", file=sys.stderr)
+        if problems and not args.repair:
+            sys.exit(1)
+    elif args.command == 'stats':
+        entries = cache.entries()
+        print("entries\t" + str(len(entries)))
+        print("size\t" + "%.1fMB" % (sum( size for _, _, size, _ in entries ) / 1024 / 1024))
+    elif args.command == 'evict':
+        if args.size is None:
+            parser.error("evict requires --size")
+        print(str(cache.evict(int(args.size * 1024 * 1024))) + " entries removed", file=sys.stderr)
+    elif args.command == 'clear':
+        cache.clear()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,232 @@
+#!/usr/bin/env python
+#-*- coding:utf-8 -*-
+
+# Compressed input and output for NAFFoLiAPy
+# Licensed under GPLv3
+
+'''
+Reading and writing gzip (.gz), xz (.xz) and zstandard (.zst) compressed documents, so corpora can stay compressed
+on disk. Compressed input is recognised by its first bytes, whatever its filename, and decompressed while it is
+parsed. Output is compressed when its filename has one of these extensions or when asked for (``--compress``):
+
+    $ naf2folia document.naf.gz document.folia.xml.zst
+    $ naf2folia --compress xz --outputdir folia/ naf/
+
+The streaming converters read their input more than once, so for them a compressed document is first decompressed
+to a temporary file. zstandard needs the zstandard module (pip install zstandard), gzip and xz are in the standard
+library.
+'''
+
+from __future__ import print_function, unicode_literals, division, absolute_import
+
+import os
+import io
+import gzip
+import lzma
+from contextlib import contextmanager
+from naffoliapy.pipe import spooled
+
+FORMATS = ('gz', 'xz', 'zst')
+
+EXTENSIONS = {
+    '.gz': 'gz',
+    '.xz': 'xz',
+    '.zst': 'zst',
+}
+
+MAGIC = {
+    b'\x1f\x8b': 'gz',
+    b'\xfd7zXZ\x00': 'xz',
+    b'\x28\xb5\x2f\xfd': 'zst',
+}
+MAGIC_SIZE = max( len(magic) for magic in MAGIC )
+
+#gzip defaults to its slowest level, the others to a balanced one
+GZIP_LEVEL = 6
+
+
+def _zstandard():
+    try:
+        import zstandard
+    except ImportError:
+        raise ImportError("Reading and writing zstandard compressed documents requires the zstandard module (pip install zstandard)")
+    return zstandard
+
+def detect_bytes(data):
+    """
+    Recognises a compressed document by its first bytes
+    :param data: the document, or at least its first bytes (bytes)
+    :return: the compression format ('gz', 'xz' or 'zst'), None if it is not compressed
+    """
+    for magic, compression in MAGIC.items():
+        if data.startswith(magic):
+            return compression
+    return None
+
+def detect(filename):
+    """
+    Recognises a compressed document by its first bytes
+    :param filename: path to the document (str)
+    :return: the compression format ('gz', 'xz' or 'zst'), None if it is not compressed
+    """
+    with open(filename, 'rb') as f:
+        return detect_bytes(f.read(MAGIC_SIZE))
+
+def split_extension(filename):
+    """
+    Splits the compression extension off a filename
+    :param filename: path or filename (str)
+    :return: tuple of the filename without the extension and the compression format, None if it has no such extension
+    """
+    base, extension = os.path.splitext(filename)
+    if extension.lower() in EXTENSIONS:
+        return base, EXTENSIONS[extension.lower()]
+    return filename, None
+
+def output_format(filename, compression=None):
+    """
+    Determines the compression of an output document
+    :param filename: path to the output document (str), or a file object
+    :param compression: compression format asked for, overrides the extension of the filename
+    :return: the compression format, None for no compression
+    """
+    if compression:
+        if compression not in FORMATS:
+            raise ValueError("Unknown compression format: " + compression + ", choose from " + ', '.join(FORMATS))
+        return compression
+    if not isinstance(filename, str):
+        return None
+    return split_extension(filename)[1]
+
+def open_input(filename):
+    """
+    Opens a document for reading, decompressing it if it is compressed
+    :param filename: path to the document (str)
+    :return: binary file object
+    """
+    compression = detect(filename)
+    if compression == 'gz':
+        return gzip.GzipFile(filename, 'rb')
+    elif compression == 'xz':
+        return lzma.LZMAFile(filename, 'rb')
+    elif compression == 'zst':
+        return _zstandard().ZstdDecompressor().stream_reader(open(filename, 'rb'), closefd=True)
+    return open(filename, 'rb')
+
+def open_stream(stream):
+    """
+    Decompresses a stream that is being read (stdin) if it is compressed, recognised by peeking at its first bytes
+    :param stream: binary file object, streams that can not peek are returned as they are
+    :return: binary file object
+    """
+    if not hasattr(stream, 'peek'):
+        return stream
+    compression = detect_bytes(stream.peek(MAGIC_SIZE))
+    if compression == 'gz':
+        return gzip.GzipFile(fileobj=stream, mode='rb')
+    elif compression == 'xz':
+        return lzma.LZMAFile(stream, 'rb')
+    elif compression == 'zst':
+        return _zstandard().ZstdDecompressor().stream_reader(stream, closefd=False)
+    return stream
+
+@contextmanager
+def readable(filename):
+    """
+    Gives something lxml can parse a document from: the filename itself if the document is not compressed, which
+    lxml reads fastest, a decompressing file object otherwise
+    :param filename: path to the document (str), file objects are passed through as they are
+    :return: context manager giving a filename or a binary file object
+    """
+    if not isinstance(filename, str) or detect(filename) is None:
+        yield filename
+    else:
+        with open_input(filename) as f:
+            yield f
+
+@contextmanager
+def decompressed(filename):
+    """
+    Gives the path to a decompressed copy of a document, for the streaming converters, which read their input more
+    than once
+    :param filename: path to the document (str)
+    :return: context manager giving the path to the document itself if it is not compressed, to a temporary file
+        otherwise (str)
+    """
+    if detect(filename) is None:
+        yield filename
+    else:
+        with open_input(filename) as f:
+            with spooled(f) as tmpfile:
+                yield tmpfile
+
+def open_output(target, compression=None):
+    """
+    Opens a document for writing, compressing it if asked for or if the filename has a compression extension
+    :param target: path to the document (str) or a binary file object, which is not closed
+    :param compression: compression format, overrides the extension of the filename
+    :return: binary file object, it must be closed to complete the compressed document
+    """
+    isfile = isinstance(target, str)
+    compression = output_format(target, compression)
+    if compression == 'gz':
+        return gzip.GzipFile(target if isfile else None, 'wb', compresslevel=GZIP_LEVEL, fileobj=None if isfile else target)
+    elif compression == 'xz':
+        return lzma.LZMAFile(target, 'wb')
+    elif compression == 'zst':
+        zstandard = _zstandard()
+        if isfile:
+            return zstandard.ZstdCompressor().stream_writer(open(target, 'wb'), closefd=True)
+        return zstandard.ZstdCompressor().stream_writer(target, closefd=False)
+    elif isfile:
+        return open(target, 'wb')
+    return _Unclosed(target)
+
+def compress(data, compression):
+    """
+    Compresses a document held in memory
+    :param data: the document (bytes)
+    :param compression: compression format, None to return the document as it is
+    :return: the compressed document (bytes)
+    """
+    if compression == 'gz':
+        return gzip.compress(data, compresslevel=GZIP_LEVEL)
+    elif compression == 'xz':
+        return lzma.compress(data)
+    elif compression == 'zst':
+        return _zstandard().ZstdCompressor().compress(data)
+    elif compression:
+        raise ValueError("Unknown compression format: " + compression)
+    return data
+
+def decompress(data):
+    """
+    Decompresses a document held in memory if it is compressed
+    :param data: the document (bytes)
+    :return: the decompressed document (bytes)
+    """
+    compression = detect_bytes(data)
+    if compression == 'gz':
+        return gzip.decompress(data)
+    elif compression == 'xz':
+        return lzma.decompress(data)
+    elif compression == 'zst':
+        #decompressobj() also handles frames that do not record their decompressed size
+        return _zstandard().ZstdDecompressor().decompressobj().decompress(data)
+    return data
+
+
+class _Unclosed(io.RawIOBase):
+    """Passes writes through to a stream that belongs to someone else (stdout), without closing it"""
+
+    def __init__(self, stream):
+        self.stream = stream
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        return self.stream.write(data)
+
+    def flush(self):
+        self.stream.flush()
@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+#-*- coding:utf-8 -*-
+
+# Warnings of the conversion for NAFFoLiAPy
+# Licensed under GPLv3
+
+'''
+Collects the warnings of a conversion. Problems in the input tend to repeat themselves (a misaligned raw layer
+gives a warning for every token), so warnings are grouped by category, identical warnings are counted rather than
+repeated, and only the first few different warnings of every category are kept:
+
+    collector = WarningCollector(limit=10)
+    foliadoc = naf2folia('document.naf', collector=collector)
+    print(json.dumps(collector.summary()))
+
+Converters that are not given a collector use one that also writes the kept warnings to stderr as they occur and
+ends with a line for every category that had more.
+'''
+
+from __future__ import print_function, unicode_literals, division, absolute_import
+
+import sys
+import io
+import json
+from collections import OrderedDict
+
+
+class WarningCollector(object):
+    """Groups, counts and limits the warnings of a conversion"""
+
+    def __init__(self, limit=10, stream=None):
+        """
+        :param limit: maximum number of different warnings kept per category, None for no limit (int)
+        :param stream: stream to write the kept warnings to as they occur, None to only collect them
+        """
+        self.limit = limit
+        self.stream = stream
+        self.categories = OrderedDict() #category => OrderedDict of message => count
+        self.counts = OrderedDict() #category => count
+
+    def warn(self, category, message):
+        """
+        Adds a warning
+        :param category: the kind of problem, warnings are grouped and limited by category (str)
+        :param message: human readable description (str)
+        """
+        messages = self.categories.get(category)
+        if messages is None:
+            messages = self.categories[category] = OrderedDict()
+            self.counts[category] = 0
+        self.counts[category] += 1
+        if message in messages:
+            messages[message] += 1
+        elif self.limit is None or len(messages) < self.limit:
+            messages[message] = 1
+            if self.stream is not None:
+                print("WARNING: " + message, file=self.stream)
+
+    def update(self, summary):
+        """
+        Adds the warnings of an earlier conversion, like those stored with a cached document
+        :param summary: summary as returned by summary()
+        """
+        for category, data in summary['categories'].items():
+            for message in data['messages']:
+                for _ in range(message['count']):
+                    self.warn(category, message['message'])
+            if data['suppressed']:
+                self.categories.setdefault(category, OrderedDict())
+                self.counts[category] = self.counts.get(category, 0) + data['suppressed']
+
+    def __len__(self):
+        return sum(self.counts.values())
+
+    def suppressed(self, category):
+        """Returns the number of warnings in a category that were not kept because the limit was reached"""
+        return self.counts[category] - sum(self.categories[category].values())
+
+    def flush(self):
+        """Writes how many warnings were left out to the stream, if any"""
+        if self.stream is not None:
+            for category in self.categories:
+                suppressed = self.suppressed(category)
+                if suppressed:
+                    print("WARNING: " + str(suppressed) + " more warning(s) of category '" + category + "' not shown", file=self.stream)
+
+    def summary(self):
+        """Returns the collected warnings as a dictionary that can be serialised to JSON"""
+        categories = OrderedDict()
+        for category, messages in self.categories.items():
+            categories[category] = OrderedDict([
+                ('count', self.counts[category]),
+                ('suppressed', self.suppressed(category)),
+                ('messages', [ OrderedDict([('message', message), ('count', count)]) for message, count in messages.items() ]),
+            ])
+        return OrderedDict([('total', len(self)), ('categories', categories)])
+
+    def save(self, filename):
+        """Writes the summary to a JSON file"""
+        with io.open(filename, 'w', encoding='utf-8') as f:
+            f.write(json.dumps(self.summary(), indent=4, ensure_ascii=False))
+
+
+class PrintWarnings(object):
+    """Writes every warning to stderr, used by conversion functions that are called without a collector"""
+
+    def warn(self, category, message):
+        print("WARNING: " + message, file=sys.stderr)
+
+PRINT_WARNINGS = PrintWarnings()
@@ -3,12 +3,23 @@
 
 from __future__ import print_function, unicode_literals, division, absolute_import
 
-from KafNafParserPy import *
-from pynlpl.formats import folia
 from collections import defaultdict
 
+from naffoliapy.lazy import lazy_import
+from naffoliapy.profiling import Profiler, NULL_PROFILER
+from naffoliapy.diagnostics import WarningCollector, PRINT_WARNINGS
+from naffoliapy import compression
+
 import sys
+import io
+import re
 import time
+import argparse
+import functools
+
+#imported when a conversion first needs them, so the command-line tool starts fast (see naffoliapy.lazy)
+naf = lazy_import('KafNafParserPy')
+folia = lazy_import('pynlpl.formats.folia')
 
 #version of this code
 version='0.1'
@@ -16,15 +27,16 @@ version='0.1'
 # FoLiA versions this code has been tested on
 tested_versions = ['1.2.0']
 
-#global dictionary that maps folia token ids to NAF term ids
-fid2tid = {}
+#FoLiA annotations that end up in a NAF layer outside the text and terms layers (names of the classes, see folia_classes())
+SPAN_ANNOTATIONS = ('Dependency', 'Chunk', 'Entity')
+
+#FoLiA elements that can not contain words or annotations the conversion looks for
+LEAF_ELEMENTS = ('AbstractTokenAnnotation', 'TextContent', 'PhonContent', 'ForeignData')
+
 
-#global dictionaries of found annotators for each layer (to be changed)
-text_header = {}
-term_header = {}
-chunk_header = {}
-dep_header = {}
-entity_header = {}
+def folia_classes(names):
+    '''Returns the FoLiA classes with the given names, so module-level constants do not need pynlpl to be imported'''
+    return tuple( getattr(folia, name) for name in names )
 
 
 def set_public_information(folia_obj, naf_header):
@@ -35,7 +47,7 @@ def set_public_information(folia_obj, naf_header):
     :return:
     '''
 
-    naf_public = Cpublic()
+    naf_public = naf.Cpublic()
     naf_public.set_publicid(folia_obj.id)
 
     if 'http' in folia_obj.id:
@@ -55,63 +67,28 @@ def add_lps_to_header(naf_obj, tooldict, layername):
     #conversion only applied if original had annotations
     if len(tooldict) > 0:
         currenttime = time.strftime('%Y-%m-%dT%H:%M:%S%Z')
-        lp = Clp(name='NAFFoLiAPy/folia2naf.py', version=version, btimestamp=currenttime, timestamp=currenttime)
+        lp = naf.Clp(name='NAFFoLiAPy/folia2naf.py', version=version, btimestamp=currenttime, timestamp=currenttime)
         naf_obj.add_linguistic_processor(layername, lp)
         for toolname, timestamp in tooldict.items():
             if timestamp is not None:
                 original_time = timestamp.strftime('%Y-%m-%dT%H:%M:%S%Z')
             else:
                 original_time = 'unknown'
-            lp = Clp(name=toolname, timestamp=original_time, btimestamp=original_time, etimestamp=original_time, hostname='unknown')
+            lp = naf.Clp(name=toolname, timestamp=original_time, btimestamp=original_time, etimestamp=original_time, hostname='unknown')
             naf_obj.add_linguistic_processor(layername, lp)
 
-def create_processes_header(naf_obj):
-    '''
-    Function that adds all processors to NAF header
-    :return: None
-    '''
-    global text_header, term_header, entity_header, chunk_header, dep_header
-
-    add_lps_to_header(naf_obj, text_header, 'text')
-    add_lps_to_header(naf_obj, term_header, 'terms')
-    add_lps_to_header(naf_obj, dep_header, 'deps')
-    add_lps_to_header(naf_obj, chunk_header, 'chunks')
-    add_lps_to_header(naf_obj, entity_header, 'entities')
-
-
-def header_to_header_layer(folia_obj, naf_obj):
-    '''
-    :param foliaobj:
-    :param nafobj:
-    :return:
-    '''
-    naf_header = CHeader()
-    set_public_information(folia_obj, naf_header)
-    naf_obj.set_header(naf_header)
-    create_processes_header(naf_obj)
-
-    # TODO: add annotation information (as linguistic processes)
-
-
-def set_word_info(nafWord, word, offset):
+def set_word_info(nafWord, text, offset):
     '''
     Adds all information that is deducted from the word form to the new token
-    :param nafWord: Cwf() object for new NAF token
-    :param word: FoLiA token
-    :param offset: offset of word
-    :return: offset updated with word length and space if applicable
+    :param nafWord: naf.Cwf() object for new NAF token
+    :param text: text of the word
+    :param offset: offset of word in the raw text
+    :return: None
     '''
 
     nafWord.set_offset(str(offset))
-    text = word.text()
-    wLength = len(text)
-    nafWord.set_length(str(wLength))
+    nafWord.set_length(str(len(text)))
     nafWord.set_text(text)
-    offset += wLength
-    if word.space:
-        offset += 1
-
-    return offset
 
 
 def create_span(idList):
@@ -120,27 +97,12 @@ def create_span(idList):
     :param idList: list of ids
     :return: span object
     '''
-    my_span = Cspan()
+    my_span = naf.Cspan()
     my_span.create_from_ids(idList)
 
     return my_span
 
 
-def create_span_from_folia_words(folia_word_list):
-    '''
-    Goes through list of folia words and identifies corresponding term id for each
-    :param folia_word_list: list of FoLiA word objects
-    :return: list of term ids
-    '''
-
-    global fid2tid
-    naf_span = []
-    for word in folia_word_list:
-        naf_term_id = fid2tid.get(word.id)
-        naf_span.append(naf_term_id)
-    return naf_span
-
-
 def add_span_to_elem(naf_elem, span_ids):
     '''
     Creates a NAF span object from a list of ids and adds this to the naf element
@@ -153,141 +115,119 @@ def add_span_to_elem(naf_elem, span_ids):
 
 
 
-def set_folia_info(folia_word, term):
-    '''
-    Retrieves information from folia_word and adds this to term
-    :param folia_word: folia word object
-    :param term: naf term object
-    :return: None
-    '''
-    global term_header
-
-    term.set_morphofeat(folia_word.pos())
-    term.set_lemma(folia_word.lemma())
-    if not folia_word.annotation(folia.PosAnnotation).annotator in term_header:
-        term_header[folia_word.annotation(folia.PosAnnotation).annotator] = folia_word.annotation(folia.PosAnnotation).datetime
-    if not folia_word.annotation(folia.LemmaAnnotation).annotator in term_header:
-        term_header[folia_word.annotation(folia.LemmaAnnotation).annotator] = folia_word.annotation(folia.LemmaAnnotation).datetime
-    #NAF pos tag corresponds to head (attribute's value) of pos element in FoLiA
-    #naf_pos = folia_word.xml().find('{http://ilk.uvt.nl/folia}pos').get('head')
-    naf_pos = folia_word.annotation(folia.PosAnnotation).feat('head')
-    term.set_pos(naf_pos)
-
-
-def get_and_add_term_information(folia_word, word_count):
-    '''
-    Retrieves term related information from folia word and adds a term
-    :param foliaWord: FoLiA word obj
-    :param nafObj: naf object to be updated
-    :param word_count: count for term id/span
-    :return: None
-    '''
-    global fid2tid
-    naf_term = Cterm()
-    # adding obligatory elements
-    term_id = 't' + str(word_count)
-    naf_term.set_id(term_id)
-    fid2tid[folia_word.id] = term_id
-    naf_span = create_span(['w' + str(word_count)])
-    naf_term.set_span(naf_span)
-    # add information from foliaWord
-    set_folia_info(folia_word, naf_term)
-    return naf_term
-
-
-
-def text_to_text_layer(folia_obj, naf_obj, annotationtypes):
-    '''
-    Goes through folia's text and adds all tokens to NAF token layer
+class RawTextBuilder(object):
+    '''
+    Builds the NAF raw text while the FoLiA words are converted, in a single pass and in linear time. Every word is
+    given its offset and length once, and the offsets always point into the raw text that is built.
+
+    If the FoLiA text body has text content (like the output of naf2folia), that is used as raw text and every word
+    is found in it, either by its explicit offset or right after the previous word. From the first word that can not
+    be found onwards, the raw text is reconstructed from the words instead: words are separated by a space if they
+    have one, and paragraphs by an empty line.
+    '''
+
+    WHITESPACE = re.compile(r'\s*', re.UNICODE)
+
+    def __init__(self, text=None, textid=None, out=None):
+        '''
+        :param text: text content of the FoLiA text body, None if there is none (str)
+        :param textid: id of the FoLiA text body, the element explicit word offsets must refer to (str)
+        :param out: file object the raw text is written to, None to keep it in memory
+        '''
+        self.text = text
+        self.textid = textid
+        self.out = out
+        self.pieces = []
+        self.length = 0 #length of the raw text so far
+        self.space = False #whether the previous word is followed by a space
+        self.paragraph = None
+
+    def write(self, piece):
+        if self.out is None:
+            self.pieces.append(piece)
+        else:
+            self.out.write(piece)
+        self.length += len(piece)
+
+    def add(self, text, space=True, paragraph=None, offset=None):
+        '''
+        Adds a word
+        :param text: text of the word (str)
+        :param space: whether the word is followed by a space (bool)
+        :param paragraph: the paragraph the word is in, a change starts a new paragraph
+        :param offset: explicit offset of the word in the text content of the text body, if any (int)
+        :return: offset of the word in the raw text (int)
+        '''
+        newparagraph = self.paragraph is not None and paragraph != self.paragraph
+        self.paragraph = paragraph
+        if self.text is not None:
+            if offset is None or offset < self.length or not self.text.startswith(text, offset):
+                offset = self.WHITESPACE.match(self.text, self.length).end()
+            if self.text.startswith(text, offset):
+                self.length = offset + len(text)
+                self.space = space
+                return offset
+            #the text content does not match the words (any longer), keep what matched and continue without it
+            matched = self.text[:self.length]
+            self.text = None
+            self.length = 0
+            self.write(matched)
+        if self.length > 0:
+            if self.space:
+                self.write(' ')
+            if newparagraph:
+                self.write('\n\n')
+        offset = self.length
+        self.write(text)
+        self.space = space
+        return offset
+
+    def add_word(self, word, paragraph):
+        '''
+        Adds a FoLiA word
+        :param word: FoLiA word obj
+        :param paragraph: the paragraph the word is in
+        :return: tuple of the offset in the raw text and the text of the word
+        '''
+        textcontent = word.textcontent()
+        text = textcontent.text()
+        if textcontent.ref is not None and textcontent.ref == self.textid:
+            offset = textcontent.offset
+        else:
+            offset = None
+        return self.add(text, word.space, paragraph, offset), text
+
+    def finish(self):
+        '''
+        Completes the raw text
+        :return: the raw text (str), or None if it was written to the file object
+        '''
+        if self.text is not None:
+            self.length = 0
+            self.write(self.text)
+            self.text = None
+        if self.out is None:
+            return ''.join(self.pieces)
+
+
+def text_body_content(folia_obj):
+    '''
+    Retrieves the text content of the FoLiA text body, if it has any
     :param folia_obj: folia input object
-    :param naf_obj: naf output object
-    :return: None
+    :return: tuple of the text (None if there is none) and the id of the text body
     '''
-    global text_header
-
-    offset = 0
-    naf_sent = 0
-    naf_para = 0
-    word_count = 0
-    for para in folia_obj.paragraphs():
-        naf_para += 1
-        for sent in para.sentences():
-            sent_nr = str(naf_sent)
-            for word in sent.words():
-                #for now (we can only capture tool and date any way)
-                if not word.annotator in text_header:
-                    text_header[word.annotator] = word.datetime
-                naf_word = Cwf()
-                offset = set_word_info(naf_word, word, offset)
-                word_count += 1
-                naf_word.set_id('w' + str(word_count))
-                naf_word.set_sent(sent_nr)
-                naf_word.set_para(str(naf_para))
-                naf_obj.add_wf(naf_word)
-                if folia.AnnotationType.POS in annotationtypes:
-                #change: only call this if term information is present
-                    naf_term = get_and_add_term_information(word, word_count)
-                    naf_obj.add_term(naf_term)
-            naf_sent += 1
-
-def add_raw_from_text_layer(naf_obj):
-    '''
-    Goes through NAF's token layer and adds a raw layer based on its data.
-    :param naf_obj: nafobject containing text layer
-    :return: None
-    '''
-    raw = ''
-    offset = 0
-    paragraph = '1'
-    for tok in naf_obj.get_tokens():
-        # add space and update offset if there was a space
-        if tok.get_offset() != str(offset):
-            raw += ' '
-            offset += 1
-        # add double new line for now paragraph
-        if tok.get_para() != paragraph:
-            raw += '\n\n'
-            paragraph = tok.get_para()
-        token = tok.get_text()
-        raw += token
-        offset += len(token)
-    naf_obj.set_raw(raw)
-
-
-def dependencies_to_dependency_layer(folia_obj, naf_obj):
-    '''
-    Retrieves all dependencies from a folia document, turns them into NAF dep elements and adds them to NAF object
-    :param folia_obj: folia object
-    :param naf_obj: naf object
-    :return: dictionary of (NAF) head id to all its (NAF) dependents ids
-    '''
-    global dep_header
-    head2deps = defaultdict(list)
-    for folia_dep in folia_obj.select(folia.Dependency):
-        if not folia_dep.annotator in dep_header:
-            dep_header[folia_dep.annotator] = folia_dep.datetime
-        head_span = create_span_from_folia_words(folia_dep.head().wrefs())
-        if len(head_span) > 1:
-            print('[WARNING] Unknown situation: head consists of more than one tokens', file=sys.stderr)
-        dep_span = create_span_from_folia_words(folia_dep.dependent().wrefs())
-        if len(dep_span) > 1:
-            print('[WARNING] Situation not captured: dependent consists of more than one token', file=sys.stderr)
-        naf_dep = Cdependency()
-        naf_head = head_span[0]
-        naf_dep.set_from(naf_head)
-        n_dep = dep_span[0]
-        naf_dep.set_to(n_dep)
-        naf_dep.set_function(folia_dep.cls)
-        naf_obj.add_dependency(naf_dep)
-        head2deps[naf_head].append(n_dep)
-    return head2deps
+    for textbody in folia_obj.data:
+        if isinstance(textbody, folia.Text) and textbody.hastext():
+            return textbody.textcontent().text(), textbody.id
+    return None, None
 
 
-def identify_head_id(span, head2deps):
+def identify_head_id(span, head2deps, collector=PRINT_WARNINGS):
     '''
     Goes through span and identifies which term is the syntactic head
     :param span: list of term ids
     :param head2deps: list of heads mapped to their dependents
+    :param collector: warning collector (naffoliapy.diagnostics.WarningCollector)
     :return:
     '''
     if len(span) == 1:
@@ -297,56 +237,9 @@ def identify_head_id(span, head2deps):
             deps = head2deps.get(term)
             if len(set(deps) & set(span)) > 0:
                 return term
-    print('[WARNING]: no information found to identify head of', span, file=sys.stderr)
-
-
-def chunking_to_chunks_layer(folia_obj, naf_obj, head2deps):
-    '''
-    Extract chunks from FoLiA object and add to NAF's chunk layer
-    :param folia_obj: folia object
-    :param naf_obj: naf object
-    :param head2deps: dictionary mapping heads to their dependents
-    :return: None
-    '''
-    global chunk_header
-    chunk_id = 1
-    for chunk in folia_obj.select(folia.Chunk):
-        if not chunk.annotator in chunk_header:
-            chunk_header[chunk.annotator] = chunk.datetime
-        naf_chunk = Cchunk()
-        naf_chunk.set_id('c' + str(chunk_id))
-        chunk_id += 1
-        naf_span = create_span_from_folia_words(chunk.wrefs())
-        add_span_to_elem(naf_chunk, naf_span)
-        naf_chunk.set_phrase(chunk.cls)
-        chunk_head = identify_head_id(naf_span, head2deps)
-        if chunk_head is not None:
-            naf_chunk.set_head(chunk_head)
-        naf_obj.add_chunk(naf_chunk)
+    collector.warn('unknown-head', 'no information found to identify head of ' + str(span))
 
 
-def entities_to_entity_layer(folia_obj, naf_obj):
-    '''
-    Retrieves all entities from folia obj and adds them to naf entity layer
-    :param folia_obj: folia object
-    :param naf_obj: naf object
-    :return: None
-    '''
-    global entity_header
-    entity_id = 1
-    for entity in folia_obj.select(folia.Entity):
-        if not entity.annotator in entity_header:
-            entity_header[entity.annotator] = entity.datetime
-        naf_entity = Centity()
-        naf_entity.set_id('e' + str(entity_id))
-        entity_id += 1
-        naf_span = create_span_from_folia_words(entity.wrefs())
-        entity_references = Creferences()
-        add_span_to_elem(entity_references, naf_span)
-        naf_entity.add_reference(entity_references)
-        naf_entity.set_type(entity.cls)
-        naf_obj.add_entity(naf_entity)
-
 def retrieve_annotation_layers(folia_obj):
     '''
     Checks which annotations are present in folia object
@@ -361,46 +254,452 @@ def retrieve_annotation_layers(folia_obj):
     return annotationtypes
 
 
-def check_overall_info(folia_obj):
+def check_version(version, collector=PRINT_WARNINGS):
     '''
-    Prints information about possible mismatches and problems in conversion
+    Warns if the FoLiA version of the input is not known or not tested
+    :param version: the version attribute of the FoLiA document, None if it has none
+    :param collector: warning collector (naffoliapy.diagnostics.WarningCollector)
+    :return: None
+    '''
+    if version is None:
+        collector.warn('folia-version', 'FoLiA input did not have a version indicated.')
+    elif not version in tested_versions:
+        collector.warn('folia-version', 'FoLiA version not represented in testset; unknown errors may have occurred.')
+
+def check_overall_info(folia_obj, collector=PRINT_WARNINGS):
+    '''
+    Warns about possible mismatches and problems in conversion
     :param folia_obj: input file
+    :param collector: warning collector (naffoliapy.diagnostics.WarningCollector)
     :return: None
     '''
-    if folia_obj.version is None:
-        print('[WARNING] FoLiA input did not have a version indicated.', file=sys.stderr)
-    elif not folia_obj.version in tested_versions:
-        print('[WARNING] FoLiA version not represented in testset; unknown errors may have occurred.', file=sys.stderr)
+    check_version(folia_obj.version, collector)
     annotationtypes = retrieve_annotation_layers(folia_obj)
     #TODO: create online documentation about missing correspondences; point to them in warnings.
     return annotationtypes
 
 
-def convert_file_to_naf(inputfolia, outputnaf=None):
+class FoLiA2NAFConverter(object):
+    '''
+    Converts a single FoLiA document to NAF. All state collected during the conversion (the mapping from FoLiA
+    word ids to NAF term ids and the annotators found for each layer) is held by the converter instance, so
+    a new instance is needed for every document. Separate instances can be used concurrently.
+    '''
+
+    def __init__(self, folia_obj, profiler=None, collector=None):
+        '''
+        :param folia_obj: folia input object
+        :param profiler: a naffoliapy.profiling.Profiler that measures every stage of the conversion
+        :param collector: a naffoliapy.diagnostics.WarningCollector to add the warnings to, every warning is written to stderr if not specified
+        '''
+        self.folia_obj = folia_obj
+        self.naf_obj = None
+        self.profiler = profiler if profiler is not None else NULL_PROFILER
+        self.collector = collector if collector is not None else PRINT_WARNINGS
+
+        #builds the raw text and the token offsets
+        self.raw = None
+
+        #maps folia token ids to NAF term ids
+        self.fid2tid = {}
+
+        #position in the document while walking it
+        self.word_count = 0
+        self.naf_sent = -1
+        self.naf_para = 0
+
+        #dependencies, chunks and entities found while walking the document, converted once all words are known
+        self.span_annotations = folia_classes(SPAN_ANNOTATIONS)
+        self.leaf_elements = folia_classes(LEAF_ELEMENTS)
+        self.annotations = dict( (Class, []) for Class in self.span_annotations )
+
+        #found annotators for each layer
+        self.text_header = {}
+        self.term_header = {}
+        self.chunk_header = {}
+        self.dep_header = {}
+        self.entity_header = {}
+
+    def convert(self):
+        '''
+        Converts the FoLiA document
+        :return: naf object (KafNafParser)
+        '''
+        if self.naf_obj is not None:
+            raise RuntimeError("Converter has already been used, create a new FoLiA2NAFConverter for every document")
+
+        folia_obj = self.folia_obj
+        # check what information is present and print warnings if not all can be handled (yet)
+        annotationtypes = check_overall_info(folia_obj, self.collector)
+
+        self.naf_obj = naf_obj = naf.KafNafParser(type='NAF')
+        if folia_obj.language() is not None:
+            naf_obj.set_language(folia_obj.language())
+        profiler = self.profiler
+        with profiler.stage('text') as stage:
+            self.raw = RawTextBuilder(*text_body_content(folia_obj))
+            for body in folia_obj.data:
+                self.visit(body, annotationtypes)
+            stage.count = self.word_count
+        with profiler.stage('raw'):
+            naf_obj.set_raw(self.raw.finish())
+        with profiler.stage('deps') as stage:
+            head2deps = self.dependencies_to_dependency_layer()
+            stage.count = len(self.annotations[folia.Dependency])
+        with profiler.stage('chunks') as stage:
+            self.chunking_to_chunks_layer(head2deps)
+            stage.count = len(self.annotations[folia.Chunk])
+        with profiler.stage('entities') as stage:
+            self.entities_to_entity_layer()
+            stage.count = len(self.annotations[folia.Entity])
+        with profiler.stage('header'):
+            self.header_to_header_layer()
+        return naf_obj
+
+    def create_processes_header(self):
+        '''
+        Function that adds all processors to NAF header
+        :return: None
+        '''
+        add_lps_to_header(self.naf_obj, self.text_header, 'text')
+        add_lps_to_header(self.naf_obj, self.term_header, 'terms')
+        add_lps_to_header(self.naf_obj, self.dep_header, 'deps')
+        add_lps_to_header(self.naf_obj, self.chunk_header, 'chunks')
+        add_lps_to_header(self.naf_obj, self.entity_header, 'entities')
+
+    def header_to_header_layer(self):
+        '''
+        Creates the NAF header from the FoLiA document and the annotators found
+        :return: None
+        '''
+        naf_header = naf.CHeader()
+        set_public_information(self.folia_obj, naf_header)
+        self.naf_obj.set_header(naf_header)
+        self.create_processes_header()
+
+        # TODO: add annotation information (as linguistic processes)
+
+    def create_span_from_folia_words(self, folia_word_list):
+        '''
+        Goes through list of folia words and identifies corresponding term id for each
+        :param folia_word_list: list of FoLiA word objects
+        :return: list of term ids
+        '''
+        naf_span = []
+        for word in folia_word_list:
+            naf_term_id = self.fid2tid.get(word.id)
+            naf_span.append(naf_term_id)
+        return naf_span
+
+    def set_folia_info(self, folia_word, term):
+        '''
+        Retrieves information from folia_word and adds this to term
+        :param folia_word: folia word object
+        :param term: naf term object
+        :return: None
+        '''
+        pos = folia_word.annotation(folia.PosAnnotation)
+        lemma = folia_word.annotation(folia.LemmaAnnotation)
+        term.set_morphofeat(pos.cls)
+        term.set_lemma(lemma.cls)
+        if not pos.annotator in self.term_header:
+            self.term_header[pos.annotator] = pos.datetime
+        if not lemma.annotator in self.term_header:
+            self.term_header[lemma.annotator] = lemma.datetime
+        #NAF pos tag corresponds to head (attribute's value) of pos element in FoLiA
+        #naf_pos = folia_word.xml().find('{http://ilk.uvt.nl/folia}pos').get('head')
+        naf_pos = pos.feat('head')
+        term.set_pos(naf_pos)
+
+    def get_and_add_term_information(self, folia_word, word_count):
+        '''
+        Retrieves term related information from folia word and adds a term
+        :param foliaWord: FoLiA word obj
+        :param word_count: count for term id/span
+        :return: naf term object
+        '''
+        naf_term = naf.Cterm()
+        # adding obligatory elements
+        term_id = 't' + str(word_count)
+        naf_term.set_id(term_id)
+        self.fid2tid[folia_word.id] = term_id
+        naf_span = create_span(['w' + str(word_count)])
+        naf_term.set_span(naf_span)
+        # add information from foliaWord
+        self.set_folia_info(folia_word, naf_term)
+        return naf_term
+
+    def word_to_naf(self, word, word_count, sent_nr, para_nr, annotationtypes):
+        '''
+        Converts a FoLiA word to a NAF token and, if there is part-of-speech annotation, a NAF term. The word is
+        added to the raw text.
+        :param word: FoLiA word obj
+        :param word_count: count for token and term id
+        :param sent_nr: NAF sentence number (str)
+        :param para_nr: NAF paragraph number (str)
+        :param annotationtypes: annotation types present in the folia document
+        :return: tuple of naf token and naf term (None if there is no term information)
+        '''
+        #for now (we can only capture tool and date any way)
+        if not word.annotator in self.text_header:
+            self.text_header[word.annotator] = word.datetime
+        naf_word = naf.Cwf()
+        offset, text = self.raw.add_word(word, para_nr)
+        set_word_info(naf_word, text, offset)
+        naf_word.set_id('w' + str(word_count))
+        naf_word.set_sent(sent_nr)
+        naf_word.set_para(para_nr)
+        naf_term = None
+        if folia.AnnotationType.POS in annotationtypes:
+        #change: only call this if term information is present
+            naf_term = self.get_and_add_term_information(word, word_count)
+        return naf_word, naf_term
+
+    def visit(self, element, annotationtypes, inparagraph=False, insentence=False):
+        '''
+        Walks the FoLiA tree below an element once, in document order, skipping non-authoritative elements like
+        select() does. Words in sentences in paragraphs are converted and passed to add_word(), dependencies, chunks
+        and entities are collected in self.annotations
+        :param element: FoLiA element to start from, it is visited too
+        :param annotationtypes: annotation types present in the folia document
+        :param inparagraph: whether the element is in a paragraph
+        :param insentence: whether the element is in a sentence in a paragraph
+        :return: None
+        '''
+        if isinstance(element, folia.Word):
+            if insentence:
+                self.word_count += 1
+                naf_word, naf_term = self.word_to_naf(element, self.word_count, str(self.naf_sent), str(self.naf_para), annotationtypes)
+                self.add_word(naf_word, naf_term)
+            return
+        elif isinstance(element, folia.AbstractSpanAnnotation):
+            #the words in span annotations are references, do not descend
+            if isinstance(element, self.span_annotations):
+                self.annotations[element.__class__].append(element)
+            return
+        elif isinstance(element, folia.Paragraph):
+            self.naf_para += 1
+            inparagraph = True
+        elif isinstance(element, folia.Sentence) and inparagraph:
+            self.naf_sent += 1
+            insentence = True
+        for child in element.data:
+            if isinstance(child, folia.AbstractElement) and not isinstance(child, self.leaf_elements) and getattr(child, 'auth', True):
+                self.visit(child, annotationtypes, inparagraph, insentence)
+
+    def add_word(self, naf_word, naf_term):
+        '''
+        Adds a converted word to the NAF document
+        :param naf_word: naf token object
+        :param naf_term: naf term object, None if there is no term information
+        :return: None
+        '''
+        self.naf_obj.add_wf(naf_word)
+        if naf_term is not None:
+            self.naf_obj.add_term(naf_term)
+
+    def dependency_to_naf(self, folia_dep):
+        '''
+        Converts a FoLiA dependency to a NAF dep element
+        :param folia_dep: FoLiA dependency obj
+        :return: naf dependency object
+        '''
+        if not folia_dep.annotator in self.dep_header:
+            self.dep_header[folia_dep.annotator] = folia_dep.datetime
+        head_span = self.create_span_from_folia_words(folia_dep.head().wrefs())
+        if len(head_span) > 1:
+            self.collector.warn('multitoken-dependency', 'Unknown situation: head consists of more than one tokens')
+        dep_span = self.create_span_from_folia_words(folia_dep.dependent().wrefs())
+        if len(dep_span) > 1:
+            self.collector.warn('multitoken-dependency', 'Situation not captured: dependent consists of more than one token')
+        naf_dep = naf.Cdependency()
+        naf_dep.set_from(head_span[0])
+        naf_dep.set_to(dep_span[0])
+        naf_dep.set_function(folia_dep.cls)
+        return naf_dep
+
+    def dependencies_to_dependency_layer(self):
+        '''
+        Turns all dependencies found in the folia document into NAF dep elements and adds them to NAF object
+        :return: dictionary of (NAF) head id to all its (NAF) dependents ids
+        '''
+        head2deps = defaultdict(list)
+        for folia_dep in self.annotations[folia.Dependency]:
+            naf_dep = self.dependency_to_naf(folia_dep)
+            self.naf_obj.add_dependency(naf_dep)
+            head2deps[naf_dep.get_from()].append(naf_dep.get_to())
+        return head2deps
+
+    def chunk_to_naf(self, chunk, chunk_id, head2deps):
+        '''
+        Converts a FoLiA chunk to a NAF chunk
+        :param chunk: FoLiA chunk obj
+        :param chunk_id: count for chunk id
+        :param head2deps: dictionary mapping heads to their dependents
+        :return: naf chunk object
+        '''
+        if not chunk.annotator in self.chunk_header:
+            self.chunk_header[chunk.annotator] = chunk.datetime
+        naf_chunk = naf.Cchunk()
+        naf_chunk.set_id('c' + str(chunk_id))
+        naf_span = self.create_span_from_folia_words(chunk.wrefs())
+        add_span_to_elem(naf_chunk, naf_span)
+        naf_chunk.set_phrase(chunk.cls)
+        chunk_head = identify_head_id(naf_span, head2deps, self.collector)
+        if chunk_head is not None:
+            naf_chunk.set_head(chunk_head)
+        return naf_chunk
+
+    def chunking_to_chunks_layer(self, head2deps):
+        '''
+        Converts the chunks found in the FoLiA document and adds them to NAF's chunk layer
+        :param head2deps: dictionary mapping heads to their dependents
+        :return: None
+        '''
+        chunk_id = 1
+        for chunk in self.annotations[folia.Chunk]:
+            self.naf_obj.add_chunk(self.chunk_to_naf(chunk, chunk_id, head2deps))
+            chunk_id += 1
+
+    def entity_to_naf(self, entity, entity_id):
+        '''
+        Converts a FoLiA entity to a NAF entity
+        :param entity: FoLiA entity obj
+        :param entity_id: count for entity id
+        :return: naf entity object
+        '''
+        if not entity.annotator in self.entity_header:
+            self.entity_header[entity.annotator] = entity.datetime
+        naf_entity = naf.Centity()
+        naf_entity.set_id('e' + str(entity_id))
+        naf_span = self.create_span_from_folia_words(entity.wrefs())
+        entity_references = naf.Creferences()
+        add_span_to_elem(entity_references, naf_span)
+        naf_entity.add_reference(entity_references)
+        naf_entity.set_type(entity.cls)
+        return naf_entity
+
+    def entities_to_entity_layer(self):
+        '''
+        Converts the entities found in the folia document and adds them to naf entity layer
+        :return: None
+        '''
+        entity_id = 1
+        for entity in self.annotations[folia.Entity]:
+            self.naf_obj.add_entity(self.entity_to_naf(entity, entity_id))
+            entity_id += 1
+
+
+def folia2naf(inputfolia, profiler=None, collector=None):
+    '''
+    Converts a FoLiA document to NAF
+    :param inputfolia: the FoLiA file to load (str), may be compressed (see naffoliapy.compression), or a ready folia.Document instance
+    :param profiler: a naffoliapy.profiling.Profiler that measures every stage of the conversion
+    :param collector: a naffoliapy.diagnostics.WarningCollector to add the warnings to, if not specified the first warnings of every kind are written to stderr
+    :return: naf object (KafNafParser)
+    '''
+    if profiler is None:
+        profiler = NULL_PROFILER
+    warnings = collector if collector is not None else WarningCollector(stream=sys.stderr)
+    if isinstance(inputfolia, folia.Document):
+        folia_obj = inputfolia
+    else:
+        with profiler.stage('load'):
+            folia_obj = load_folia(inputfolia)
+    naf_obj = FoLiA2NAFConverter(folia_obj, profiler, warnings).convert()
+    if collector is None:
+        warnings.flush()
+    return naf_obj
+
+
+def load_folia(inputfolia):
     '''
-    :param inputfolia: file
-    :return: None
+    Loads a FoLiA document, decompressing it if it is compressed
+    :param inputfolia: path to the FoLiA document (str)
+    :return: folia.Document instance
     '''
+    if compression.detect(inputfolia) is None:
+        return folia.Document(file=inputfolia)
+    with compression.open_input(inputfolia) as f:
+        return folia.Document(string=f.read())
 
-    # if no output name provided, output name is original filename with .naf extension
-    if outputnaf == None:
-        outputnaf = "".join([inputfolia, '.naf'])
 
-    folia_obj = folia.Document(file=inputfolia)
-    annotationtypes = check_overall_info(folia_obj)
-    # check what information is present and print warnings if not all can be handled (yet)
+def save_naf(naf_obj, outputnaf, compress=None):
+    '''
+    Saves a NAF document, compressed if asked for or if the filename has a compression extension
+    :param naf_obj: KafNafParser instance
+    :param outputnaf: path to the NAF output document (str) or a binary file object
+    :param compress: compression format ('gz', 'xz' or 'zst'), by default it follows the extension of the filename
+    '''
+    if compression.output_format(outputnaf, compress) is None:
+        naf_obj.dump(outputnaf)
+    else:
+        with compression.open_output(outputnaf, compress) as f:
+            naf_obj.dump(f)
 
 
-    naf_obj = KafNafParser(type='NAF')
-    if folia_obj.language() is not None:
-        naf_obj.set_language(folia_obj.language())
-    text_to_text_layer(folia_obj, naf_obj, annotationtypes)
-    add_raw_from_text_layer(naf_obj)
-    head2deps = dependencies_to_dependency_layer(folia_obj, naf_obj)
-    chunking_to_chunks_layer(folia_obj, naf_obj, head2deps)
-    entities_to_entity_layer(folia_obj, naf_obj)
-    header_to_header_layer(folia_obj, naf_obj)
-    naf_obj.dump(outputnaf)
+def folia2naf_bytes(payload, collector=None):
+    '''
+    Converts a FoLiA document held in memory, for pipe mode (see naffoliapy.pipe)
+    :param payload: the FoLiA document (bytes), may be compressed
+    :param collector: a naffoliapy.diagnostics.WarningCollector to add the warnings to, if not specified the first warnings of every kind are written to stderr
+    :return: the NAF document (bytes)
+    '''
+    naf_obj = folia2naf(folia.Document(string=compression.decompress(payload)), collector=collector)
+    output = io.BytesIO()
+    naf_obj.dump(output)
+    return output.getvalue()
+
+
+def preload():
+    #Imports the lazily imported modules (see naffoliapy.lazy) in a new batch worker process, so this does not count
+    #towards the time limit of its first document; using an attribute of such a module imports it
+    return naf.KafNafParser, folia.Document
+
+
+def convert_file_to_naf(inputfolia, outputnaf=None, stream=False, profiler=None, collector=None, cache=None, compress=None):
+    '''
+    :param inputfolia: file, may be compressed (see naffoliapy.compression)
+    :param outputnaf: output file, defaults to the input file (without a compression extension) with .naf extension
+    :param stream: convert one paragraph at a time with bounded memory use, see naffoliapy.foliastream
+    :param profiler: a naffoliapy.profiling.Profiler that measures every stage of the conversion, the streaming conversion is measured as a whole
+    :param collector: a naffoliapy.diagnostics.WarningCollector to add the warnings to, if not specified the first warnings of every kind are written to stderr
+    :param cache: a naffoliapy.cache.ConversionCache, the document is only converted if it is not in the cache yet
+    :param compress: compression format of the output ('gz', 'xz' or 'zst'), by default it follows the extension of the output filename
+    :return: summary of the warnings (dict, see WarningCollector.summary())
+    '''
+    if profiler is None:
+        profiler = NULL_PROFILER
+
+    # if no output name provided, output name is original filename with .naf extension
+    if outputnaf == None:
+        outputnaf = "".join([compression.split_extension(inputfolia)[0], '.naf', '.' + compress if compress else ''])
+
+    if cache is not None:
+        options = {'stream': bool(stream)}
+        if compression.output_format(outputnaf, compress):
+            options['compression'] = compression.output_format(outputnaf, compress)
+        key = cache.key(inputfolia, 'folia2naf', version, options)
+        metadata = cache.get(key, outputnaf)
+        if metadata is not None:
+            if collector is not None:
+                collector.update(metadata['warnings'])
+            return metadata['warnings']
+    warnings = collector if collector is not None else WarningCollector(stream=sys.stderr)
+
+    if stream:
+        from naffoliapy.foliastream import folia2naf_stream
+        with profiler.stage('stream'):
+            folia2naf_stream(inputfolia, outputnaf, warnings, compress)
+    else:
+        naf_obj = folia2naf(inputfolia, profiler, warnings)
+        with profiler.stage('serialize'):
+            save_naf(naf_obj, outputnaf, compress)
+    if collector is None:
+        warnings.flush()
+    if cache is not None:
+        cache.put(key, outputnaf, converter='folia2naf', input=inputfolia, warnings=warnings.summary())
+    return warnings.summary()
 
 
 def main(argv=None):
@@ -409,12 +708,152 @@ def main(argv=None):
     if argv == None:
         argv = sys.argv
 
+    parser = argparse.ArgumentParser(prog='folia2naf', description="FoLiA to NAF convertor")
+    parser.add_argument('files', metavar='file', nargs='*', help="FoLiA input document (- for stdin), optionally followed by the NAF output document, - for stdout (defaults to the input filename with .naf extension, or stdout when reading from stdin). In batch mode (--outputdir): any number of FoLiA documents, directories or glob patterns")
+    parser.add_argument('-O', '--outputdir', metavar='directory', default=None, help="Batch mode: convert all input documents and write them to this directory, mirroring the input tree")
+    parser.add_argument('-j', '--workers', type=int, default=None, help="Batch mode: number of worker processes (defaults to the number of CPUs)")
+    parser.add_argument('--extensions', default='.folia.xml,.xml', help="Batch mode: comma separated list of filename extensions of FoLiA documents to convert when searching directories")
+    parser.add_argument('--slowest', type=int, default=10, help="Batch mode: number of slowest documents to list in the summary")
+    parser.add_argument('--shard', metavar='i/N', default=None, help="Batch mode: only convert shard i of N shards (e.g. 1/4), to divide a corpus over several machines; every document is assigned to the same shard on every machine")
+    parser.add_argument('--timeout', type=float, default=None, help="Batch mode: maximum time in seconds to convert a single document, the worker process converting a document that takes longer is killed and replaced, and the document fails")
+    parser.add_argument('--max-memory', type=float, default=None, help="Batch mode: maximum memory use (resident set size) of a worker process in megabytes, a worker that uses more is killed and replaced, and the document it was converting fails (Linux only)")
+    parser.add_argument('--recycle', type=int, default=None, help="Batch mode: replace every worker process after it converted this number of documents, to cap slow growth of their memory use")
+    parser.add_argument('--quarantine', metavar='directory', default=None, help="Batch mode: copy the documents that hit --timeout or --max-memory, or crash their worker process, to this directory, with a log of the reasons")
+    parser.add_argument('--journal', metavar='journal.jsonl', default=None, help="Batch mode: record every converted document in this journal, and skip the documents it records whose input and output did not change since, so an interrupted conversion can be started again (use a journal per shard)")
+    parser.add_argument('--framed', choices=('nul', 'length'), default=None, help="Pipe mode: read a stream of FoLiA documents from stdin and write the NAF documents to stdout, every document followed by a NUL byte (nul) or preceded by its size in bytes and a newline (length)")
+    parser.add_argument('--stream', action='store_true', help="Convert one paragraph at a time and write the output as it goes, so memory use does not grow with the document size (for very large documents)")
+    parser.add_argument('--profile', metavar='report.json', default=None, help="Measure the time, number of elements and memory use of every stage of the conversion and write a report to this JSON file")
+    parser.add_argument('--warnings', metavar='warnings.json', default=None, help="Write a summary of the warnings, grouped and counted by category, to this JSON file rather than to stderr")
+    parser.add_argument('--max-warnings', type=int, default=10, help="Maximum number of different warnings to report per category")
+    parser.add_argument('--cache', metavar='directory', default=None, help="Cache the converted documents in this directory, documents that did not change since they were last converted with the same options are copied from the cache rather than converted again")
+    parser.add_argument('--cache-size', type=float, default=None, help="Maximum size of the cache in megabytes, the least recently used documents are removed when it grows larger")
+    parser.add_argument('--cache-link', action='store_true', help="Hard link documents from the cache rather than copying them (the output documents must then not be modified in place)")
+    parser.add_argument('--compress', choices=compression.FORMATS, default=None, help="Compress the NAF output with gzip (gz), xz or zstandard (zst). Output filenames ending in .gz, .xz or .zst are compressed without this option, compressed input is always recognised")
+
     if len(argv) < 2:
-        print('python folia2naf.py folia_input.xml (naf_output.xml)')
-    elif len(argv) < 3:
-        convert_file_to_naf(argv[1])
+        parser.print_usage()
+        return
+    args = parser.parse_args(argv[1:])
+
+    if args.outputdir:
+        if args.framed or args.profile or args.warnings:
+            parser.error("--framed, --profile and --warnings can not be used in batch mode")
+        if args.shard:
+            from naffoliapy.batch import parse_shard
+            try:
+                args.shard = parse_shard(args.shard)
+            except ValueError as e:
+                parser.error(str(e))
+        if args.max_memory:
+            from naffoliapy.supervisor import memory_supported
+            if not memory_supported():
+                parser.error("--max-memory is not supported on this system")
+        batch_main(args)
+        return
+    elif args.shard or args.journal or args.timeout or args.max_memory or args.recycle or args.quarantine:
+        parser.error("--shard, --journal, --timeout, --max-memory, --recycle and --quarantine can only be used in batch mode (--outputdir)")
+    if len(args.files) > 2:
+        parser.error("Expected a FoLiA input document and optionally a NAF output document, use --outputdir to convert multiple documents")
+    args.inputfolia = args.files[0] if args.files else '-'
+    args.outputnaf = args.files[1] if len(args.files) > 1 else None
+
+    profiler = Profiler() if args.profile else None
+    collector = WarningCollector(args.max_warnings, None if args.warnings else sys.stderr)
+
+    if args.framed:
+        if args.inputfolia != '-' or args.outputnaf not in (None, '-'):
+            parser.error("--framed reads the FoLiA documents from stdin and writes the NAF documents to stdout")
+        if args.stream or args.profile or args.warnings or args.cache:
+            parser.error("--framed can not be combined with --stream, --profile, --warnings or --cache")
+        if args.compress and args.framed != 'length':
+            parser.error("--compress requires --framed length, compressed documents may contain NUL bytes")
+        from naffoliapy.pipe import convert_frames
+        documents, failures = convert_frames(lambda payload, number: compression.compress(folia2naf_bytes(payload, collector), args.compress), args.framed)
+        collector.flush()
+        if failures:
+            print(str(failures) + " of " + str(documents) + " documents failed", file=sys.stderr)
+            sys.exit(1)
+        return
+
+    if args.inputfolia == '-' or args.outputnaf == '-':
+        if args.cache:
+            parser.error("--cache requires a FoLiA input document and a NAF output document")
+        pipe_main(args, profiler, collector)
+    else:
+        convert_file_to_naf(args.inputfolia, args.outputnaf, args.stream, profiler, collector, _cache(args), args.compress)
+    collector.flush()
+    if args.warnings:
+        collector.save(args.warnings)
+    if profiler is not None:
+        profiler.save(args.profile, converter='folia2naf', document=args.inputfolia)
+
+
+def _cache(args):
+    if not args.cache:
+        return None
+    from naffoliapy.cache import ConversionCache
+    return ConversionCache(args.cache, int(args.cache_size * 1024 * 1024) if args.cache_size else None, args.cache_link)
+
+def batch_main(args):
+    from naffoliapy import batch
+
+    extensions = tuple( extension.strip() for extension in args.extensions.split(',') if extension.strip() )
+    outputextension = '.naf' + ('.' + args.compress if args.compress else '')
+    inputs = batch.collect_inputs(args.files, extensions)
+    if not inputs:
+        print("No input documents found",file=sys.stderr)
+        sys.exit(2)
+    if args.shard:
+        inputs = batch.select_shard(inputs, *args.shard)
+    jobs = [ (inputfolia, batch.output_path(relpath, args.outputdir, ('.folia.xml',) + extensions, outputextension)) for inputfolia, relpath in inputs ]
+
+    journal = None
+    if args.journal:
+        from naffoliapy.journal import Journal
+        journal = Journal(args.journal, {'converter': 'folia2naf', 'version': version, 'stream': bool(args.stream)})
+        pending = journal.pending(jobs)
+        if len(pending) < len(jobs):
+            print("Skipping " + str(len(jobs) - len(pending)) + " documents converted earlier (" + args.journal + ")",file=sys.stderr)
+        jobs = pending
+
+    quarantine = None
+    if args.quarantine:
+        from naffoliapy.supervisor import Quarantine
+        quarantine = Quarantine(args.quarantine)
+
+    begintime = time.time()
+    function = functools.partial(convert_file_to_naf, stream=args.stream, cache=_cache(args), compress=args.compress)
+    try:
+        results = batch.convert_batch(jobs, function, args.workers, journal, args.timeout, int(args.max_memory * 1024 * 1024) if args.max_memory else None, args.recycle, quarantine, preload)
+    finally:
+        if journal is not None:
+            journal.close()
+    batch.print_summary(results, time.time() - begintime, args.slowest)
+    if any( error is not None for _, _, _, error in results ):
+        sys.exit(1)
+
+
+def pipe_main(args, profiler, collector):
+    #Converts a single document from stdin and/or to stdout
+    from naffoliapy.pipe import stdin, stdout, spooled
+    if profiler is None:
+        profiler = NULL_PROFILER
+    output = stdout() if args.outputnaf in (None, '-') else args.outputnaf
+    if args.stream:
+        from naffoliapy.foliastream import folia2naf_stream
+        with profiler.stage('stream'):
+            if args.inputfolia == '-':
+                #the streaming conversion reads the document more than once
+                with spooled(stdin()) as inputfolia:
+                    folia2naf_stream(inputfolia, output, collector, args.compress)
+            else:
+                folia2naf_stream(args.inputfolia, output, collector, args.compress)
     else:
-        convert_file_to_naf(argv[1], argv[2])
+        with profiler.stage('load'):
+            folia_obj = folia.Document(string=compression.decompress(stdin().read())) if args.inputfolia == '-' else load_folia(args.inputfolia)
+        naf_obj = folia2naf(folia_obj, profiler, collector)
+        with profiler.stage('serialize'):
+            save_naf(naf_obj, output, args.compress)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,271 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+
+'''
+Streaming FoLiA to NAF conversion. Rather than loading the whole FoLiA document, it is read one paragraph at
+a time with pynlpl's incremental reader, and the NAF tokens, terms, dependencies, chunks and entities of every
+paragraph are written out as soon as the paragraph has been converted. Every NAF layer is written to its own
+temporary file, the layers are put together when the whole document has been read.
+
+Only the mapping from FoLiA word ids to NAF term ids of the current paragraph is kept. Annotation layers that
+are not part of a paragraph (text-level layers) are found by a first pass over the document, the words they
+refer to are remembered while streaming, and they are converted after all paragraphs.
+'''
+
+from __future__ import print_function, unicode_literals, division, absolute_import
+
+import sys
+import shutil
+import tempfile
+from collections import defaultdict
+
+from lxml import etree
+from KafNafParserPy import KafNafParser
+from pynlpl.formats import folia
+
+from naffoliapy.folia2naf import FoLiA2NAFConverter, RawTextBuilder, SPAN_ANNOTATIONS, folia_classes, check_version, retrieve_annotation_layers
+from naffoliapy.nafstream import _forget
+from naffoliapy.diagnostics import WarningCollector
+from naffoliapy import compression
+
+
+#NAF layers written while streaming, in the order they appear in the output
+NAF_LAYERS = ('text', 'terms', 'deps', 'chunks', 'entities')
+
+
+def find_outer_annotations(inputfolia):
+    '''
+    Finds dependencies, chunks and entities that are not part of a paragraph, the text content of the text body and
+    the FoLiA version of the document
+    :param inputfolia: path to the FoLiA document
+    :return: tuple of a list of lxml elements (detached from the document), the set of word ids they refer to,
+    a tuple of the lxml text content element and the id of the text body (None if the text body has no text content),
+    and the version attribute of the root element (None if it has none)
+    '''
+    tags = dict( ('{' + folia.NSFOLIA + '}' + Class.XMLTAG, Class) for Class in folia_classes(SPAN_ANNOTATIONS) )
+    paragraph = '{' + folia.NSFOLIA + '}' + folia.Paragraph.XMLTAG
+    wref = '{' + folia.NSFOLIA + '}' + folia.WordReference.XMLTAG
+    text = '{' + folia.NSFOLIA + '}' + folia.Text.XMLTAG
+    t = '{' + folia.NSFOLIA + '}' + folia.TextContent.XMLTAG
+    elements = []
+    word_ids = set()
+    textcontent = None
+    version = None
+    inparagraph = 0
+    inannotation = 0
+    for event, node in etree.iterparse(inputfolia, events=('start', 'end')):
+        if event == 'start':
+            if node.getparent() is None:
+                #folia.Reader sets a version on the document it builds, the warnings need the one in the input
+                version = node.get('version')
+            elif node.tag == paragraph:
+                inparagraph += 1
+            elif node.tag in tags:
+                inannotation += 1
+            continue
+        if node.tag == paragraph:
+            inparagraph -= 1
+        elif node.tag in tags:
+            inannotation -= 1
+        if inparagraph or inannotation:
+            #removed along with the paragraph or annotation it is part of
+            continue
+        if node.tag in tags:
+            elements.append(node)
+            word_ids.update( wrefnode.get('id') for wrefnode in node.iter(wref) )
+        elif node.tag == t and textcontent is None and node.getparent().tag == text and node.get('class', 'current') == 'current':
+            textcontent = (node, node.getparent().get('{http://www.w3.org/XML/1998/namespace}id'))
+        else:
+            node.clear()
+        if node.getparent() is not None:
+            node.getparent().remove(node)
+    return elements, word_ids, textcontent, version
+
+
+def _serialize(naf_elem):
+    return etree.tostring(naf_elem.get_node(), encoding='UTF-8', pretty_print=True)
+
+def _copy_cdata(source, f, chunksize=65536):
+    #Copies text into a CDATA section. CDATA sections can not contain their own end marker, the section is split
+    #there; a ']' at the end of a chunk is held back in case the marker continues in the next chunk
+    f.write(b'<![CDATA[')
+    carry = ''
+    while True:
+        chunk = source.read(chunksize)
+        text = carry + chunk
+        carry = ''
+        if chunk:
+            while text.endswith(']') and len(carry) < 2:
+                carry = ']' + carry
+                text = text[:-1]
+        f.write(text.replace(']]>', ']]]]><![CDATA[>').encode('utf-8'))
+        if not chunk:
+            break
+    f.write(b']]>')
+
+
+class StreamingFoLiA2NAFConverter(FoLiA2NAFConverter):
+    '''
+    Converts a single FoLiA document to NAF one paragraph at a time, writing the NAF layers as it goes.
+    The output is the same as that of FoLiA2NAFConverter, except that annotation layers outside paragraphs
+    are always converted after the paragraphs.
+    '''
+
+    def __init__(self, inputfolia, collector=None):
+        '''
+        :param inputfolia: path to the FoLiA input document
+        :param collector: a naffoliapy.diagnostics.WarningCollector to add the warnings to, every warning is written to stderr if not specified
+        '''
+        self.inputfolia = inputfolia
+        self.reader = folia.Reader(inputfolia, folia.Paragraph)
+        FoLiA2NAFConverter.__init__(self, self.reader.doc, collector=collector)
+
+        #head to dependents for the terms of the current paragraph
+        self.head2deps = defaultdict(list)
+        self.chunk_count = 0
+        self.entity_count = 0
+
+        #temporary files the NAF layers are written to during the conversion
+        self.layers = None
+
+    def convert(self, outputnaf, compress=None):
+        '''
+        Converts the FoLiA document
+        :param outputnaf: path to the NAF output document or a binary file object
+        :param compress: compression format of the output ('gz', 'xz' or 'zst'), by default it follows the extension of the output filename
+        :return: None
+        '''
+        if self.naf_obj is not None:
+            raise RuntimeError("Converter has already been used, create a new StreamingFoLiA2NAFConverter for every document")
+
+        outer_elements, outer_word_ids, textcontent, version = find_outer_annotations(self.inputfolia)
+        check_version(version, self.collector)
+        annotationtypes = retrieve_annotation_layers(self.folia_obj)
+        #only the header and the root element are built in memory
+        self.naf_obj = naf_obj = KafNafParser(type='NAF')
+        if self.folia_obj.language() is not None:
+            naf_obj.set_language(self.folia_obj.language())
+
+        outer_head2deps = defaultdict(list)
+
+        self.layers = layers = dict( (layername, tempfile.TemporaryFile()) for layername in NAF_LAYERS )
+        raw = tempfile.TemporaryFile(mode='w+', encoding='utf-8')
+        try:
+            if textcontent is not None:
+                node, textid = textcontent
+                self.raw = RawTextBuilder(folia.TextContent.parsexml(node, self.folia_obj).text(), textid, out=raw)
+            else:
+                self.raw = RawTextBuilder(out=raw)
+
+            for para in self.reader:
+                self.visit(para, annotationtypes)
+                self.convert_annotations(*( self.annotations[Class] for Class in self.span_annotations ), layers=layers)
+                for annotations in self.annotations.values():
+                    del annotations[:]
+
+                #keep what the annotations outside paragraphs will need, forget everything else
+                outer_term_ids = set()
+                for word_id in list(self.fid2tid):
+                    if word_id in outer_word_ids:
+                        outer_term_ids.add(self.fid2tid[word_id])
+                    else:
+                        del self.fid2tid[word_id]
+                for head, deps in self.head2deps.items():
+                    if head in outer_term_ids:
+                        outer_head2deps[head] += deps
+                self.head2deps = defaultdict(list)
+                _forget(para, self.folia_obj)
+
+            if outer_elements:
+                self.head2deps = outer_head2deps
+                annotations = [ folia.XML2CLASS[etree.QName(node).localname].parsexml(node, self.folia_obj) for node in outer_elements ]
+                self.convert_annotations(*( [ annotation for annotation in annotations if isinstance(annotation, Class) ] for Class in self.span_annotations ), layers=layers)
+
+            self.raw.finish()
+            self.header_to_header_layer()
+            self.write(outputnaf, raw, layers, compress)
+        finally:
+            raw.close()
+            for layer in layers.values():
+                layer.close()
+
+    def add_word(self, naf_word, naf_term):
+        '''
+        Writes a converted word to the text and terms layers
+        :param naf_word: naf token object
+        :param naf_term: naf term object, None if there is no term information
+        :return: None
+        '''
+        self.layers['text'].write(_serialize(naf_word))
+        if naf_term is not None:
+            self.layers['terms'].write(_serialize(naf_term))
+
+    def convert_annotations(self, dependencies, chunks, entities, layers):
+        '''
+        Converts dependencies, chunks and entities and writes them to their layers
+        :param dependencies: FoLiA dependencies
+        :param chunks: FoLiA chunks
+        :param entities: FoLiA entities
+        :param layers: dictionary of NAF layer name to the temporary file it is written to
+        :return: None
+        '''
+        for folia_dep in dependencies:
+            naf_dep = self.dependency_to_naf(folia_dep)
+            layers['deps'].write(_serialize(naf_dep))
+            self.head2deps[naf_dep.get_from()].append(naf_dep.get_to())
+        for chunk in chunks:
+            self.chunk_count += 1
+            layers['chunks'].write(_serialize(self.chunk_to_naf(chunk, self.chunk_count, self.head2deps)))
+        for entity in entities:
+            self.entity_count += 1
+            layers['entities'].write(_serialize(self.entity_to_naf(entity, self.entity_count)))
+
+    def write(self, outputnaf, raw, layers, compress=None):
+        '''
+        Writes the NAF document: the header, followed by the raw text and the layers written so far
+        :param outputnaf: path to the NAF output document or a binary file object
+        :param raw: temporary file holding the raw text
+        :param layers: dictionary of NAF layer name to the temporary file it is written to
+        :param compress: compression format of the output, see convert()
+        :return: None
+        '''
+        root = self.naf_obj.root
+        placeholder = etree.Comment('body')
+        root.append(placeholder)
+        head, tail = etree.tostring(self.naf_obj.tree, encoding='UTF-8', pretty_print=True, xml_declaration=True).split(etree.tostring(placeholder))
+        root.remove(placeholder)
+
+        f = compression.open_output(outputnaf, compress)
+        try:
+            f.write(head.rstrip() + b'\n')
+            raw.seek(0)
+            f.write(b'<raw>')
+            _copy_cdata(raw, f)
+            f.write(b'</raw>\n')
+            for layername in NAF_LAYERS:
+                layer = layers[layername]
+                if layer.tell() == 0:
+                    continue
+                f.write(b'<' + layername.encode('ascii') + b'>\n')
+                layer.seek(0)
+                shutil.copyfileobj(layer, f)
+                f.write(b'</' + layername.encode('ascii') + b'>\n')
+            f.write(tail.lstrip())
+        finally:
+            f.close()
+
+
+def folia2naf_stream(inputfolia, outputnaf, collector=None, compress=None):
+    '''
+    Converts a FoLiA document to NAF one paragraph at a time
+    :param inputfolia: path to the FoLiA input document, may be compressed (see naffoliapy.compression)
+    :param outputnaf: path to the NAF output document or a binary file object
+    :param collector: a naffoliapy.diagnostics.WarningCollector to add the warnings to, if not specified the first warnings of every kind are written to stderr
+    :param compress: compression format of the output ('gz', 'xz' or 'zst'), by default it follows the extension of the output filename
+    :return: None
+    '''
+    warnings = collector if collector is not None else WarningCollector(stream=sys.stderr)
+    with compression.decompressed(inputfolia) as source:
+        StreamingFoLiA2NAFConverter(source, warnings).convert(outputnaf, compress)
+    if collector is None:
+        warnings.flush()
@@ -0,0 +1,535 @@
+#!/usr/bin/env python
+#-*- coding:utf-8 -*-
+
+# Direct NAF2FoLiA Converter
+# Licensed under GPLv3
+
+"""
+NAF to FoLiA conversion that writes the FoLiA XML straight from the NAF document, for when only the FoLiA document
+is needed and not the FoLiA objects (``--direct``). The FoLiA document is never built as pynlpl objects and never
+serialised afterwards: the text, paragraphs, sentences, words and their token annotations are written from the
+token table of the NAF document (see naf2folia.TokenTable), sentence by sentence, as the output goes.
+
+The other layers are converted by the same functions as in naf2folia, with the same sets, IDs and warnings, but onto
+light nodes (Node) that hold no more than what is written; their words are token indices. Only the header (the
+declarations and metadata) is serialised by pynlpl, from a bare FoLiA document that holds no more than the raw text.
+
+The output is the same document, byte for byte, as that of naf2folia(), including the order pynlpl gives the words
+of a span annotation, the words a semantic role takes from its predicate, and which sets are left out as the only
+one declared for their annotation type. The checks pynlpl makes as elements are added (valid and unique IDs,
+declared sets, one part-of-speech tag per set per word) are made as well.
+"""
+
+from __future__ import print_function, unicode_literals, division, absolute_import
+
+import sys
+
+from lxml import etree
+import KafNafParserPy as naf
+from pynlpl.formats import folia
+
+from naffoliapy import naf2folia as n2f
+from naffoliapy import compression
+from naffoliapy.nafstream import XLINK, _unprefix
+from naffoliapy.profiling import NULL_PROFILER
+from naffoliapy.diagnostics import WarningCollector
+
+TEXT_ESCAPES = { ord('&'): '&amp;', ord('<'): '&lt;', ord('>'): '&gt;', ord('\r'): '&#13;' }
+ATTRIBUTE_ESCAPES = dict(TEXT_ESCAPES)
+ATTRIBUTE_ESCAPES.update({ ord('"'): '&quot;', ord('\n'): '&#10;', ord('\t'): '&#9;' })
+
+#names of the namespaced attributes of pynlpl's XML, as written
+ATTRIBUTE_NAMES = {
+    '{http://www.w3.org/XML/1998/namespace}': 'xml:',
+    '{' + XLINK + '}': 'xlink:',
+    '{' + folia.NSFOLIA + '}': '',
+}
+
+INDENT = '  '
+
+
+def _text(value):
+    return value.translate(TEXT_ESCAPES)
+
+def _attribute(value):
+    return value.translate(ATTRIBUTE_ESCAPES)
+
+
+class Paragraph(object):
+    """A paragraph of the text: its ID, its sentences and the index of its first token"""
+
+    __slots__ = ('id', 'sentences', 'start')
+
+    def __init__(self, id):
+        self.id = id
+        self.sentences = []
+        self.start = None
+
+class Sentence(object):
+    """A sentence of the text: its ID, the index of its first token and the paragraph it is in (None if none)"""
+
+    __slots__ = ('id', 'start', 'end', 'parent')
+
+    def __init__(self, id, start, parent):
+        self.id = id
+        self.start = start
+        self.end = start
+        self.parent = parent
+
+
+class Node(object):
+    """
+    An element in an annotation layer (the layer itself, a span annotation, a feature, an alignment...) or a sense
+    annotation on a word, with just what is needed to write it. It takes the place of the pynlpl element for the
+    layer converters of naf2folia, which only add() to it. The words of a span annotation are token indices.
+    """
+
+    __slots__ = ('conversion', 'tag', 'type', 'id', 'attribs', 'children', 'text', 'parent', 'span')
+
+    def __init__(self, conversion, tag, type=None, id=None, attribs=(), parent=None, span=False):
+        self.conversion = conversion
+        self.tag = tag
+        self.type = type #annotation type, to leave out the set if it is the only one declared
+        self.id = id
+        self.attribs = attribs #list of (name, value) tuples, in order
+        self.children = [] #Nodes, token indices and pynlpl elements
+        self.text = None
+        self.parent = parent
+        self.span = span
+
+    @property
+    def doc(self):
+        return self.conversion.foliadoc
+
+    def add(self, Class, *args, **kwargs):
+        """Adds an element of the given pynlpl class, with the same arguments as pynlpl's add(), returns it"""
+        return self.conversion.create(self, Class, *args, **kwargs)
+
+
+class LayerNodes(n2f.LayerRegistry):
+    """The annotation layers of the sentences and the text body, as Nodes"""
+
+    def __init__(self, conversion):
+        super(LayerNodes, self).__init__()
+        self.conversion = conversion
+
+    def get(self, element, Class, set):
+        key = (element.id, Class, set)
+        layer = self.layers.get(key)
+        if layer is None:
+            layer = self.layers[key] = Node(self.conversion, Class.XMLTAG)
+            self.conversion.layers.setdefault(element.id, []).append(layer)
+        return layer
+
+class DirectResolver(n2f.NAFResolver):
+    """NAFResolver for the direct conversion, it resolves the NAF IDs to token indices and sentences to Sentences"""
+
+    def __init__(self, conversion, exrefs):
+        self.words = conversion.token_index
+        self.sentences = conversion.sentence_of
+        self.terms = {}
+        self.term_tokens = {}
+        self.layers = LayerNodes(conversion)
+        self.exrefs = exrefs
+        for term in conversion.table.terms:
+            if all( w_id in self.words for w_id in term.span ):
+                self.terms[term.id] = [ self.words[w_id] for w_id in term.span ]
+            else:
+                self.terms[term.id] = None
+                self.term_tokens[term.id] = list(term.span)
+
+    def sentence(self, word):
+        return self.sentences[word]
+
+
+class DirectConversion(object):
+    """
+    The state of the direct conversion of one NAF document: what has been collected to write the FoLiA document,
+    and the bare FoLiA document that holds its declarations and metadata
+    """
+
+    def __init__(self, nafparser, docid, collector):
+        self.collector = collector
+        self.table = n2f.token_table(nafparser)
+        self.token_index = dict( (token_id, index) for index, token_id in enumerate(self.table.ids) ) #token id => index
+        self.raw = nafparser.get_raw()
+
+        self.foliadoc = folia.Document(id=docid)
+        self.foliadoc.declare(folia.Word, 'undefined')
+        self.foliadoc.declare(folia.Sentence, 'undefined')
+        self.foliadoc.metadata['language'] = nafparser.get_language()
+        n2f.convert_metadata(nafparser.get_header(), self.foliadoc)
+        self.textbody = self.foliadoc.append(folia.Text(self.foliadoc, id=self.foliadoc.id+'.text'))
+        if self.raw:
+            self.textbody.append(folia.TextContent, self.raw)
+
+        self.ids = set([self.textbody.id]) #IDs in use
+        self.blocks = [] #Paragraphs and Sentences in the text body
+        self.sentence_of = [] #Sentence per token
+        self.offsets = bytearray() #1 per token whose offset is written
+        self.annotations = {} #token index => token annotations, as (tag, annotation type, set, class) tuples or Nodes
+        self.layers = {} #sentence or text body id => annotation layers (Nodes)
+        #the first token the search for the order of the words of a span in the text body reaches, pynlpl's search
+        #stops at the raw text before it reaches any
+        self.first = None if self.raw else 0
+        self.defaults = {}
+
+    def register(self, id):
+        """Checks a new ID like pynlpl does, returns it"""
+        folia.isncname(id)
+        if id in self.ids:
+            raise folia.DuplicateIDError("Duplicate ID not permitted: " + id)
+        self.ids.add(id)
+        return id
+
+    def convert_text(self, nafparser, foliadoc):
+        """Collects the paragraphs, sentences and words, like naf2folia.convert_text_layer()"""
+        table = self.table
+        labels = table.labels
+        raw = self.raw
+        collector = self.collector
+        prevsent = 0
+        prevpara = 0
+        paragraph = None
+        for index in range(len(table)):
+            para = table.paragraphs[index]
+            sent = table.sentences[index]
+            if para != prevpara:
+                if prevpara == 0:
+                    #first paragraph, declare for completion's sake
+                    foliadoc.declare(folia.Paragraph, 'undefined')
+                paragraph = Paragraph(self.register(foliadoc.id+ '.para' + labels[para]))
+                self.blocks.append(paragraph)
+            if sent != prevsent:
+                sentence = Sentence(self.register(foliadoc.id+ '.sent' + labels[sent]), index, paragraph)
+                if paragraph is not None:
+                    if not paragraph.sentences:
+                        paragraph.start = index
+                    paragraph.sentences.append(sentence)
+                else:
+                    self.blocks.append(sentence)
+            sentence.end = index + 1
+            self.sentence_of.append(sentence)
+
+            token_id = table.ids[index]
+            text = table.texts[index]
+            self.register(foliadoc.id + '.' + token_id)
+            offset_valid = False
+            if raw:
+                offset = table.offsets[index]
+                length = table.lengths[index]
+                try:
+                    offset_valid = offset >= 0 and length >= 0 and raw[offset+length] == text
+                except IndexError:
+                    offset_valid = False
+                if not offset_valid:
+                    collector.warn('misaligned-offset', "NAF error: offset for token " + token_id +" does not align properly with raw layer! Discarding offset information for FoLiA conversion")
+            if text is None:
+                raise ValueError("Unable to append object of type NoneType to TextContent. Type not allowed as child.")
+            self.offsets.append(offset_valid)
+
+            prevpara = para
+            prevsent = sent
+
+    def convert_terms(self, nafparser, foliadoc, exrefs):
+        """Collects the token annotations of the terms, like naf2folia.convert_term()"""
+        for term in self.table.terms:
+            if len(term.span) > 1:
+                #NAF term spans multiple tokens
+                exrefs.collector.warn('multitoken-term', "Convertor limitation: NAF term " + term.id + " spans multiple tokens. Conversion not supported yet!")
+                continue
+            index = self.token_index.get(term.span[0])
+            if index is None:
+                raise KeyError(foliadoc.id + '.' + term.span[0])
+            annotations = self.annotations.setdefault(index, [])
+
+            if term.pos:
+                if not foliadoc.declared(folia.PosAnnotation, n2f.POS_SET):
+                    foliadoc.declare(folia.PosAnnotation, n2f.POS_SET)
+                self.add_pos(index, annotations, n2f.POS_SET, term.pos)
+            if term.morphofeat:
+                if not foliadoc.declared(folia.PosAnnotation, n2f.MORPHOFEAT_SET):
+                    foliadoc.declare(folia.PosAnnotation, n2f.MORPHOFEAT_SET)
+                self.add_pos(index, annotations, n2f.MORPHOFEAT_SET, term.morphofeat)
+            if term.lemma:
+                if not foliadoc.declared(folia.LemmaAnnotation, n2f.LEMMA_SET):
+                    foliadoc.declare(folia.LemmaAnnotation, n2f.LEMMA_SET)
+                #added without a set, so it gets the only one declared
+                annotations.append(('lemma', folia.AnnotationType.LEMMA, self.default_set(folia.LemmaAnnotation, term.lemma), term.lemma))
+
+            if term.node is not None:
+                naf_term = naf.term_data.Cterm(term.node)
+                word = Node(self, folia.Word.XMLTAG, id=foliadoc.id + '.' + term.span[0])
+                n2f.convert_senses(naf_term, word, exrefs)
+                n2f.convert_sentiment(naf_term, word, exrefs.collector)
+                annotations.extend(word.children)
+
+    def add_pos(self, index, annotations, posset, cls):
+        if any( annotation[0] == 'pos' and annotation[2] == posset for annotation in annotations if isinstance(annotation, tuple) ):
+            raise folia.DuplicateAnnotationError("Unable to add another object of set " + posset + " and type PosAnnotation to Word  (id=" + self.foliadoc.id + '.' + self.table.ids[index] + "). There are already 1 instances of this class, which is the maximum for the set.")
+        annotations.append(('pos', folia.AnnotationType.POS, posset, cls))
+
+    def resolver(self, nafparser, foliadoc, exrefs):
+        """Returns the resolver for the layer converters, called like NAFResolver()"""
+        return DirectResolver(self, exrefs)
+
+    def default_set(self, Class, cls=None):
+        #the set pynlpl gives an element that is created without one
+        sets = self.foliadoc.annotationdefaults.get(Class.ANNOTATIONTYPE)
+        if sets is not None and len(sets) == 1:
+            return next(iter(sets))
+        if cls:
+            raise ValueError("Set is required for " + Class.__name__ +  ". Class '" + cls + "' assigned without set.")
+        return None
+
+    def attributes(self, Class, attribs, kwargs):
+        #the attributes pynlpl writes for an element created with these arguments, in its order
+        if kwargs.get('id') is not None:
+            attribs.append(('xml:id', self.register(kwargs['id'])))
+        cls = kwargs.get('cls', kwargs.get('class'))
+        if 'set' in kwargs:
+            set = kwargs['set'] or 'undefined'
+            if set not in self.foliadoc.annotationdefaults.get(Class.ANNOTATIONTYPE, ()):
+                raise ValueError("Set '" + set + "' is used for " + Class.__name__ + ", but has no declaration!")
+        else:
+            set = self.default_set(Class, cls)
+        if set:
+            attribs.append(('set', set))
+        if cls:
+            attribs.append(('class', cls))
+        confidence = kwargs.get('confidence')
+        if confidence is not None:
+            try:
+                confidence = float(confidence)
+            except (TypeError, ValueError):
+                confidence = -1
+            if not 0.0 <= confidence <= 1.0:
+                raise ValueError("Confidence must be a floating point number between 0 and 1, got " + repr(kwargs['confidence']) )
+            if confidence:
+                attribs.append(('confidence', str(confidence)))
+        if kwargs.get('href'):
+            attribs.append(('xlink:href', kwargs['href']))
+            attribs.append(('xlink:type', 'simple'))
+        return attribs
+
+    def create(self, parent, Class, *args, **kwargs):
+        """Adds an element to a Node, see Node.add()"""
+        if issubclass(Class, (folia.AbstractSpanAnnotation, folia.AbstractTokenAnnotation, folia.Alignment)):
+            attribs = []
+            if Class is folia.Alignment and kwargs.get('format', 'text/folia+xml') != 'text/folia+xml':
+                attribs.append(('format', kwargs['format']))
+            span = issubclass(Class, folia.AbstractSpanAnnotation)
+            node = Node(self, Class.XMLTAG, Class.ANNOTATIONTYPE, kwargs.get('id'), self.attributes(Class, attribs, kwargs), parent, span)
+            if span:
+                for word in args:
+                    self.insert_word(node.children, word)
+        elif Class is folia.Feature:
+            attribs = [('subset', kwargs['subset'])] if kwargs.get('subset') != Class.SUBSET else []
+            attribs.append(('class', kwargs.get('cls', kwargs.get('class'))))
+            node = Node(self, Class.XMLTAG, attribs=attribs, parent=parent)
+        elif Class is folia.AlignReference:
+            attribs = [('id', kwargs['id'])]
+            for name in ('type', 't'):
+                if kwargs.get(name):
+                    attribs.append((name, kwargs[name]))
+            node = Node(self, 'aref', attribs=attribs, parent=parent)
+        elif Class is folia.Comment:
+            node = Node(self, Class.XMLTAG, attribs=self.attributes(Class, [], kwargs), parent=parent)
+            node.text = kwargs.get('value') or ''
+        else:
+            #whatever else a resource handler adds is created by pynlpl and written from its XML
+            node = Class(self.foliadoc, *args, **kwargs)
+        parent.children.append(node)
+        if isinstance(node, Node) and node.span:
+            #like pynlpl, the words of a span annotation are taken out of the span annotations it is in
+            e = parent
+            while isinstance(e, Node) and e.span:
+                for word in node.children:
+                    try:
+                        e.children.remove(word)
+                    except ValueError:
+                        pass
+                e = e.parent
+        return node
+
+    def first_word(self, a, b):
+        #the first token pynlpl's search reaches in the closest element that holds both tokens, None if it stops first
+        sentence = self.sentence_of[a]
+        other = self.sentence_of[b]
+        if sentence is other:
+            return sentence.start
+        elif sentence.parent is not None and sentence.parent is other.parent:
+            return sentence.parent.start
+        return self.first
+
+    def insert_word(self, words, word):
+        #pynlpl inserts every word of a span before the last word that does not precede it according to a search
+        #that gives up at the first text it meets, which leaves the words in a peculiar order
+        point = len(words)
+        for i, sibling in enumerate(words):
+            if sibling != word and self.first_word(sibling, word) == word:
+                point = i
+        words.insert(point, word)
+
+    def write(self, output, compress=None):
+        """
+        Writes the FoLiA document
+        :param output: path to the FoLiA output document (str) or a binary file object
+        :param compress: compression format of the output ('gz', 'xz' or 'zst'), by default it follows the extension of the output filename
+        """
+        #the sets that are left out, as the only one declared for their annotation type
+        self.defaults = dict( (annotationtype, next(iter(sets))) for annotationtype, sets in self.foliadoc.annotationdefaults.items() if len(sets) == 1 )
+        textlayers = self.layers.get(self.textbody.id, [])
+
+        root = self.foliadoc.xml()
+        if self.blocks or textlayers:
+            placeholder = etree.Comment('body')
+            root.find('{' + folia.NSFOLIA + '}text').append(placeholder)
+            head, tail = _unprefix(etree.tostring(root, xml_declaration=True, encoding='utf-8', pretty_print=True)).split(etree.tostring(placeholder))
+            head = head.rstrip(b' ')
+            tail = tail[1:]
+        else:
+            head = _unprefix(etree.tostring(root, xml_declaration=True, encoding='utf-8', pretty_print=True))
+            tail = b''
+
+        indent = INDENT * 2
+        f = compression.open_output(output, compress)
+        try:
+            f.write(head)
+            for block in self.blocks:
+                out = []
+                if isinstance(block, Paragraph):
+                    self.write_paragraph(out, block, indent)
+                else:
+                    self.write_sentence(out, block, indent)
+                f.write(self.encode(out))
+            if textlayers:
+                out = []
+                for layer in textlayers:
+                    self.write_node(out, layer, indent)
+                f.write(self.encode(out))
+            f.write(tail)
+        finally:
+            f.close()
+
+    def encode(self, out):
+        #the same patch folia.Document.xmlstring() applies
+        return ''.join(out).replace('ns0:', '').replace(':ns0', '').encode('utf-8')
+
+    def write_paragraph(self, out, paragraph, indent):
+        if not paragraph.sentences:
+            out.append(indent + '<p xml:id="' + paragraph.id + '"/>\n')
+            return
+        out.append(indent + '<p xml:id="' + paragraph.id + '">\n')
+        for sentence in paragraph.sentences:
+            self.write_sentence(out, sentence, indent + INDENT)
+        out.append(indent + '</p>\n')
+
+    def write_sentence(self, out, sentence, indent):
+        table = self.table
+        docid = self.foliadoc.id
+        textid = self.textbody.id
+        annotations = self.annotations
+        defaults = self.defaults
+        wordindent = indent + INDENT
+        childindent = wordindent + INDENT
+        last = len(table) - 1
+        out.append(indent + '<s xml:id="' + sentence.id + '">\n')
+        for index in range(sentence.start, sentence.end):
+            if index < last and table.adjacent(index + 1):
+                out.append(wordindent + '<w space="no" xml:id="' + docid + '.' + table.ids[index] + '">\n')
+            else:
+                out.append(wordindent + '<w xml:id="' + docid + '.' + table.ids[index] + '">\n')
+            if self.offsets[index]:
+                out.append(childindent + '<t offset="' + str(table.offsets[index]) + '" ref="' + textid + '">' + _text(table.texts[index]) + '</t>\n')
+            else:
+                out.append(childindent + '<t>' + _text(table.texts[index]) + '</t>\n')
+            for annotation in annotations.get(index, ()):
+                if isinstance(annotation, tuple):
+                    tag, annotationtype, set, cls = annotation
+                    if set and defaults.get(annotationtype) != set:
+                        out.append(childindent + '<' + tag + ' set="' + _attribute(set) + '" class="' + _attribute(cls) + '"/>\n')
+                    else:
+                        out.append(childindent + '<' + tag + ' class="' + _attribute(cls) + '"/>\n')
+                else:
+                    self.write_node(out, annotation, childindent)
+            out.append(wordindent + '</w>\n')
+        for layer in self.layers.get(sentence.id, ()):
+            self.write_node(out, layer, wordindent)
+        out.append(indent + '</s>\n')
+
+    def write_node(self, out, node, indent):
+        if not isinstance(node, Node):
+            self.write_xml(out, node.xml(), indent)
+            return
+        defaults = self.defaults
+        start = indent + '<' + node.tag + ''.join( ' ' + name + '="' + _attribute(value) + '"' for name, value in node.attribs if name != 'set' or defaults.get(node.type) != value )
+        if node.text is not None:
+            out.append(start + '>' + _text(node.text) + '</' + node.tag + '>\n')
+        elif node.children:
+            out.append(start + '>\n')
+            childindent = indent + INDENT
+            for child in node.children:
+                if isinstance(child, int):
+                    out.append(childindent + '<wref id="' + self.foliadoc.id + '.' + self.table.ids[child] + '" t="' + _attribute(self.table.texts[child]) + '"/>\n')
+                else:
+                    self.write_node(out, child, childindent)
+            out.append(indent + '</' + node.tag + '>\n')
+        else:
+            out.append(start + '/>\n')
+
+    def write_xml(self, out, e, indent):
+        #writes an element serialised by pynlpl, as lxml would pretty print it
+        tag = etree.QName(e).localname
+        attribs = ''
+        for name, value in e.attrib.items():
+            for namespace, prefix in ATTRIBUTE_NAMES.items():
+                if name.startswith(namespace):
+                    name = prefix + name[len(namespace):]
+                    break
+            attribs += ' ' + name + '="' + _attribute(value) + '"'
+        if e.text is not None:
+            out.append(indent + '<' + tag + attribs + '>' + _text(e.text) + '</' + tag + '>\n')
+        elif len(e):
+            out.append(indent + '<' + tag + attribs + '>\n')
+            for child in e:
+                self.write_xml(out, child, indent + INDENT)
+            out.append(indent + '</' + tag + '>\n')
+        else:
+            out.append(indent + '<' + tag + attribs + '/>\n')
+
+
+def naf2folia_direct(naffile, output, docid=None, layers=None, profiler=None, collector=None, compress=None):
+    """
+    Converts a NAF document to FoLiA, writing the FoLiA XML directly rather than building a FoLiA document
+    :param naffile: path to the NAF input document (str), may be compressed (see naffoliapy.compression), a binary file object or a KafNafParser instance
+    :param output: path to the FoLiA output document (str) or a binary file object
+    :param docid: the ID for the FoLiA document, will be derived from the filename if not specified (str)
+    :param layers: names of the layers to convert, None for all (see naf2folia.naf2folia())
+    :param profiler: a naffoliapy.profiling.Profiler that measures every stage of the conversion
+    :param collector: a naffoliapy.diagnostics.WarningCollector to add the warnings to, if not specified the first warnings of every kind are written to stderr
+    :param compress: compression format of the output ('gz', 'xz' or 'zst'), by default it follows the extension of the output filename
+    """
+    layers = n2f.select_layers(layers)
+    if profiler is None:
+        profiler = NULL_PROFILER
+    warnings = collector if collector is not None else WarningCollector(stream=sys.stderr)
+
+    if not isinstance(naffile, naf.KafNafParser):
+        with profiler.stage('load'):
+            nafparser = n2f.load_naf(naffile, layers)
+    else:
+        nafparser = naffile
+        naffile = nafparser.get_filename()
+    if not docid:
+        docid = n2f.derive_docid(naffile)
+
+    conversion = DirectConversion(nafparser, docid, warnings)
+    foliadoc = conversion.foliadoc
+    n2f.convert_layer(nafparser, foliadoc, profiler, 'text', conversion.convert_text)
+    n2f.convert_layers(nafparser, foliadoc, layers - {'text'}, n2f.ExternalReferences(foliadoc, warnings), profiler, conversion.convert_terms, conversion.resolver)
+    with profiler.stage('write'):
+        conversion.write(output, compress)
+
+    if collector is None:
+        warnings.flush()
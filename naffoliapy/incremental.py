@@ -0,0 +1,311 @@
+#!/usr/bin/env python
+#-*- coding:utf-8 -*-
+
+# Incremental NAF2FoLiA Converter
+# Licensed under GPLv3
+
+"""
+Incremental NAF to FoLiA conversion, for pipelines in which every step adds a layer to the NAF document.
+Rather than converting the whole document again after every step, only the layers that are new or that changed
+since the FoLiA document was last converted are converted, and patched into the existing FoLiA document.
+
+The FoLiA document records a fingerprint of every converted NAF layer in its metadata: a checksum of the layer
+and of the linguistic processors listed for it in the NAF header. A layer is converted again when its fingerprint
+differs; its old annotations are removed first. A change in the text or the terms, which all other layers refer
+to, or a FoLiA document without fingerprints, means a full conversion.
+
+The existing FoLiA document is patched as XML, it is never loaded as FoLiA objects. The changed layers are
+converted onto a bare FoLiA document that only holds the text, and their annotation layers are moved into the
+sentences of the existing document, so the work mostly depends on the size of the changed layers. The NAF document
+is still read in full to compute the fingerprints, but only the text, the terms and the changed layers are parsed
+into objects.
+"""
+
+from __future__ import print_function, unicode_literals, division, absolute_import
+
+import sys
+import os
+import hashlib
+
+from lxml import etree
+from pynlpl.formats import folia
+
+from naffoliapy import naf2folia as n2f
+from naffoliapy import compression
+from naffoliapy.nafstream import XLINK, _serialize
+from naffoliapy.profiling import NULL_PROFILER
+from naffoliapy.diagnostics import WarningCollector
+
+#prefix of the FoLiA metadata fields that hold the fingerprints of the converted NAF layers
+FINGERPRINT_PREFIX = 'naf-layer-'
+
+#layers that all other layers refer to, a change means a full conversion
+BASE_LAYERS = ('text', 'terms')
+
+NS = '{' + folia.NSFOLIA + '}'
+
+
+def layer_fingerprints(naffile):
+    """
+    Computes the fingerprint of every layer of a NAF document: a checksum of the layer and its linguistic processors
+    :param naffile: path to the NAF document (str), may be compressed
+    :return: dictionary of layer name (see naf2folia.LAYERS) to fingerprint (str), for all layers, including absent ones
+    """
+    tag2layer = dict( (tag, layer) for layer, tags in n2f.LAYERS.items() for tag in tags )
+    checksums = dict( (layer, hashlib.sha1()) for layer in n2f.LAYERS )
+    with compression.readable(naffile) as source:
+        for _, node in etree.iterparse(source, tag=list(tag2layer) + ['linguisticProcessors']):
+            parent = node.getparent()
+            if node.tag == 'linguisticProcessors':
+                layer = tag2layer.get(node.get('layer'))
+            elif parent is not None and parent.getparent() is None: #layers are children of the root
+                layer = tag2layer[node.tag]
+            else:
+                continue
+            if layer is not None:
+                checksums[layer].update(etree.tostring(node, encoding='utf-8'))
+            node.clear()
+            if parent is not None and parent.getparent() is None:
+                #free the layers that have been checked
+                while node.getprevious() is not None:
+                    del parent[0]
+    return dict( (layer, checksum.hexdigest()) for layer, checksum in checksums.items() )
+
+def record_fingerprints(foliadoc, fingerprints):
+    """
+    Records the fingerprints of the converted NAF layers in a FoLiA document, replacing the ones recorded before
+    :param foliadoc: folia.Document instance
+    :param fingerprints: dictionary of layer name to fingerprint, for the converted layers
+    """
+    for layer in n2f.LAYERS:
+        if layer in fingerprints:
+            foliadoc.metadata[FINGERPRINT_PREFIX + layer] = fingerprints[layer]
+        elif FINGERPRINT_PREFIX + layer in foliadoc.metadata:
+            del foliadoc.metadata[FINGERPRINT_PREFIX + layer]
+
+
+class FoLiAPatch(object):
+    """
+    An existing FoLiA document, parsed as XML, that annotation layers are removed from and added to. Layers are
+    identified by their element and set, like naf2folia.ANNOTATION_LAYERS lists them.
+    """
+
+    def __init__(self, foliafile):
+        with compression.readable(foliafile) as source:
+            self.tree = etree.parse(source)
+        self.root = self.tree.getroot()
+        self.metadata = self.root.find(NS + 'metadata')
+        self.annotations = self.metadata.find(NS + 'annotations')
+        self.declarations = {} #annotation type => list of declared sets
+        for declaration in self.annotations:
+            if isinstance(declaration.tag, str) and declaration.tag.endswith('-annotation'):
+                annotationtype = getattr(folia.AnnotationType, etree.QName(declaration).localname[:-11].upper().replace('-', '_'), None)
+                self.declarations.setdefault(annotationtype, []).append(declaration.get('set'))
+        #annotation layers are added to sentences, or to the text body for coreferences
+        self.elements = {}
+        for textbody in self.root.iterfind(NS + 'text'):
+            self.elements[textbody.get('{http://www.w3.org/XML/1998/namespace}id')] = textbody
+            for sentence in textbody.iter(NS + 's'):
+                self.elements[sentence.get('{http://www.w3.org/XML/1998/namespace}id')] = sentence
+
+    def fingerprints(self):
+        """Returns the fingerprints of the NAF layers recorded in the document (dict)"""
+        fingerprints = {}
+        for meta in self.metadata.iterfind(NS + 'meta'):
+            if meta.get('id', '').startswith(FINGERPRINT_PREFIX):
+                fingerprints[meta.get('id')[len(FINGERPRINT_PREFIX):]] = meta.text
+        return fingerprints
+
+    def record_fingerprints(self, fingerprints):
+        """Replaces the recorded fingerprints, like record_fingerprints() does for a folia.Document"""
+        for meta in list(self.metadata.iterfind(NS + 'meta')):
+            if meta.get('id', '').startswith(FINGERPRINT_PREFIX):
+                self._remove(meta)
+        for layer in n2f.LAYERS:
+            if layer in fingerprints:
+                meta = etree.Element(NS + 'meta', id=FINGERPRINT_PREFIX + layer)
+                meta.text = fingerprints[layer]
+                self._place(self.metadata, meta, None)
+
+    def layer(self, node):
+        """Returns the name of the NAF layer an annotation layer element was converted from, None if it is not one"""
+        Class = folia.XML2CLASS.get(etree.QName(node).localname) if isinstance(node.tag, str) else None
+        if Class is None or not issubclass(Class, folia.AbstractAnnotationLayer):
+            return None
+        annotationset = node.get('set')
+        if annotationset is None:
+            #resolved like FoLiA does: the only declared set, or the set of the annotations in the layer
+            sets = self.declarations.get(Class.ANNOTATIONTYPE, [])
+            if len(sets) == 1:
+                annotationset = sets[0]
+            else:
+                for child in node:
+                    if child.get('set') and folia.XML2CLASS.get(etree.QName(child).localname, folia.AbstractElement).ANNOTATIONTYPE == Class.ANNOTATIONTYPE:
+                        annotationset = child.get('set')
+                        break
+        for layer, annotationlayers in n2f.ANNOTATION_LAYERS.items():
+            if any( Class.__name__ == classname and annotationset == layerset for classname, layerset in annotationlayers ):
+                return layer
+        return None
+
+    def remove_layers(self, layers):
+        """
+        Removes the FoLiA annotations the given NAF layers were converted to
+        :param layers: names of the layers (see naf2folia.LAYERS), layers that are not converted to annotations are ignored
+        :return: number of FoLiA annotation layers removed (int)
+        """
+        removed = 0
+        for element in self.elements.values():
+            for child in list(element):
+                if self.layer(child) in layers:
+                    self._remove(child)
+                    removed += 1
+        return removed
+
+    def add_layer(self, element, node, layer):
+        """
+        Adds an annotation layer to a sentence or text body, among the other layers in the order of naf2folia.LAYERS
+        :param element: the sentence or text body, as an XML element
+        :param node: the annotation layer, as an XML element
+        :param layer: name of the NAF layer it was converted from
+        """
+        for descendant in node.iter():
+            #leave out the set where it is the only one declared, like FoLiA does
+            Class = folia.XML2CLASS.get(etree.QName(descendant).localname) if isinstance(descendant.tag, str) else None
+            if Class is not None and descendant.get('set') is not None and len(self.declarations.get(Class.ANNOTATIONTYPE, [])) == 1:
+                del descendant.attrib['set']
+        rank = list(n2f.LAYERS).index(layer)
+        for child in element:
+            childlayer = self.layer(child)
+            if childlayer is not None and list(n2f.LAYERS).index(childlayer) > rank:
+                self._place(element, node, child)
+                return
+        self._place(element, node, None)
+
+    def declare(self, foliadoc):
+        """Adds the declarations of a FoLiA document that are missing"""
+        for node in foliadoc.xmldeclarations():
+            #the set is namespaced until FoLiA serialises the document
+            declaration = etree.Element(node.tag, dict( (etree.QName(key).localname, value) for key, value in node.attrib.items() ))
+            annotationtype = getattr(folia.AnnotationType, etree.QName(declaration).localname[:-11].upper().replace('-', '_'), None)
+            sets = self.declarations.setdefault(annotationtype, [])
+            if declaration.get('set') in sets:
+                continue
+            if len(sets) == 1:
+                #the annotations of the only set so far leave it out, a second one makes it ambiguous
+                self._explicit_set(annotationtype, sets[0])
+            sets.append(declaration.get('set'))
+            self._place(self.annotations, declaration, None)
+
+    def _explicit_set(self, annotationtype, annotationset):
+        for node in self.root.find(NS + 'text').iter():
+            if isinstance(node.tag, str) and node.get('set') is None:
+                Class = folia.XML2CLASS.get(etree.QName(node).localname)
+                if Class is not None and Class.ANNOTATIONTYPE == annotationtype and not issubclass(Class, folia.AbstractAnnotationLayer):
+                    node.set('set', annotationset)
+
+    def _remove(self, node):
+        #keeps the indentation of the siblings intact
+        previous = node.getprevious()
+        if previous is not None:
+            previous.tail = node.tail
+        node.getparent().remove(node)
+
+    def _place(self, parent, node, before):
+        #inserts a node before a sibling, or as the last child, indented like its siblings
+        indentation = parent.text if parent.text and not parent.text.strip() else '\n'
+        for descendant in node.iterdescendants():
+            if descendant.tail and not descendant.tail.strip():
+                descendant.tail += indentation[1:]
+        for descendant in node.iter():
+            if len(descendant) and descendant.text and not descendant.text.strip():
+                descendant.text += indentation[1:]
+        if before is not None:
+            before.addprevious(node)
+            node.tail = indentation
+        else:
+            last = parent[-1] if len(parent) and parent[-1] is not node else None
+            parent.append(node)
+            if last is not None:
+                node.tail = last.tail
+                last.tail = indentation
+            else:
+                node.tail = indentation[:-2] if len(indentation) > 2 else '\n'
+
+    def save(self, foliafile, compress=None):
+        with compression.open_output(foliafile, compress) as f:
+            f.write(b"<?xml version='1.0' encoding='utf-8'?>\n" + etree.tostring(self.root, encoding='utf-8') + b'\n')
+
+
+def convert_changed_layers(naffile, patch, docid, layers, profiler, collector):
+    #Converts the layers onto a bare FoLiA document that only holds the text and moves them into the patched document
+    with profiler.stage('load'):
+        nafparser = n2f.load_naf(naffile, set(layers) | {'text', 'terms'})
+    foliadoc = folia.Document(id=docid)
+    foliadoc.declare(folia.Word, 'undefined')
+    foliadoc.declare(folia.Sentence, 'undefined')
+    #warnings about the text were given when it was converted
+    n2f.convert_layer(nafparser, foliadoc, profiler, 'text', n2f.convert_text_layer, WarningCollector())
+    n2f.convert_layers(nafparser, foliadoc, set(layers), n2f.ExternalReferences(foliadoc, collector), profiler)
+    with profiler.stage('patch'):
+        patch.declare(foliadoc)
+        for textbody in foliadoc.data:
+            for element in [textbody] + list(textbody.select(folia.Sentence)):
+                for child in list(element.data):
+                    if isinstance(child, folia.AbstractAnnotationLayer):
+                        layer = next(( layer for layer in layers if any( isinstance(child, getattr(folia, classname)) and child.set == layerset for classname, layerset in n2f.ANNOTATION_LAYERS.get(layer, []) ) ), None)
+                        if layer is not None:
+                            #parsed in a wrapper that declares the namespaces the serialisation leaves out
+                            wrapper = etree.fromstring(b'<wrapper xmlns="' + folia.NSFOLIA.encode('utf-8') + b'" xmlns:xlink="' + XLINK.encode('utf-8') + b'">' + _serialize(child, foliadoc) + b'</wrapper>')
+                            patch.add_layer(patch.elements[element.id], wrapper[0], layer)
+
+
+def naf2folia_incremental(naffile, foliafile, docid=None, layers=None, profiler=None, collector=None, compress=None):
+    """
+    Converts a NAF document to FoLiA, reusing an earlier conversion to FoLiA and only converting the layers that changed
+    :param naffile: path to the NAF input document (str)
+    :param foliafile: path to the earlier FoLiA output document, it is converted in full if it does not exist, and overwritten with the result (str)
+    :param docid: the ID for the FoLiA document, will be derived from the filename if not specified (str)
+    :param layers: names of the layers to convert, None for all (see naf2folia.naf2folia()), earlier converted layers that are no longer selected are removed
+    :param profiler: a naffoliapy.profiling.Profiler that measures every stage of the conversion
+    :param collector: a naffoliapy.diagnostics.WarningCollector to add the warnings to, if not specified the first warnings of every kind are written to stderr
+    :param compress: compression format of the FoLiA document ('gz', 'xz' or 'zst'), by default it follows the extension of its filename
+    :return: names of the layers that were converted (list)
+    """
+    layers = n2f.select_layers(layers)
+    if profiler is None:
+        profiler = NULL_PROFILER
+    warnings = collector if collector is not None else WarningCollector(stream=sys.stderr)
+    if not docid:
+        docid = n2f.derive_docid(naffile)
+
+    with profiler.stage('fingerprint'):
+        fingerprints = dict( (layer, fingerprint) for layer, fingerprint in layer_fingerprints(naffile).items() if layer in layers )
+
+    patch = None
+    if os.path.exists(foliafile):
+        with profiler.stage('parse'):
+            patch = FoLiAPatch(foliafile)
+        recorded = patch.fingerprints()
+        if patch.root.get('{http://www.w3.org/XML/1998/namespace}id') != docid or any( fingerprints.get(layer) != recorded.get(layer) for layer in BASE_LAYERS ):
+            patch = None
+
+    if patch is None:
+        foliadoc = n2f.naf2folia(naffile, docid, layers, profiler, warnings)
+        converted = [ layer for layer in n2f.LAYERS if layer in layers ]
+        record_fingerprints(foliadoc, fingerprints)
+        with profiler.stage('serialize'):
+            n2f.save_folia(foliadoc, foliafile, compress)
+    else:
+        converted = [ layer for layer in n2f.LAYERS if layer in layers and fingerprints[layer] != recorded.get(layer) ]
+        with profiler.stage('remove'):
+            patch.remove_layers([ layer for layer in recorded if layer in converted or layer not in layers ])
+        if converted:
+            convert_changed_layers(naffile, patch, docid, converted, profiler, warnings)
+        patch.record_fingerprints(fingerprints)
+        with profiler.stage('serialize'):
+            patch.save(foliafile, compress)
+
+    if collector is None:
+        warnings.flush()
+    return converted
@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+#-*- coding:utf-8 -*-
+
+# Checkpoint journal of batch conversions for NAFFoLiAPy
+# Licensed under GPLv3
+
+'''
+Append-only journal of the documents a batch conversion completed, so that a conversion that was interrupted (a
+crashed or killed node, a reboot) can be started again and only converts the documents that are not done yet.
+Every completed document is recorded as soon as it is written, as one line of JSON with the checksums of its input
+and output document and the conversion options. A document is skipped on a restart if its record is found and its
+input and output document still have the recorded checksums, anything else is converted again:
+
+    $ naf2folia --journal folia/journal.jsonl --outputdir folia/ naf/
+
+A record that was not completely written when the conversion was interrupted is ignored. Together with ``--shard``
+(see naffoliapy.batch.select_shard()) a corpus can be divided over several machines that share a filesystem, each
+converting its own part with its own journal:
+
+    $ naf2folia --shard 1/4 --journal folia/journal.1.jsonl --outputdir folia/ naf/
+
+Paths are recorded relative to the directory of the journal, so the journal stays valid when the filesystem is
+mounted elsewhere on another machine. A journal must not be written by more than one conversion at the same time.
+'''
+
+from __future__ import print_function, unicode_literals, division, absolute_import
+
+import os
+import io
+import json
+import time
+
+from naffoliapy.cache import file_checksum
+
+
+def checksums(inputfile, outputfile):
+    """
+    Computes what is recorded in the journal for a converted document, called in the worker process that converted it
+    :param inputfile: path to the input document (str)
+    :param outputfile: path to the output document (str)
+    :return: dict with the checksums of both documents and the size of the output document
+    """
+    return {
+        'input_checksum': file_checksum(inputfile),
+        'output_checksum': file_checksum(outputfile),
+        'size': os.path.getsize(outputfile),
+    }
+
+
+class Journal(object):
+    """An append-only file with a record of every document a batch conversion completed"""
+
+    def __init__(self, filename, options=None):
+        """
+        Opens a journal, reading the records of earlier conversions if it exists
+        :param filename: path to the journal (str), created if it does not exist
+        :param options: the converter and conversion options that affect the output, a document converted with other options is converted again, must be serialisable to JSON (dict)
+        """
+        self.filename = filename
+        self.directory = os.path.dirname(os.path.abspath(filename))
+        self.options = json.loads(json.dumps(options or {}, sort_keys=True)) #as it reads back from the journal
+        self.records = {}
+        complete = True
+        if os.path.exists(filename):
+            with io.open(filename, 'r', encoding='utf-8') as f:
+                for line in f:
+                    complete = line.endswith('\n')
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        #not completely written when the conversion was interrupted
+                        continue
+                    self.records[record['output']] = record
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+        self.file = io.open(filename, 'a', encoding='utf-8')
+        if not complete:
+            #so the next record does not continue the incomplete one
+            self.file.write('\n')
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _path(self, filename):
+        return os.path.relpath(os.path.abspath(filename), self.directory).replace(os.sep, '/')
+
+    def done(self, inputfile, outputfile):
+        """
+        Checks whether a document was converted by an earlier conversion with the same options, and its input and output document did not change since
+        :param inputfile: path to the input document (str)
+        :param outputfile: path to the output document (str)
+        :return: bool
+        """
+        record = self.records.get(self._path(outputfile))
+        if record is None or record['input'] != self._path(inputfile) or record['options'] != self.options:
+            return False
+        try:
+            if os.path.getsize(outputfile) != record['size']:
+                return False
+            return file_checksum(outputfile) == record['output_checksum'] and file_checksum(inputfile) == record['input_checksum']
+        except (IOError, OSError):
+            return False
+
+    def pending(self, jobs):
+        """
+        Leaves out the documents that are done (see done())
+        :param jobs: list of (inputfile, outputfile) tuples
+        :return: list of the (inputfile, outputfile) tuples still to convert
+        """
+        return [ (inputfile, outputfile) for inputfile, outputfile in jobs if not self.done(inputfile, outputfile) ]
+
+    def record(self, inputfile, outputfile, checksums):
+        """
+        Records a converted document, the record is on disk when this returns
+        :param inputfile: path to the input document (str)
+        :param outputfile: path to the output document (str)
+        :param checksums: the checksums of the documents, as returned by checksums()
+        """
+        record = dict(checksums, input=self._path(inputfile), output=self._path(outputfile), options=self.options, time=time.time())
+        self.records[record['output']] = record
+        self.file.write(json.dumps(record, sort_keys=True) + '\n')
+        self.file.flush()
+        os.fsync(self.file.fileno())
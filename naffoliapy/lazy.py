@@ -0,0 +1,42 @@
+#!/usr/bin/env python
+#-*- coding:utf-8 -*-
+
+# Deferred imports for NAFFoLiAPy
+# Licensed under GPLv3
+
+'''
+lxml, KafNafParserPy and pynlpl (which pulls in rdflib) take several times longer to import than the command-line
+tools need to parse their arguments. The converter modules therefore import them with lazy_import(), which returns a
+placeholder that only imports the module when one of its attributes is first used:
+
+    folia = lazy_import('pynlpl.formats.folia')
+
+Module-level code must not use such a module, or the import happens anyway.
+'''
+
+from __future__ import print_function, unicode_literals, division, absolute_import
+
+import sys
+import types
+import importlib
+
+
+class LazyModule(types.ModuleType):
+    """A module that is imported when one of its attributes is first used"""
+
+    def __getattr__(self, name):
+        #only called for attributes not found yet; after the import the module's attributes are copied over, so
+        #later lookups do not get here
+        module = importlib.import_module(self.__name__)
+        self.__dict__.update(module.__dict__)
+        return getattr(module, name)
+
+def lazy_import(name):
+    """
+    Returns a module that is only imported when it is first used
+    :param name: full name of the module (str)
+    :return: the module if it has already been imported, a LazyModule otherwise
+    """
+    if name in sys.modules:
+        return sys.modules[name]
+    return LazyModule(name)
@@ -11,475 +11,827 @@ import sys
 import os
 import argparse
 import types
-from collections import defaultdict
-
-import KafNafParserPy as naf
-from pynlpl.formats import folia
+import re
+import time
+import io
+import functools
+from array import array
+from collections import defaultdict, OrderedDict
+
+from naffoliapy.lazy import lazy_import
+from naffoliapy.profiling import Profiler, NULL_PROFILER
+from naffoliapy.diagnostics import WarningCollector, PRINT_WARNINGS
+from naffoliapy import compression
+from naffoliapy.bulk import bulk_build, validate as validate_folia
+
+#imported when a conversion first needs them, so the command-line tool starts fast (see naffoliapy.lazy)
+etree = lazy_import('lxml.etree')
+naf = lazy_import('KafNafParserPy')
+folia = lazy_import('pynlpl.formats.folia')
 
 VERSION = '0.1'
 
+#Layers that can be selected for conversion, with the tags of the NAF layers they are read from. The text is always
+#converted, all other layers refer to it.
+LAYERS = OrderedDict([
+    ('text', ('text', 'raw')),
+    ('terms', ('terms',)),
+    ('entities', ('entities',)),
+    ('markables', ('markables',)),
+    ('chunks', ('chunks',)),
+    ('coreferences', ('coreferences',)),
+    ('srl', ('srl',)),
+    ('deps', ('deps',)),
+    ('timex', ('timeExpressions',)),
+    ('temporalrelations', ('temporalRelations',)),
+    ('causalrelations', ('causalRelations',)),
+    ('constituency', ('constituency',)),
+    ('factuality', ('factualitylayer', 'factualities')),
+    ('opinions', ('opinions',)),
+    ('attribution', ('attribution',)),
+])
+
+#Layers whose elements refer to terms, the terms layer is read (though not converted) when any of them is selected
+TERM_REFERRING_LAYERS = ('entities', 'markables', 'chunks', 'coreferences', 'srl', 'deps', 'timex', 'opinions')
+
+POS_SET = "https://raw.githubusercontent.com/proycon/folia/master/setdefinitions/naf_pos.foliaset.xml"
+MORPHOFEAT_SET = "https://raw.githubusercontent.com/proycon/folia/master/setdefinitions/naf_morphofeat.foliaset.xml"
+LEMMA_SET = "https://raw.githubusercontent.com/proycon/folia/master/setdefinitions/naf_lemma.foliaset.xml"
+ENTITY_SET = "https://raw.githubusercontent.com/proycon/folia/master/setdefinitions/naf_entities.foliaset.xml"
+MARKABLE_SET = "https://raw.githubusercontent.com/proycon/folia/master/setdefinitions/naf_markables.foliaset.xml"
+CHUNK_SET = "https://raw.githubusercontent.com/proycon/folia/master/setdefinitions/naf_entities.foliaset.xml"
+COREFERENCE_SETS = {
+    'entity': "https://raw.githubusercontent.com/proycon/folia/master/setdefinitions/naf_coreference.foliaset.xml",
+    'event': "https://raw.githubusercontent.com/proycon/folia/master/setdefinitions/naf_events.foliaset.xml"
+}
+PREDICATE_SET = "https://raw.githubusercontent.com/proycon/folia/master/setdefinitions/naf_predicates.foliaset.xml"
+SEMROLE_SET = "https://raw.githubusercontent.com/proycon/folia/master/setdefinitions/naf_semroles.foliaset.xml"
+DEPENDENCY_SET = "https://raw.githubusercontent.com/proycon/folia/master/setdefinitions/naf_dependencies.foliaset.xml"
+TIMEX_SET = "https://raw.githubusercontent.com/proycon/folia/master/setdefinitions/naf_timex3.foliaset.xml"
+SENTIMENT_SET = "https://raw.githubusercontent.com/proycon/folia/master/setdefinitions/naf_sentiment.foliaset.xml"
+
+#The FoLiA annotation layers (name of the class and set) every NAF layer is converted to, for the layers that are converted to annotation layers
+ANNOTATION_LAYERS = {
+    'entities': [('EntitiesLayer', ENTITY_SET)],
+    'markables': [('EntitiesLayer', MARKABLE_SET)],
+    'chunks': [('ChunkingLayer', CHUNK_SET)],
+    'coreferences': [ ('CoreferenceLayer', corefset) for corefset in sorted(COREFERENCE_SETS.values()) ],
+    'srl': [('SemanticRolesLayer', SEMROLE_SET)],
+    'deps': [('DependenciesLayer', DEPENDENCY_SET)],
+    'timex': [('EntitiesLayer', TIMEX_SET)],
+    'opinions': [('SentimentLayer', SENTIMENT_SET)],
+}
+
+
+class Term(object):
+    """
+    A NAF term, as held in the TokenTable: its ID, the IDs of the tokens it spans and its attributes, interned. The
+    node is only kept for terms with more than a span (external references, a sentiment), which are converted
+    through the KafNafParserPy term object.
+    """
+
+    __slots__ = ('id', 'span', 'pos', 'morphofeat', 'lemma', 'node')
+
+    def __init__(self, node, idattribute='id'):
+        self.id = sys.intern(node.get(idattribute))
+        span = node.find('span')
+        self.span = tuple( sys.intern(target.get('id')) for target in span.iterchildren('target') ) if span is not None else ()
+        self.pos = _intern(node.get('pos'))
+        self.morphofeat = _intern(node.get('morphofeat'))
+        self.lemma = _intern(node.get('lemma'))
+        self.node = node if len(node) > (1 if span is not None else 0) else None
+
+def _intern(value):
+    return sys.intern(value) if value is not None else None
 
-def convert_text_layer(nafparser, foliadoc):
+class TokenTable(object):
+    """
+    The tokens and terms of a NAF document in compact form, read from the XML once per document (see token_table())
+    and shared by the text and term conversion and NAFResolver, rather than going through a KafNafParserPy object
+    per token and term. Offsets and lengths are parsed once and kept in typed arrays (-1 if missing), sentence and
+    paragraph numbers are kept as indices into a list of their distinct values, IDs are interned.
+    """
+
+    def __init__(self, nafparser):
+        kaf = nafparser.get_type() == 'KAF'
+        self.ids = [] #token id per token
+        self.texts = [] #text per token, interned as most words occur more than once
+        self.offsets = array('l')
+        self.lengths = array('l')
+        self.sentences = array('l') #index in labels per token
+        self.paragraphs = array('l') #index in labels per token
+        self.labels = [None] #distinct sentence and paragraph numbers (str), 0 means none
+        self.terms = [] #Term per term
+
+        labelindex = {None: 0}
+        def label(value):
+            index = labelindex.get(value)
+            if index is None:
+                index = labelindex[value] = len(self.labels)
+                self.labels.append(value)
+            return index
+        def number(value):
+            try:
+                return int(value)
+            except (TypeError, ValueError):
+                return -1
+
+        if nafparser.text_layer is not None:
+            idattribute = 'wid' if kaf else 'id'
+            for node in nafparser.text_layer.get_node().iterchildren('wf'):
+                self.ids.append(sys.intern(node.get(idattribute)))
+                self.texts.append(_intern(node.text))
+                self.offsets.append(number(node.get('offset')))
+                self.lengths.append(number(node.get('length')))
+                self.sentences.append(label(node.get('sent')))
+                self.paragraphs.append(label(node.get('para')))
+        if nafparser.term_layer is not None:
+            idattribute = 'tid' if kaf else 'id'
+            self.terms = [ Term(node, idattribute) for node in nafparser.term_layer.get_node().iterchildren('term') ]
+
+    def __len__(self):
+        return len(self.ids)
+
+    def adjacent(self, index):
+        """Returns True if there is no whitespace between token index-1 and token index"""
+        offset = self.offsets[index - 1]
+        length = self.lengths[index - 1]
+        return offset >= 0 and length >= 0 and offset + length == self.offsets[index]
+
+def token_table(nafparser):
+    """
+    Returns the TokenTable of a NAF document, it is built on first use and kept with the parser
+    :param nafparser: KafNafParser instance
+    :return: TokenTable
+    """
+    table = getattr(nafparser, 'token_table', None)
+    if table is None:
+        table = nafparser.token_table = TokenTable(nafparser)
+    return table
+
+
+def convert_text_layer(nafparser, foliadoc, collector=PRINT_WARNINGS):
     textbody = foliadoc.append(folia.Text(foliadoc, id=foliadoc.id+'.text'))
     naf_raw = nafparser.get_raw()
-    textbody.append(folia.TextContent, naf_raw)
+    if naf_raw:
+        textbody.append(folia.TextContent, naf_raw)
 
-    prevsent_id = None
-    prevpara_id = None
+    table = token_table(nafparser)
+    labels = table.labels
+    prevsent = 0
+    prevpara = 0
     paragraph = None
     prevword = None
-    prev_naf_token = None
-    for naf_token in nafparser.get_tokens():
-        para_id = naf_token.get_para()
-        sent_id = naf_token.get_sent()
-        if para_id != prevpara_id:
-            if prevpara_id is None:
+    for index in range(len(table)):
+        para = table.paragraphs[index]
+        sent = table.sentences[index]
+        if para != prevpara:
+            if prevpara == 0:
                 #first paragraph, declare for completion's sake
                 foliadoc.declare(folia.Paragraph, 'undefined')
-            paragraph = textbody.append(folia.Paragraph, id=foliadoc.id+ '.para' + para_id)
-        if sent_id != prevsent_id:
+            paragraph = textbody.append(folia.Paragraph, id=foliadoc.id+ '.para' + labels[para])
+        if sent != prevsent:
             if paragraph:
-                sentence = paragraph.append(folia.Sentence, id=foliadoc.id+ '.sent' + sent_id)
+                sentence = paragraph.append(folia.Sentence, id=foliadoc.id+ '.sent' + labels[sent])
             else:
-                sentence = textbody.append(folia.Sentence, id=foliadoc.id+ '.sent' + sent_id)
+                sentence = textbody.append(folia.Sentence, id=foliadoc.id+ '.sent' + labels[sent])
 
-        token_id = naf_token.get_id()
-        if prev_naf_token is not None and int(prev_naf_token.get_offset()) + int(prev_naf_token.get_length()) == int(naf_token.get_offset()):
+        if prevword is not None and table.adjacent(index):
             prevword.space = False
-        word = sentence.append(folia.Word, id=foliadoc.id+ '.' + token_id)
-        offset=int(naf_token.get_offset())
-        try:
-            offset_valid = naf_raw[offset+int(naf_token.get_length())] == naf_token.get_text()
-        except IndexError:
-            offset_valid = False
-        if not offset_valid:
-            print("WARNING: NAF error: offset for token " + token_id +" does not align properly with raw layer! Discarding offset information for FoLiA conversion",file=sys.stderr)
-            word.append(folia.TextContent, naf_token.get_text())
-        else:
-            word.append(folia.TextContent, naf_token.get_text(), offset=naf_token.get_offset(), ref=textbody)
-
-        prevword = word
-        prev_naf_token = naf_token
+        prevword = add_word(sentence, textbody, naf_raw, table.ids[index], table.texts[index], table.offsets[index], table.lengths[index], collector)
 
-        prevpara_id = para_id
-        prevsent_id = sent_id
+        prevpara = para
+        prevsent = sent
     return textbody
 
-def validate_confidence(confidence):
+def tokens_adjacent(naf_token, next_naf_token):
+    """Returns True if there is no whitespace between two consecutive NAF tokens, False if either has no offset or length"""
+    offset = naf_token.get_offset()
+    length = naf_token.get_length()
+    next_offset = next_naf_token.get_offset()
+    if offset is None or length is None or next_offset is None:
+        return False
+    return int(offset) + int(length) == int(next_offset)
+
+def convert_token(naf_token, sentence, textbody, naf_raw, collector=PRINT_WARNINGS):
+    """Adds a FoLiA word for a NAF token to the sentence, returns the word"""
+    offset = naf_token.get_offset()
+    length = naf_token.get_length()
+    return add_word(sentence, textbody, naf_raw, naf_token.get_id(), naf_token.get_text(), int(offset) if offset is not None else -1, int(length) if length is not None else -1, collector)
+
+def add_word(sentence, textbody, naf_raw, token_id, text, offset, length, collector=PRINT_WARNINGS):
+    """Adds a FoLiA word for a NAF token, given by its ID, text, offset and length (-1 if missing), to the sentence, returns the word"""
+    foliadoc = sentence.doc
+    word = sentence.append(folia.Word, id=foliadoc.id+ '.' + token_id)
+    if not naf_raw:
+        #no raw layer, nothing for the offsets to refer to
+        word.append(folia.TextContent, text)
+        return word
+    try:
+        offset_valid = offset >= 0 and length >= 0 and naf_raw[offset+length] == text
+    except IndexError:
+        offset_valid = False
+    if not offset_valid:
+        collector.warn('misaligned-offset', "NAF error: offset for token " + token_id +" does not align properly with raw layer! Discarding offset information for FoLiA conversion")
+        word.append(folia.TextContent, text)
+    else:
+        word.append(folia.TextContent, text, offset=offset, ref=textbody)
+    return word
+
+def validate_confidence(confidence, collector=PRINT_WARNINGS):
     if confidence is None:
         return None
     else:
         confidence = float(confidence)
     if confidence < 0:
-        print("WARNING: NAF error: confidence  " + str(confidence) + " is not in range! Forcing to 0"  ,file=sys.stderr)
+        collector.warn('confidence-range', "NAF error: confidence  " + str(confidence) + " is not in range! Forcing to 0")
         return 0.0
     if confidence > 1:
-        print("WARNING: NAF error: confidence  " + str(confidence) + " is not in range! Forcing to 1"  ,file=sys.stderr)
+        collector.warn('confidence-range', "NAF error: confidence  " + str(confidence) + " is not in range! Forcing to 1")
         return 1.0
     return confidence
 
-def unsupported_notice(collection, annotationtitle):
+def unsupported_notice(collection, annotationtitle, collector=PRINT_WARNINGS):
     if collection is not None and (not isinstance(collection, types.GeneratorType) or not list(collection)):
-        print("WARNING: The following annotation type in NAF can not be converted to FoLiA yet: " +  annotationtitle + ". Skipping....",file=sys.stderr)
+        collector.warn('unsupported-annotation', "The following annotation type in NAF can not be converted to FoLiA yet: " +  annotationtitle + ". Skipping....")
 
 
-def _get_exrefs(exref, result):
+def _nested_exrefs(naf_exref):
     #Depth first search getting all nested external references (FoLiA does not support the unbounded nesting)
-    for exref2 in exref.get_external_references():
-        result.append(exref2)
-        _get_exrefs(exref2, result)
+    stack = list(naf_exref.get_external_references())
+    stack.reverse()
+    while stack:
+        naf_exref = stack.pop()
+        yield naf_exref
+        children = list(naf_exref.get_external_references())
+        children.reverse()
+        stack += children
+
+
+class ResourceHandler(object):
+    """
+    Converts the NAF external references to one resource (wordnet, framenet, etc). References on terms become
+    sense annotations on words, references on other elements become alignments (if they are not URLs already).
+    Subclasses override the matching methods and conversion methods for what the resource supports, and are
+    made known with register_resource_handler().
+    """
+
+    def matches_sense(self, resource):
+        """Returns True if external references on terms to this resource are converted to senses"""
+        return False
+
+    def matches_alignment(self, resource):
+        """Returns True if external references to this resource that are not URLs are converted to alignments"""
+        return False
+
+    def sense(self, naf_exref, reference):
+        """Returns a (class, features) tuple for the sense annotation, or None to skip the reference"""
+        return reference, {}
+
+    def alignment(self, naf_exref, folia_element, resource, reference, confidence):
+        """Adds the alignment (or whatever the reference is converted to) to the FoLiA element"""
+        alignment = folia_element.add(folia.Alignment, cls=resource, format="application/unknown", confidence=confidence) #location of ontology not defined!
+        alignment.add(folia.AlignReference, id=reference, type="unknown")
+
+class WordnetHandler(ResourceHandler):
+    def matches_sense(self, resource):
+        return resource.lower().find('wordnet') != -1 or resource.startswith('wn')
+
+    def matches_alignment(self, resource):
+        return resource.lower().find('wordnet') != -1
+
+    def sense(self, naf_exref, reference):
+        #see if the ID follows the NAF convention for wordnet
+        if len(reference) > 10 and reference[3] == '-' and reference[6] == '-' and reference[-2] == '-':
+            return reference[7:-2], {'version': reference[4:6], 'language': reference[:3],'pos': reference[-1]}
+        return None
+
+    def alignment(self, naf_exref, folia_element, resource, reference, confidence):
+        if naf_exref.get_source() == "dominant_sense":
+            #add as feature rather than an alignment
+            folia_element.add(folia.Feature, subset="ODWN_dominant_sense", cls=reference)
+        else:
+            super(WordnetHandler, self).alignment(naf_exref, folia_element, resource, reference, confidence)
+
+class ODWNHandler(WordnetHandler):
+    def matches_sense(self, resource):
+        return resource.lower().find('odwn') != -1
 
-def convert_senses(naf_term, word):
+    def matches_alignment(self, resource):
+        return resource.lower() == "odwn"
+
+    def sense(self, naf_exref, reference):
+        features = {}
+        for child_exref in _nested_exrefs(naf_exref):
+            features[child_exref.get_resource()] = child_exref.get_reference()
+        features['pos'] = reference[-1]
+        return reference, features
+
+class FrameNetHandler(ResourceHandler):
+    def matches_sense(self, resource):
+        return resource.lower().find('framenet') != -1
+
+    def matches_alignment(self, resource):
+        return resource.lower() == "framenet"
+
+    def alignment(self, naf_exref, folia_element, resource, reference, confidence):
+        alignment = folia_element.add(folia.Alignment, cls=resource, format="application/rdf+xml", confidence=confidence) #location of ontology not defined!
+        alignment.add(folia.AlignReference, id="http://www.newsreader-project.eu/framenet#" + reference, type="rdf:description")
+
+class ESOHandler(ResourceHandler):
+    def matches_alignment(self, resource):
+        return resource.lower() == "eso"
+
+    def alignment(self, naf_exref, folia_element, resource, reference, confidence):
+        alignment = folia_element.add(folia.Alignment, cls=resource, href="https://raw.githubusercontent.com/newsreader/eso/master/ESO_Version2.owl", format="application/rdf+xml", confidence=confidence)
+        alignment.add(folia.AlignReference, id="http://www.newsreader-project.eu/domain-ontology#" + reference, type="rdf:description")
+
+#Resource handlers in the order they are tried, the first one that matches a resource is used
+RESOURCE_HANDLERS = [WordnetHandler(), ODWNHandler(), FrameNetHandler(), ESOHandler()]
+
+def register_resource_handler(handler):
+    """
+    Adds a handler for the external references to a resource. It is tried before the handlers registered earlier
+    (and the built-in ones), so it can also take over a resource that is already supported.
+    Only affects documents converted after registration.
+    :param handler: a ResourceHandler instance
+    """
+    RESOURCE_HANDLERS.insert(0, handler)
+
+class ExternalReferences(object):
+    """
+    Per-document state for the conversion of external references: which handler every resource is dispatched to,
+    which sets have been declared, and which unknown resources have already been warned about. Every resource is
+    classified once per document rather than for every reference. It also holds the warning collector of the
+    document, for the conversion functions that are passed this state anyway.
+    """
+
+    def __init__(self, foliadoc, collector=PRINT_WARNINGS):
+        self.foliadoc = foliadoc
+        self.collector = collector
+        self.handlers = list(RESOURCE_HANDLERS)
+        self.sense_handlers = {} #resource => ResourceHandler, None if unknown
+        self.alignment_handlers = {} #resource => ResourceHandler, None if unknown
+        self.sensesets = {} #resource => declared sense set
+        self.alignset = None
+        self.warned = set()
+
+    def sense_handler(self, resource):
+        try:
+            return self.sense_handlers[resource]
+        except KeyError:
+            handler = self.sense_handlers[resource] = next(( handler for handler in self.handlers if handler.matches_sense(resource) ), None)
+            return handler
+
+    def alignment_handler(self, resource):
+        try:
+            return self.alignment_handlers[resource]
+        except KeyError:
+            handler = self.alignment_handlers[resource] = next(( handler for handler in self.handlers if handler.matches_alignment(resource) ), None)
+            return handler
+
+    def senseset(self, resource):
+        """Returns the sense set for a resource, declaring it the first time"""
+        senseset = self.sensesets.get(resource)
+        if senseset is None:
+            senseset = self.sensesets[resource] = "https://raw.githubusercontent.com/proycon/folia/master/setdefinitions/naf_sense_" + resource.replace(' ','_') + ".foliaset.xml"
+            if not self.foliadoc.declared(folia.SenseAnnotation, senseset):
+                self.foliadoc.declare(folia.SenseAnnotation, senseset)
+        return senseset
+
+    def alignmentset(self):
+        """Returns the alignment set, declaring it the first time"""
+        if self.alignset is None:
+            self.alignset = "https://raw.githubusercontent.com/proycon/folia/master/setdefinitions/naf_alignments.foliaset.xml"
+            if not self.foliadoc.declared(folia.Alignment, self.alignset):
+                self.foliadoc.declare(folia.Alignment, self.alignset)
+        return self.alignset
+
+    def warn(self, category, key, message):
+        """Adds a warning to the collector, only the first time for a given key"""
+        if (category, key) not in self.warned:
+            self.warned.add((category, key))
+            self.collector.warn(category, message)
+
+def convert_senses(naf_term, word, exrefs=None):
+    if exrefs is None:
+        exrefs = ExternalReferences(word.doc)
     senses = defaultdict(list) #resource => []
     for naf_exref in naf_term.get_external_references():
         resource = naf_exref.get_resource()
         reference = naf_exref.get_reference()
-        features = {}
-        confidence = validate_confidence(naf_exref.get_confidence())
-        #if confidence is None: confidence = 0 #needed for sorting later
-
-        if resource.lower().find('wordnet') != -1 or resource.startswith('wn'):
-            #wordnet
-            #see if the ID follows the NAF convention for wordnet
-            if len(reference) > 10 and reference[3] == '-' and reference[6] == '-' and reference[-2] == '-':
-                features = {'version': reference[4:6], 'language': reference[:3],'pos': reference[-1]}
-                reference = reference[7:-2]
-                senses[resource].append( ( confidence, reference, features) )
-
-        elif resource.lower().find('odwn') != -1:
-            #ODWN
-            children_exrefs = []
-            _get_exrefs(naf_exref, children_exrefs)
-            for child_exref in children_exrefs:
-                features[child_exref.get_resource()] = child_exref.get_reference()
-
-            features['pos'] = reference[-1]
-            senses[resource].append( ( confidence, reference, features) )
-        elif resource.lower().find('framenet') != -1:
-            senses[resource].append( ( confidence, reference, features) )
-        else:
-            print("WARNING: Conversion from external reference with resource '" + resource + "' is not known (reference=" + reference+")! Skipping...",file=sys.stderr)
-
-
+        handler = exrefs.sense_handler(resource)
+        if handler is None:
+            exrefs.warn('unknown-resource', resource, "Conversion from external reference with resource '" + resource + "' is not known (first reference=" + reference+")! Skipping all references to it...")
+            continue
+        confidence = validate_confidence(naf_exref.get_confidence(), exrefs.collector)
+        sense = handler.sense(naf_exref, reference)
+        if sense is not None:
+            senses[resource].append( (confidence,) + tuple(sense) )
 
     for resource, sensedata in senses.items():
-        senseset = "https://raw.githubusercontent.com/proycon/folia/master/setdefinitions/naf_sense_" + resource.replace(' ','_') + ".foliaset.xml"
-        word.doc.declare(folia.SenseAnnotation, senseset)
-        #first = True
-        for confidence, reference, features in sensedata: #reversed(sorted(sensedata)): #get highest confidence item first, the rest will be alternatives (DISABLED)
-            #if first:
-            #    anchor = word
-            #else:
-            #    anchor = word.add(folia.Alternative)
+        senseset = exrefs.senseset(resource)
+        for confidence, reference, features in sensedata:
             sense = word.add(folia.SenseAnnotation, set=senseset, cls=reference, confidence=confidence)
             if features:
                 for subset, cls in features.items():
                     sense.add(folia.Feature, subset=subset,cls=cls)
-            #first = False
-
-def convert_sentiment(naf_term, word):
-    unsupported_notice(naf_term.get_sentiment(), "Sentiment")
-
-def convert_terms(nafparser, foliadoc):
-    pos_declared = pos2_declared = lemma_declared = False
-    for naf_term in nafparser.get_terms():
-        span = [ foliadoc.id + '.' + w_id for w_id in naf_term.get_span().get_span_ids() ]
-        if len(span) > 1:
-            #NAF term spans multiple tokens
-            print("WARNING: Convertor limitation: NAF term " + naf_term.get_id() + " spans multiple tokens. Conversion not supported yet!" ,file=sys.stderr)
-        else:
-            word = foliadoc.index[span[0]]
-
-            naf_pos = naf_term.get_pos()
-            if naf_pos:
-                if not pos_declared:
-                    foliadoc.declare(folia.PosAnnotation, "https://raw.githubusercontent.com/proycon/folia/master/setdefinitions/naf_pos.foliaset.xml")
-                    pos_declared = True
-                word.append(folia.PosAnnotation, cls=naf_pos, set="https://raw.githubusercontent.com/proycon/folia/master/setdefinitions/naf_pos.foliaset.xml")
-
-            naf_morphofeat = naf_term.get_morphofeat()
-            if naf_morphofeat:
-                if not pos2_declared:
-                    foliadoc.declare(folia.PosAnnotation, "https://raw.githubusercontent.com/proycon/folia/master/setdefinitions/naf_morphofeat.foliaset.xml")
-                    pos2_declared = True
-                word.append(folia.PosAnnotation, cls=naf_morphofeat, set="https://raw.githubusercontent.com/proycon/folia/master/setdefinitions/naf_morphofeat.foliaset.xml")
-
-            naf_lemma = naf_term.get_lemma()
-            if naf_lemma:
-                if not lemma_declared:
-                    foliadoc.declare(folia.LemmaAnnotation, "https://raw.githubusercontent.com/proycon/folia/master/setdefinitions/naf_lemma.foliaset.xml")
-                    lemma_declared = True
-                word.append(folia.LemmaAnnotation, cls=naf_lemma)
-
-            convert_senses(naf_term, word)
-            convert_sentiment(naf_term, word)
-
-def resolve_span(nafspan, nafparser, foliadoc):
-    """Converts a NAF span to a list of FoLiA objects"""
-    assert isinstance(nafspan, naf.span_data.Cspan)
-    span = []
-    for target in nafspan:
-        naf_term = nafparser.get_term(target.get_id())
-        if naf_term is None:
-            #perhaps it's a token and not a term? Seems to be allows in NAF and happens
-            naf_token = nafparser.get_token(target.get_id())
-            if naf_token is None:
-                raise Exception("NAF span target with ID " + target.get_id() + " failed to resolve (either as term or token ) in span " + ','.join(nafspan.get_span_ids()))
-            try:
-                span.append( foliadoc[foliadoc.id + '.' + naf_token.get_id()] )
-            except KeyError:
-                print("NAF error: Span refers to one or more non-existing term or token IDs:" + ','.join(naf_term.get_span().get_span_ids()) ,  file=sys.stderr)
-        else:
-            try:
-                span += [ foliadoc[foliadoc.id + '.' + w_id] for w_id in naf_term.get_span().get_span_ids() ]
-            except KeyError:
-                print("NAF error: Span refers to one or more non-existing term or token IDs:" + ','.join(naf_term.get_span().get_span_ids()) ,  file=sys.stderr)
-    return span
 
+def convert_sentiment(naf_term, word, collector=PRINT_WARNINGS):
+    unsupported_notice(naf_term.get_sentiment(), "Sentiment", collector)
+
+def convert_terms(nafparser, foliadoc, exrefs=None):
+    if exrefs is None:
+        exrefs = ExternalReferences(foliadoc)
+    for term in token_table(nafparser).terms:
+        convert_term(term, foliadoc, exrefs)
+
+def convert_term(term, foliadoc, exrefs=None):
+    """Converts a NAF term (a Term, or a KafNafParserPy term object) to annotations on the FoLiA word of its token"""
+    if exrefs is None:
+        exrefs = ExternalReferences(foliadoc)
+    if not isinstance(term, Term):
+        term = Term(term.get_node(), 'tid' if term.type == 'KAF' else 'id')
+    posset = POS_SET
+    morphofeatset = MORPHOFEAT_SET
+    lemmaset = LEMMA_SET
+    span = [ foliadoc.id + '.' + w_id for w_id in term.span ]
+    if len(span) > 1:
+        #NAF term spans multiple tokens
+        exrefs.collector.warn('multitoken-term', "Convertor limitation: NAF term " + term.id + " spans multiple tokens. Conversion not supported yet!")
+    else:
+        word = foliadoc.index[span[0]]
+
+        naf_pos = term.pos
+        if naf_pos:
+            if not foliadoc.declared(folia.PosAnnotation, posset):
+                foliadoc.declare(folia.PosAnnotation, posset)
+            word.append(folia.PosAnnotation, cls=naf_pos, set=posset)
+
+        naf_morphofeat = term.morphofeat
+        if naf_morphofeat:
+            if not foliadoc.declared(folia.PosAnnotation, morphofeatset):
+                foliadoc.declare(folia.PosAnnotation, morphofeatset)
+            word.append(folia.PosAnnotation, cls=naf_morphofeat, set=morphofeatset)
+
+        naf_lemma = term.lemma
+        if naf_lemma:
+            if not foliadoc.declared(folia.LemmaAnnotation, lemmaset):
+                foliadoc.declare(folia.LemmaAnnotation, lemmaset)
+            word.append(folia.LemmaAnnotation, cls=naf_lemma)
+
+        if term.node is not None:
+            naf_term = naf.term_data.Cterm(term.node)
+            convert_senses(naf_term, word, exrefs)
+            convert_sentiment(naf_term, word, exrefs.collector)
+
+class LayerRegistry(object):
+    """
+    Keeps track of the annotation layers added to sentences (or the text body), so finding the layer an annotation
+    goes in is a single dictionary lookup rather than a scan of the sentence with an exception on a miss
+    """
 
+    def __init__(self):
+        self.layers = {} #(element id, layer class, set) => layer
 
-def convert_entities(nafparser, foliadoc):
-    entityset =  "https://raw.githubusercontent.com/proycon/folia/master/setdefinitions/naf_entities.foliaset.xml"
-    first = True
-    for naf_entity in nafparser.get_entities():
-        if first:
-            foliadoc.declare(folia.Entity, entityset)
-            first = False
-        naf_references = list(naf_entity.get_references())
-        if len(naf_references) > 1:
-            raise Exception("Entity has multiple references, this was unexpected...",file=sys.stderr)
-        span = resolve_span(naf_references[0].get_span(), nafparser, foliadoc)
-        sentence = span[0].sentence()
-        try:
-            layer = sentence.annotation(folia.EntitiesLayer, entityset)
-        except folia.NoSuchAnnotation:
-            layer = sentence.add(folia.EntitiesLayer, set=entityset)
-        entity = layer.add(folia.Entity, *span,  id=foliadoc.id + '.' + naf_entity.get_id(), set=entityset, cls=naf_entity.get_type())
+    def get(self, element, Class, set):
+        """Returns the layer of the given class and set in the element, adding it if there is none yet"""
+        key = (element.id, Class, set)
+        layer = self.layers.get(key)
+        if layer is None:
+            layer = self.layers[key] = element.add(Class, set=set)
+        return layer
 
-        convert_exrefs(naf_entity, entity)
+    def clear(self):
+        self.layers.clear()
 
-def convert_exrefs(naf_element, folia_element):
-    """Converts external references to alignments. Not all external references are processed here, the ones that are not converted to alignments (but to senses for instance) are processed in convert_senses"""
-    alignset = "https://raw.githubusercontent.com/proycon/folia/master/setdefinitions/naf_alignments.foliaset.xml"
+class NAFResolver(object):
+    """
+    Resolves the NAF term and token IDs that annotations refer to, to the FoLiA words they were converted to.
+    The index is built once the text and terms layers have been converted and is shared by all layer converters,
+    so resolving an ID is a single dictionary lookup. The resolver also holds the registry of annotation layers
+    and the external reference state of the document. The streaming converter provides a resolver with the same
+    interface that only covers the sentence being converted.
+    """
 
-    foliadoc = folia_element.doc
+    def __init__(self, nafparser, foliadoc, exrefs=None):
+        self.words = {} #token id => folia.Word
+        self.sentences = {} #folia word id => folia.Sentence
+        self.terms = {} #term id => [folia.Word], None if the term refers to non-existing tokens
+        self.term_tokens = {} #term id => [token id], only for terms referring to non-existing tokens
+        self.layers = LayerRegistry()
+        self.exrefs = exrefs if exrefs is not None else ExternalReferences(foliadoc)
+
+        prefixlength = len(foliadoc.id) + 1
+        for sentence in foliadoc.sentences():
+            for word in sentence.words():
+                self.words[word.id[prefixlength:]] = word
+                self.sentences[word.id] = sentence
+        for term in token_table(nafparser).terms:
+            if all( w_id in self.words for w_id in term.span ):
+                self.terms[term.id] = [ self.words[w_id] for w_id in term.span ]
+            else:
+                self.terms[term.id] = None
+                self.term_tokens[term.id] = list(term.span)
+
+    def span(self, nafspan):
+        """Converts a NAF span (of terms and/or tokens) to a list of FoLiA words"""
+        assert isinstance(nafspan, naf.span_data.Cspan)
+        span = []
+        for target_id in nafspan.get_span_ids():
+            if target_id in self.terms:
+                words = self.terms[target_id]
+                if words is None:
+                    self.exrefs.collector.warn('nonexisting-ids', "NAF error: Span refers to one or more non-existing term or token IDs:" + ','.join(self.term_tokens[target_id]))
+                else:
+                    span += words
+            elif target_id in self.words:
+                #perhaps it's a token and not a term? Seems to be allows in NAF and happens
+                span.append(self.words[target_id])
+            else:
+                raise Exception("NAF span target with ID " + target_id + " failed to resolve (either as term or token ) in span " + ','.join(nafspan.get_span_ids()))
+        return span
 
-    naf_exrefs = []
-    for naf_exref in naf_element.get_external_references(): #FoLiA does not supported nested references beyond two levels, flatten them
-        naf_exrefs.append(naf_exref)
-        _get_exrefs(naf_exref, naf_exrefs)
+    def term(self, term_id):
+        """Returns the FoLiA words for the tokens a NAF term spans, raises KeyError if it refers to non-existing tokens"""
+        words = self.terms.get(term_id, [])
+        if words is None:
+            raise KeyError(term_id)
+        return words
 
-    for naf_exref in naf_exrefs:
-        if not foliadoc.declared(folia.Alignment, alignset):
-            foliadoc.declare(folia.Alignment, alignset)
+    def tokens(self, token_ids):
+        """Returns the FoLiA words for a list of NAF token IDs, raises KeyError for non-existing tokens"""
+        return [ self.words[w_id] for w_id in token_ids ]
 
-        confidence = validate_confidence(naf_exref.get_confidence())
-        resource = naf_exref.get_resource()
-        reference = naf_exref.get_reference()
-        mimetype = "text/html"
-        if reference.find('://') == -1:
-            #reference is not a URL
-            if resource.lower() == "odwn" or resource.lower().find('wordnet') != -1:
-                if naf_exref.get_source() == "dominant_sense":
-                    #add as feature rather than an alignment
-                    folia_element.add(folia.Feature, subset="ODWN_dominant_sense", cls=reference)
-                else:
-                    alignment = folia_element.add(folia.Alignment, cls=resource, format="application/unknown", confidence=confidence) #location of ontology not defined!
-                    alignment.add(folia.AlignReference, id=reference, type="unknown")
-            elif resource.lower() == "framenet":
-                alignment = folia_element.add(folia.Alignment, cls=resource, format="application/rdf+xml", confidence=confidence) #location of ontology not defined!
-                alignment.add(folia.AlignReference, id="http://www.newsreader-project.eu/framenet#" + reference, type="rdf:description")
-            elif resource.lower() == "eso":
-                alignment = folia_element.add(folia.Alignment, cls=resource, href="https://raw.githubusercontent.com/newsreader/eso/master/ESO_Version2.owl", format="application/rdf+xml", confidence=confidence)
-                alignment.add(folia.AlignReference, id="http://www.newsreader-project.eu/domain-ontology#" + reference, type="rdf:description")
-            else:
-                print("WARNING: External reference '" + reference + "' for resource '" + resource + "' is not a URL! Context ID is " + str(folia_element.id) + ". Skipping...",file=sys.stderr)
+    def sentence(self, word):
+        """Returns the FoLiA sentence a word is in"""
+        return self.sentences[word.id]
+
+
+def convert_entities(nafparser, foliadoc, resolver=None):
+    if resolver is None:
+        resolver = NAFResolver(nafparser, foliadoc)
+    for naf_entity in nafparser.get_entities():
+        convert_entity(naf_entity, foliadoc, resolver)
+
+def convert_entity(naf_entity, foliadoc, resolver):
+    entityset = ENTITY_SET
+    if not foliadoc.declared(folia.Entity, entityset):
+        foliadoc.declare(folia.Entity, entityset)
+    naf_references = list(naf_entity.get_references())
+    if len(naf_references) > 1:
+        raise ValueError("Entity " + naf_entity.get_id() + " has multiple references, this was unexpected...")
+    span = resolver.span(naf_references[0].get_span())
+    sentence = resolver.sentence(span[0])
+    layer = resolver.layers.get(sentence, folia.EntitiesLayer, entityset)
+    entity = layer.add(folia.Entity, *span,  id=foliadoc.id + '.' + naf_entity.get_id(), set=entityset, cls=naf_entity.get_type())
+
+    convert_exrefs(naf_entity, entity, resolver.exrefs)
+
+def convert_exrefs(naf_element, folia_element, exrefs=None):
+    """Converts external references to alignments. Not all external references are processed here, the ones that are not converted to alignments (but to senses for instance) are processed in convert_senses"""
+    if exrefs is None:
+        exrefs = ExternalReferences(folia_element.doc)
+
+    for naf_exref in naf_element.get_external_references():
+        #FoLiA does not supported nested references beyond two levels, flatten them
+        convert_exref(naf_exref, folia_element, exrefs)
+        for child_exref in _nested_exrefs(naf_exref):
+            convert_exref(child_exref, folia_element, exrefs)
+
+def convert_exref(naf_exref, folia_element, exrefs):
+    exrefs.alignmentset()
+    confidence = validate_confidence(naf_exref.get_confidence(), exrefs.collector)
+    resource = naf_exref.get_resource()
+    reference = naf_exref.get_reference()
+    mimetype = "text/html"
+    if reference.find('://') == -1:
+        #reference is not a URL
+        handler = exrefs.alignment_handler(resource)
+        if handler is not None:
+            handler.alignment(naf_exref, folia_element, resource, reference, confidence)
         else:
-            #reference is a URL
-            alignment = folia_element.add(folia.Alignment, cls=resource, href=reference, format=mimetype, confidence=confidence)
+            exrefs.warn('exref-not-url', resource, "External reference '" + reference + "' for resource '" + resource + "' is not a URL! Context ID is " + str(folia_element.id) + ". Skipping all such references to this resource...")
+    else:
+        #reference is a URL
+        alignment = folia_element.add(folia.Alignment, cls=resource, href=reference, format=mimetype, confidence=confidence)
 
 
 
-def convert_markables(nafparser, foliadoc):
-    markableset =  "https://raw.githubusercontent.com/proycon/folia/master/setdefinitions/naf_markables.foliaset.xml"
-    first = True
+def convert_markables(nafparser, foliadoc, resolver=None):
+    if resolver is None:
+        resolver = NAFResolver(nafparser, foliadoc)
     for naf_mark in nafparser.get_markables():
-        if first:
-            foliadoc.declare(folia.Entity, markableset)
-            first = False
-        span = resolve_span(naf_mark.get_span(), nafparser, foliadoc)
-        sentence = span[0].sentence()
-        try:
-            layer = sentence.annotation(folia.EntitiesLayer, markableset)
-        except folia.NoSuchAnnotation:
-            layer = sentence.add(folia.EntitiesLayer, set=markableset)
-        markable = layer.add(folia.Entity, *span,  id=foliadoc.id + '.' + naf_mark.get_id(), set=markableset)
-        if naf_mark.get_lemma():
-            markable.add(folia.Feature, subset="lemma",cls=naf_mark.get_lemma())
-        if naf_mark.get_source():
-            markable.add(folia.Feature, subset="source",cls=naf_mark.get_source())
-
-        convert_exrefs(naf_mark, markable)
-
-def convert_chunks(nafparser, foliadoc):
-    chunkset =  "https://raw.githubusercontent.com/proycon/folia/master/setdefinitions/naf_entities.foliaset.xml"
-    first = True
+        convert_markable(naf_mark, foliadoc, resolver)
+
+def convert_markable(naf_mark, foliadoc, resolver):
+    markableset = MARKABLE_SET
+    if not foliadoc.declared(folia.Entity, markableset):
+        foliadoc.declare(folia.Entity, markableset)
+    span = resolver.span(naf_mark.get_span())
+    sentence = resolver.sentence(span[0])
+    layer = resolver.layers.get(sentence, folia.EntitiesLayer, markableset)
+    markable = layer.add(folia.Entity, *span,  id=foliadoc.id + '.' + naf_mark.get_id(), set=markableset)
+    if naf_mark.get_lemma():
+        markable.add(folia.Feature, subset="lemma",cls=naf_mark.get_lemma())
+    if naf_mark.get_source():
+        markable.add(folia.Feature, subset="source",cls=naf_mark.get_source())
+
+    convert_exrefs(naf_mark, markable, resolver.exrefs)
+
+def convert_chunks(nafparser, foliadoc, resolver=None):
+    if resolver is None:
+        resolver = NAFResolver(nafparser, foliadoc)
     for naf_chunk in nafparser.get_chunks():
-        if first:
-            foliadoc.declare(folia.Chunk, chunkset)
-            first = False
-        span = resolve_span(naf_chunk.get_span(), nafparser, foliadoc)
-        sentence = span[0].sentence()
-        try:
-            layer = sentence.annotation(folia.ChunkingLayer, chunkset)
-        except folia.NoSuchAnnotation:
-            layer = sentence.add(folia.ChunkingLayer, set=chunkset)
-        layer.add(folia.Chunk, *span,  id=foliadoc.id + '.' + naf_chunk.get_id(), set=chunkset, cls=naf_chunk.get_type())
+        convert_chunk(naf_chunk, foliadoc, resolver)
+
+def convert_chunk(naf_chunk, foliadoc, resolver):
+    chunkset = CHUNK_SET
+    if not foliadoc.declared(folia.Chunk, chunkset):
+        foliadoc.declare(folia.Chunk, chunkset)
+    span = resolver.span(naf_chunk.get_span())
+    sentence = resolver.sentence(span[0])
+    layer = resolver.layers.get(sentence, folia.ChunkingLayer, chunkset)
+    layer.add(folia.Chunk, *span,  id=foliadoc.id + '.' + naf_chunk.get_id(), set=chunkset, cls=naf_chunk.get_type())
+
+def convert_coreferences(nafparser, foliadoc, resolver=None):
+    if resolver is None:
+        resolver = NAFResolver(nafparser, foliadoc)
+    for naf_coref in nafparser.get_corefs():
+        convert_coreference(naf_coref, foliadoc, resolver)
 
-def convert_coreferences(nafparser, foliadoc):
+def convert_coreference(naf_coref, foliadoc, resolver):
     textbody = foliadoc.data[0]
-    corefset = {
-        'entity': "https://raw.githubusercontent.com/proycon/folia/master/setdefinitions/naf_coreference.foliaset.xml",
-        'event': "https://raw.githubusercontent.com/proycon/folia/master/setdefinitions/naf_events.foliaset.xml"
-    }
-    declared = defaultdict(bool)
-    layer = {}
-    for naf_coref in nafparser.get_corefs():
-        coreftype = naf_coref.get_type()
-        if not coreftype: coreftype = 'entity'
+    corefset = COREFERENCE_SETS
+    coreftype = naf_coref.get_type()
+    if not coreftype: coreftype = 'entity'
 
-        if not declared[coreftype]:
-            foliadoc.declare(folia.CoreferenceChain, corefset[coreftype])
-            declared[coreftype] = True
+    if not foliadoc.declared(folia.CoreferenceChain, corefset[coreftype]):
+        foliadoc.declare(folia.CoreferenceChain, corefset[coreftype])
 
-        try:
-            layer[coreftype] = textbody.annotation(folia.CoreferenceLayer, corefset[coreftype])
-        except folia.NoSuchAnnotation:
-            layer[coreftype] = textbody.add(folia.CoreferenceLayer, set=corefset[coreftype])
-
-        corefchain = layer[coreftype].add(folia.CoreferenceChain, id=foliadoc.id + '.' + naf_coref.get_id(),  set=corefset[coreftype])
-        for naf_span in naf_coref.get_spans():
-            span =  []
-            for term_id in naf_span.get_span_ids():
-                for w_id in nafparser.get_dict_tokens_for_termid(term_id):
-                    span.append( foliadoc[foliadoc.id + '.' + w_id])
-            corefchain.add(folia.CoreferenceLink, *span)
-
-        convert_exrefs(naf_coref, corefchain)
-
-def convert_semroles(nafparser, foliadoc):
-    predicateset = "https://raw.githubusercontent.com/proycon/folia/master/setdefinitions/naf_predicates.foliaset.xml"
-    semroleset = "https://raw.githubusercontent.com/proycon/folia/master/setdefinitions/naf_semroles.foliaset.xml"
-    declared = False
+    layer = resolver.layers.get(textbody, folia.CoreferenceLayer, corefset[coreftype])
+
+    corefchain = layer.add(folia.CoreferenceChain, id=foliadoc.id + '.' + naf_coref.get_id(),  set=corefset[coreftype])
+    for naf_span in naf_coref.get_spans():
+        span =  []
+        for term_id in naf_span.get_span_ids():
+            span += resolver.term(term_id)
+        corefchain.add(folia.CoreferenceLink, *span)
+
+    convert_exrefs(naf_coref, corefchain, resolver.exrefs)
+
+def convert_semroles(nafparser, foliadoc, resolver=None):
+    if resolver is None:
+        resolver = NAFResolver(nafparser, foliadoc)
     for naf_predicate in nafparser.get_predicates():
-        span = resolve_span(naf_predicate.get_span(), nafparser, foliadoc)
-        sentence = span[0].sentence()
+        convert_predicate(naf_predicate, foliadoc, resolver)
 
-        if not declared:
-            foliadoc.declare(folia.SemanticRole, semroleset)
-            foliadoc.declare(folia.Predicate, predicateset)
-            declared = True
+def convert_predicate(naf_predicate, foliadoc, resolver):
+    predicateset = PREDICATE_SET
+    semroleset = SEMROLE_SET
+    span = resolver.span(naf_predicate.get_span())
+    sentence = resolver.sentence(span[0])
 
-        try:
-            layer = sentence.annotation(folia.SemanticRolesLayer, semroleset)
-        except folia.NoSuchAnnotation:
-            layer = sentence.add(folia.SemanticRolesLayer, set=semroleset)
+    if not foliadoc.declared(folia.Predicate, predicateset):
+        foliadoc.declare(folia.SemanticRole, semroleset)
+        foliadoc.declare(folia.Predicate, predicateset)
+
+    layer = resolver.layers.get(sentence, folia.SemanticRolesLayer, semroleset)
 
-        predicate_class = naf_predicate.get_uri()
-        confidence = validate_confidence(naf_predicate.get_confidence())
+    predicate_class = naf_predicate.get_uri()
+    confidence = validate_confidence(naf_predicate.get_confidence(), resolver.exrefs.collector)
 
-        predicate = layer.add(folia.Predicate, *span, id=foliadoc.id + '.' + naf_predicate.get_id(), set=predicateset, cls=predicate_class, confidence=confidence)
+    predicate = layer.add(folia.Predicate, *span, id=foliadoc.id + '.' + naf_predicate.get_id(), set=predicateset, cls=predicate_class, confidence=confidence)
 
-        for naf_role in naf_predicate.get_roles():
-            semrole_class = naf_role.get_sem_role()
-            span = resolve_span(naf_role.get_span(), nafparser, foliadoc)
+    for naf_role in naf_predicate.get_roles():
+        semrole_class = naf_role.get_sem_role()
+        span = resolver.span(naf_role.get_span())
 
-            semrole = predicate.add(folia.SemanticRole, *span,  id=foliadoc.id + '.' + naf_role.get_id(), set=semroleset, cls=semrole_class)
-            # - NAF has no support for confidence on semantic roles
+        semrole = predicate.add(folia.SemanticRole, *span,  id=foliadoc.id + '.' + naf_role.get_id(), set=semroleset, cls=semrole_class)
+        # - NAF has no support for confidence on semantic roles
 
-            convert_exrefs(naf_role, semrole)
-        convert_exrefs(naf_predicate, predicate)
+        convert_exrefs(naf_role, semrole, resolver.exrefs)
+    convert_exrefs(naf_predicate, predicate, resolver.exrefs)
 
-def convert_dependencies(nafparser, foliadoc):
-    depset = "https://raw.githubusercontent.com/proycon/folia/master/setdefinitions/naf_dependencies.foliaset.xml"
-    declared = False
+def convert_dependencies(nafparser, foliadoc, resolver=None):
+    if resolver is None:
+        resolver = NAFResolver(nafparser, foliadoc)
     for naf_dep in nafparser.get_dependencies():
-        naf_term = nafparser.get_term(naf_dep.get_from())
-        hd_span = [ foliadoc[foliadoc.id + '.' + w_id] for w_id in naf_term.get_span().get_span_ids() ]
+        convert_dependency(naf_dep, foliadoc, resolver)
 
-        naf_term = nafparser.get_term(naf_dep.get_to())
-        dep_span = [ foliadoc[foliadoc.id + '.' + w_id] for w_id in naf_term.get_span().get_span_ids() ]
+def convert_dependency(naf_dep, foliadoc, resolver):
+    depset = DEPENDENCY_SET
+    hd_span = resolver.term(naf_dep.get_from())
+    dep_span = resolver.term(naf_dep.get_to())
 
-        sentence = hd_span[0].sentence()
-        assert dep_span[0].sentence() is sentence
+    sentence = resolver.sentence(hd_span[0])
+    if resolver.sentence(dep_span[0]) is not sentence:
+        raise ValueError("Dependency from " + naf_dep.get_from() + " to " + naf_dep.get_to() + " crosses a sentence boundary")
 
-        if not declared:
-            foliadoc.declare(folia.Dependency, depset)
-            declared = True
+    if not foliadoc.declared(folia.Dependency, depset):
+        foliadoc.declare(folia.Dependency, depset)
 
-        try:
-            layer = sentence.annotation(folia.DependenciesLayer, depset)
-        except folia.NoSuchAnnotation:
-            layer = sentence.add(folia.DependenciesLayer, set=depset)
-
-        dependency = layer.add(folia.Dependency, set=depset, cls=naf_dep.get_function() )
-        dependency.add(folia.Headspan, *hd_span)
-        dependency.add(folia.DependencyDependent, *dep_span)
-        # - NAF has no support for IDs or confidence on dependencies
-
-def convert_opinions(nafparser, foliadoc):
-    sentimentset = "https://raw.githubusercontent.com/proycon/folia/master/setdefinitions/naf_sentiment.foliaset.xml"
-    declared = False
-    for naf_opinion in nafparser.get_opinions():
-        if naf_opinion.get_expression():
-            if not declared:
-                foliadoc.declare(folia.Sentiment, sentimentset)
-                declared = True
+    layer = resolver.layers.get(sentence, folia.DependenciesLayer, depset)
 
-            span = resolve_span(naf_opinion.get_expression().get_span(), nafparser, foliadoc)
-            sentence = span[0].sentence()
+    dependency = layer.add(folia.Dependency, set=depset, cls=naf_dep.get_function() )
+    dependency.add(folia.Headspan, *hd_span)
+    dependency.add(folia.DependencyDependent, *dep_span)
+    # - NAF has no support for IDs or confidence on dependencies
 
-            try:
-                layer = sentence.annotation(folia.SentimentLayer, sentimentset)
-            except folia.NoSuchAnnotation:
-                layer = sentence.add(folia.SentimentLayer, set=sentimentset)
-
-            sentiment = layer.add(folia.Sentiment, id=foliadoc.id + '.' + naf_opinion.get_id(), set=sentimentset)
-
-            if naf_opinion.get_expression().get_polarity():
-                sentiment.add(folia.Feature,subset='polarity',cls=naf_opinion.get_expression().get_polarity())
-            if naf_opinion.get_expression().get_strength():
-                sentiment.add(folia.Feature,subset='strength',cls=naf_opinion.get_expression().get_strength())
-            if naf_opinion.get_expression().get_subjectivity():
-                sentiment.add(folia.Feature,subset='subjectivity',cls=naf_opinion.get_expression().get_subjectivity())
-            if naf_opinion.get_expression().get_sentiment_semantic_type():
-                sentiment.add(folia.Feature,subset='semantic_type',cls=naf_opinion.get_expression().get_sentiment_semantic_type())
-            if naf_opinion.get_expression().get_sentiment_product_feature():
-                sentiment.add(folia.Feature,subset='product_feature',cls=naf_opinion.get_expression().get_sentiment_product_feature())
-
-            sentiment.add(folia.Headspan, *span)
-            if naf_opinion.get_holder():
-                span = resolve_span(naf_opinion.get_holder().get_span(), nafparser, foliadoc)
-                sentiment.add(folia.Source, *span)
-            if naf_opinion.get_target():
-                span = resolve_span(naf_opinion.get_target().get_span(), nafparser, foliadoc)
-                sentiment.add(folia.Target, *span)
-
-
-def convert_timeexpressions(nafparser, foliadoc):
-    timexset = "https://raw.githubusercontent.com/proycon/folia/master/setdefinitions/naf_timex3.foliaset.xml"
-    first = True
+def convert_opinions(nafparser, foliadoc, resolver=None):
+    if resolver is None:
+        resolver = NAFResolver(nafparser, foliadoc)
+    for naf_opinion in nafparser.get_opinions():
+        if naf_opinion.get_expression():
+            convert_opinion(naf_opinion, foliadoc, resolver)
+
+def convert_opinion(naf_opinion, foliadoc, resolver):
+    sentimentset = SENTIMENT_SET
+    if not foliadoc.declared(folia.Sentiment, sentimentset):
+        foliadoc.declare(folia.Sentiment, sentimentset)
+
+    span = resolver.span(naf_opinion.get_expression().get_span())
+    sentence = resolver.sentence(span[0])
+
+    layer = resolver.layers.get(sentence, folia.SentimentLayer, sentimentset)
+
+    sentiment = layer.add(folia.Sentiment, id=foliadoc.id + '.' + naf_opinion.get_id(), set=sentimentset)
+
+    if naf_opinion.get_expression().get_polarity():
+        sentiment.add(folia.Feature,subset='polarity',cls=naf_opinion.get_expression().get_polarity())
+    if naf_opinion.get_expression().get_strength():
+        sentiment.add(folia.Feature,subset='strength',cls=naf_opinion.get_expression().get_strength())
+    if naf_opinion.get_expression().get_subjectivity():
+        sentiment.add(folia.Feature,subset='subjectivity',cls=naf_opinion.get_expression().get_subjectivity())
+    if naf_opinion.get_expression().get_sentiment_semantic_type():
+        sentiment.add(folia.Feature,subset='semantic_type',cls=naf_opinion.get_expression().get_sentiment_semantic_type())
+    if naf_opinion.get_expression().get_sentiment_product_feature():
+        sentiment.add(folia.Feature,subset='product_feature',cls=naf_opinion.get_expression().get_sentiment_product_feature())
+
+    sentiment.add(folia.Headspan, *span)
+    if naf_opinion.get_holder():
+        span = resolver.span(naf_opinion.get_holder().get_span())
+        sentiment.add(folia.Source, *span)
+    if naf_opinion.get_target():
+        span = resolver.span(naf_opinion.get_target().get_span())
+        sentiment.add(folia.Target, *span)
+
+
+def convert_timeexpressions(nafparser, foliadoc, resolver=None):
+    if resolver is None:
+        resolver = NAFResolver(nafparser, foliadoc)
     for naf_timex in nafparser.get_timeExpressions():
         if naf_timex:
-            if first:
-                foliadoc.declare(folia.Entity, timexset)
-                first = False
-            if not naf_timex.get_span():
-                #NAF has meta constructs like: <timex3 functionInDocument="CREATION_TIME" id="tx1" type="DATE" value="2005-05-07"/>
-                #These can not be covered by FoLiA entities as they do not refer to the text.
-                print("WARNING: Time expression has no span and can not be converted: " + naf_timex.get_id() ,file=sys.stderr)
-                continue
-            try:
-                span = [ foliadoc[foliadoc.id + '.' + w_id] for w_id in naf_timex.get_span().get_span_ids() ]
-            except KeyError:
-                print("NAF error: Span refers to one or more non-existing token IDs:" + ','.join(naf_timex.get_span().get_span_ids()) ,  file=sys.stderr)
-            sentence = span[0].sentence()
-            try:
-                layer = sentence.annotation(folia.EntitiesLayer, timexset)
-            except folia.NoSuchAnnotation:
-                layer = sentence.add(folia.EntitiesLayer, set=timexset)
-            timex = layer.add(folia.Entity, *span,  id=foliadoc.id + '.' + naf_timex.get_id(), cls=naf_timex.get_type(), set=timexset)
-            if naf_timex.get_value():
-                timex.add(folia.Feature, subset="value",cls=naf_timex.get_value())
-            if naf_timex.get_mod():
-                timex.add(folia.Feature, subset="mod",cls=naf_timex.get_mod())
-            if naf_timex.get_quant():
-                timex.add(folia.Feature, subset="quant",cls=naf_timex.get_quant())
-            if naf_timex.get_freq():
-                timex.add(folia.Feature, subset="freq",cls=naf_timex.get_freq())
-            if naf_timex.get_temporalFunction():
-                timex.add(folia.Feature, subset="temporalFunction",cls=naf_timex.get_temporalFunction())
-            if naf_timex.get_valueFromFunction():
-                timex.add(folia.Feature, subset="valueFromFunction",cls=naf_timex.get_valueFromFunction())
-            if naf_timex.get_functionInDocument():
-                timex.add(folia.Feature, subset="functionInDocument",cls=naf_timex.get_functionInDocument())
-            if naf_timex.get_comment():
-                timex.add(folia.Comment, value=naf_timex.get_comment())
-            #TODO: beginPoint and endPoint are not handled yet, best solved with alignments
-
-
-def convert_temporalrelations(nafparser, foliadoc):
-    unsupported_notice(nafparser.get_tlinks(), "Temporal Relations")
-
-def convert_causalrelations(nafparser, foliadoc):
+            convert_timeexpression(naf_timex, foliadoc, resolver)
+
+def convert_timeexpression(naf_timex, foliadoc, resolver):
+    timexset = TIMEX_SET
+    if not foliadoc.declared(folia.Entity, timexset):
+        foliadoc.declare(folia.Entity, timexset)
+    if not naf_timex.get_span():
+        #NAF has meta constructs like: <timex3 functionInDocument="CREATION_TIME" id="tx1" type="DATE" value="2005-05-07"/>
+        #These can not be covered by FoLiA entities as they do not refer to the text.
+        resolver.exrefs.collector.warn('timex-without-span', "Time expression has no span and can not be converted: " + naf_timex.get_id())
+        return
+    try:
+        span = resolver.tokens(naf_timex.get_span().get_span_ids())
+    except KeyError:
+        resolver.exrefs.collector.warn('nonexisting-ids', "NAF error: Span refers to one or more non-existing token IDs:" + ','.join(naf_timex.get_span().get_span_ids()))
+        return
+    sentence = resolver.sentence(span[0])
+    layer = resolver.layers.get(sentence, folia.EntitiesLayer, timexset)
+    timex = layer.add(folia.Entity, *span,  id=foliadoc.id + '.' + naf_timex.get_id(), cls=naf_timex.get_type(), set=timexset)
+    if naf_timex.get_value():
+        timex.add(folia.Feature, subset="value",cls=naf_timex.get_value())
+    if naf_timex.get_mod():
+        timex.add(folia.Feature, subset="mod",cls=naf_timex.get_mod())
+    if naf_timex.get_quant():
+        timex.add(folia.Feature, subset="quant",cls=naf_timex.get_quant())
+    if naf_timex.get_freq():
+        timex.add(folia.Feature, subset="freq",cls=naf_timex.get_freq())
+    if naf_timex.get_temporalFunction():
+        timex.add(folia.Feature, subset="temporalFunction",cls=naf_timex.get_temporalFunction())
+    if naf_timex.get_valueFromFunction():
+        timex.add(folia.Feature, subset="valueFromFunction",cls=naf_timex.get_valueFromFunction())
+    if naf_timex.get_functionInDocument():
+        timex.add(folia.Feature, subset="functionInDocument",cls=naf_timex.get_functionInDocument())
+    if naf_timex.get_comment():
+        timex.add(folia.Comment, value=naf_timex.get_comment())
+    #TODO: beginPoint and endPoint are not handled yet, best solved with alignments
+
+
+def convert_temporalrelations(nafparser, foliadoc, collector=PRINT_WARNINGS):
+    unsupported_notice(nafparser.get_tlinks(), "Temporal Relations", collector)
+
+def convert_causalrelations(nafparser, foliadoc, collector=PRINT_WARNINGS):
     #Not documented in NAF specification yet
-    unsupported_notice(nafparser.get_clinks(), "Causal Relations")
+    unsupported_notice(nafparser.get_clinks(), "Causal Relations", collector)
 
-def convert_syntax(nafparser, foliadoc):
-    unsupported_notice(nafparser.get_trees(), "Constituency Parse (syntax)")
+def convert_syntax(nafparser, foliadoc, collector=PRINT_WARNINGS):
+    unsupported_notice(nafparser.get_trees(), "Constituency Parse (syntax)", collector)
 
-def convert_factuality(nafparser, foliadoc):
-    unsupported_notice(nafparser.factuality_layer, "Factuality")
+def convert_factuality(nafparser, foliadoc, collector=PRINT_WARNINGS):
+    unsupported_notice(nafparser.factuality_layer, "Factuality", collector)
 
 
 def convert_attribution(nafparser, foliadoc):
@@ -490,36 +842,8 @@ def convert_attribution(nafparser, foliadoc):
 
 
 
-def naf2folia(naffile, docid=None):
-    """
-    Converts a NAF Document to FoLiA, returns a FoLiA document instance.
-    :param naffile: The NAF file to load (str) or ready instance of KafNafParser
-    :param docid: the ID for the FoLiA document, will be derived from the filename if not specified (may not always work out) (str)
-    :return: a folia.Document instance
-    """
-
-    if not isinstance(naffile, naf.KafNafParser):
-        nafparser = naf.KafNafParser(naffile)
-    else:
-        nafparser = naffile
-        naffile = nafparser.get_filename()
-
-    if not docid:
-        #derive document ID from filename
-        docid = os.path.basename(naffile).split('.')[0]
-        try:
-            folia.isncname(docid)
-        except ValueError:
-            print("Document ID can not be extracted from filename (invalid XML NCName), please set --id manually",file=sys.stderr)
-            sys.exit(2)
-
-    foliadoc = folia.Document(id=docid)
-    foliadoc.declare(folia.Word, 'undefined')
-    foliadoc.declare(folia.Sentence, 'undefined')
-    foliadoc.metadata['language'] = nafparser.get_language()
-
-    #Convert metadata from nafHeader/fileDesc and nafHeader/public
-    naf_header = nafparser.get_header()
+def convert_metadata(naf_header, foliadoc):
+    """Converts metadata from nafHeader/fileDesc and nafHeader/public to FoLiA's native metadata"""
     if naf_header.get_publicId(): foliadoc.metadata['publicId'] = naf_header.get_publicId()
     try:
         if naf_header.get_uri(): foliadoc.metadata['source'] = naf_header.get_uri()
@@ -539,21 +863,190 @@ def naf2folia(naffile, docid=None):
         if naf_filedesc.get_section(): foliadoc.metadata['section'] = naf_filedesc.get_section()
 
 
-    convert_text_layer(nafparser,foliadoc)
-    convert_terms(nafparser, foliadoc)
-    convert_entities(nafparser, foliadoc)
-    convert_markables(nafparser, foliadoc)
-    convert_chunks(nafparser, foliadoc)
-    convert_coreferences(nafparser, foliadoc)
-    convert_semroles(nafparser, foliadoc)
-    convert_dependencies(nafparser, foliadoc)
-    convert_timeexpressions(nafparser, foliadoc)
-    convert_temporalrelations(nafparser, foliadoc)
-    convert_causalrelations(nafparser, foliadoc)
-    convert_syntax(nafparser, foliadoc)
-    convert_factuality(nafparser, foliadoc)
-    convert_opinions(nafparser, foliadoc)
-    convert_attribution(nafparser, foliadoc)
+def select_layers(layers=None):
+    """
+    Validates a selection of layers to convert
+    :param layers: names of the layers (see LAYERS), as a list or a comma separated string, None for all layers
+    :return: the set of selected layer names, always including the text (frozenset)
+    """
+    if layers is None:
+        return frozenset(LAYERS)
+    if isinstance(layers, str):
+        layers = layers.split(',')
+    layers = set( layer.strip() for layer in layers if layer.strip() )
+    unknown = layers - set(LAYERS)
+    if unknown:
+        raise ValueError("Unknown layer(s): " + ', '.join(sorted(unknown)) + ". Choose from: " + ', '.join(LAYERS))
+    layers.add('text')
+    return frozenset(layers)
+
+def naf_layer_tags(layers):
+    """
+    Returns the tags of the NAF layers that have to be read for a selection of layers
+    :param layers: the selected layers, as returned by select_layers()
+    :return: set of NAF layer tags
+    """
+    tags = set( tag for layer in layers for tag in LAYERS[layer] )
+    if any( layer in layers for layer in TERM_REFERRING_LAYERS ):
+        tags.add('terms')
+    return tags
+
+_ParsedNAF = None
+
+def parsed_naf(tree, filename=None):
+    """
+    Returns a KafNafParser for a NAF document that has already been parsed. KafNafParser can only parse a document
+    itself: its constructor sets self.tree, which a subclass ignores in favour of the given tree. The subclass is
+    defined on first use, as KafNafParserPy is imported lazily.
+    :param tree: the NAF document (lxml ElementTree)
+    :param filename: path the document was read from (str)
+    :return: KafNafParser instance
+    """
+    global _ParsedNAF
+    if _ParsedNAF is None:
+        class ParsedNAF(naf.KafNafParser):
+            def __init__(self, tree):
+                self._tree = tree
+                naf.KafNafParser.__init__(self, None, tree.getroot().tag)
+
+            @property
+            def tree(self):
+                return self._tree
+
+            @tree.setter
+            def tree(self, value):
+                #the constructor of KafNafParser sets None and then an empty document
+                pass
+        _ParsedNAF = ParsedNAF
+    nafparser = _ParsedNAF(tree)
+    nafparser.filename = filename
+    return nafparser
+
+def load_naf(naffile, layers=None):
+    """
+    Loads a NAF document, leaving out the layers that are not needed for a selection of layers. Those are discarded
+    while parsing, so they are never wrapped, indexed or walked; the document is parsed once.
+    :param naffile: path to the NAF document (str), may be compressed (see naffoliapy.compression), or a binary file object
+    :param layers: the selected layers, as returned by select_layers(), None for all layers
+    :return: KafNafParser instance
+    """
+    with compression.readable(naffile) as source:
+        if layers is None or layers == frozenset(LAYERS):
+            nafparser = naf.KafNafParser(source)
+            nafparser.filename = naffile
+            return nafparser
+        skip = set( tag for tags in LAYERS.values() for tag in tags ) - naf_layer_tags(layers)
+        context = etree.iterparse(source, events=('end',), tag=tuple(skip), remove_blank_text=True)
+        for _, node in context:
+            parent = node.getparent()
+            if parent is not None and parent.getparent() is None:
+                #a layer (the tags may also be used deeper down in other layers)
+                parent.remove(node)
+    return parsed_naf(context.root.getroottree(), naffile)
+
+def layer_size(nafparser, layer):
+    """
+    Returns the number of elements in a layer of a NAF document
+    :param nafparser: KafNafParser instance
+    :param layer: name of the layer (see LAYERS)
+    :return: int
+    """
+    return sum( len(node) for node in ( nafparser.root.find(tag) for tag in LAYERS[layer] ) if node is not None )
+
+def convert_layer(nafparser, foliadoc, profiler, layer, function, *args):
+    """Converts a layer with the given conversion function, measuring it with the profiler"""
+    with profiler.stage(layer) as stage:
+        function(nafparser, foliadoc, *args)
+        if profiler.enabled:
+            stage.count = layer_size(nafparser, layer)
+
+def convert_layers(nafparser, foliadoc, layers, exrefs, profiler=NULL_PROFILER, term_converter=convert_terms, resolver_class=NAFResolver):
+    """
+    Converts annotation layers of a NAF document to a FoLiA document the text has already been converted to
+    :param nafparser: KafNafParser instance
+    :param foliadoc: folia.Document instance
+    :param layers: names of the layers to convert (see LAYERS), except the text (set)
+    :param exrefs: ExternalReferences instance of the document, also holding its warning collector
+    :param profiler: a naffoliapy.profiling.Profiler that measures every layer
+    :param term_converter: function that converts the terms layer, called like convert_terms()
+    :param resolver_class: class (or function) of the resolver of the other layers, called like NAFResolver()
+    """
+    warnings = exrefs.collector
+    convert = functools.partial(convert_layer, nafparser, foliadoc, profiler)
+    if 'terms' in layers:
+        convert('terms', term_converter, exrefs)
+    if any( layer in layers for layer in TERM_REFERRING_LAYERS ):
+        with profiler.stage('resolver'):
+            resolver = resolver_class(nafparser, foliadoc, exrefs)
+    if 'entities' in layers:
+        convert('entities', convert_entities, resolver)
+    if 'markables' in layers:
+        convert('markables', convert_markables, resolver)
+    if 'chunks' in layers:
+        convert('chunks', convert_chunks, resolver)
+    if 'coreferences' in layers:
+        convert('coreferences', convert_coreferences, resolver)
+    if 'srl' in layers:
+        convert('srl', convert_semroles, resolver)
+    if 'deps' in layers:
+        convert('deps', convert_dependencies, resolver)
+    if 'timex' in layers:
+        convert('timex', convert_timeexpressions, resolver)
+    if 'temporalrelations' in layers:
+        convert('temporalrelations', convert_temporalrelations, warnings)
+    if 'causalrelations' in layers:
+        convert('causalrelations', convert_causalrelations, warnings)
+    if 'constituency' in layers:
+        convert('constituency', convert_syntax, warnings)
+    if 'factuality' in layers:
+        convert('factuality', convert_factuality, warnings)
+    if 'opinions' in layers:
+        convert('opinions', convert_opinions, resolver)
+    if 'attribution' in layers:
+        convert('attribution', convert_attribution)
+
+def naf2folia(naffile, docid=None, layers=None, profiler=None, collector=None, bulk=False, validate=True):
+    """
+    Converts a NAF Document to FoLiA, returns a FoLiA document instance.
+    :param naffile: The NAF file to load (str) or ready instance of KafNafParser
+    :param docid: the ID for the FoLiA document, will be derived from the filename if not specified (see derive_docid()) (str)
+    :param layers: names of the layers to convert (see LAYERS), as a list or comma separated string, None for all. Layers that are not selected are not read.
+    :param profiler: a naffoliapy.profiling.Profiler that measures every stage of the conversion
+    :param collector: a naffoliapy.diagnostics.WarningCollector to add the warnings to, if not specified the first warnings of every kind are written to stderr
+    :param bulk: build the FoLiA document without pynlpl's checks on every added element, and make them once on the finished document, see naffoliapy.bulk (bool)
+    :param validate: with bulk, False skips the checks on the finished document as well, for input known to convert to valid FoLiA (bool)
+    :return: a folia.Document instance
+    """
+    layers = select_layers(layers)
+    if profiler is None:
+        profiler = NULL_PROFILER
+    if collector is None:
+        warnings = WarningCollector(stream=sys.stderr)
+    else:
+        warnings = collector
+
+    if not isinstance(naffile, naf.KafNafParser):
+        with profiler.stage('load'):
+            nafparser = load_naf(naffile, layers)
+    else:
+        nafparser = naffile
+        naffile = nafparser.get_filename()
+
+    if not docid:
+        docid = derive_docid(naffile)
+
+    foliadoc = folia.Document(id=docid)
+    foliadoc.declare(folia.Word, 'undefined')
+    foliadoc.declare(folia.Sentence, 'undefined')
+    foliadoc.metadata['language'] = nafparser.get_language()
+    convert_metadata(nafparser.get_header(), foliadoc)
+
+    with bulk_build(bulk):
+        convert_layer(nafparser, foliadoc, profiler, 'text', convert_text_layer, warnings)
+        convert_layers(nafparser, foliadoc, layers - {'text'}, ExternalReferences(foliadoc, warnings), profiler)
+    if bulk and validate:
+        with profiler.stage('validate'):
+            validate_folia(foliadoc)
 
     #add annotator information to declarations
     #NAF may have multiple annotators per layer, making it not entirely clear
@@ -563,26 +1056,318 @@ def naf2folia(naffile, docid=None):
     #TODO: missing functionality in kafnafparser to iterate over linguistic processors (issue cltl/KafNafParserPy#13)
     #foliadoc.defaultannotator(folia.Word,
 
+    if collector is None:
+        warnings.flush()
     return foliadoc
 
 
+def derive_docid(naffile):
+    """
+    Derives a FoLiA document ID from a filename, replacing every character other than ASCII letters, digits, '_',
+    '.' and '-' (a subset of what an XML NCName allows, so the ID is always valid)
+    :param naffile: path to the NAF document (str)
+    :return: document ID (str)
+    """
+    docid = re.sub(r'[^A-Za-z0-9_.-]', '_', os.path.basename(naffile).split('.')[0])
+    if not re.match(r'[A-Za-z_]', docid):
+        docid = '_' + docid
+    return docid
+
+def naf_docid(nafparser, default='untitled'):
+    """
+    Derives a FoLiA document ID for a NAF document that was not read from a file, from the public ID in its header
+    :param nafparser: KafNafParser instance
+    :param default: document ID if the NAF document has no public ID (str)
+    :return: document ID (str)
+    """
+    header = nafparser.get_header()
+    publicid = header.get_publicId() if header is not None else None
+    return derive_docid(publicid) if publicid else default
+
+def naf2folia_bytes(payload, docid=None, layers=None, collector=None, bulk=False, validate=True, direct=False):
+    """
+    Converts a NAF document held in memory, for pipe mode (see naffoliapy.pipe)
+    :param payload: the NAF document (bytes), may be compressed (see naffoliapy.compression)
+    :param docid: the ID for the FoLiA document, will be derived from the public ID of the NAF document if not specified (str)
+    :param layers: names of the layers to convert, None for all (see naf2folia())
+    :param collector: a naffoliapy.diagnostics.WarningCollector to add the warnings to, if not specified the first warnings of every kind are written to stderr
+    :param bulk: build the FoLiA document with deferred validation (see naf2folia())
+    :param validate: with bulk, False skips the validation of the finished document (see naf2folia())
+    :param direct: write the FoLiA XML directly, see naffoliapy.foliawriter (bool)
+    :return: the FoLiA document (bytes)
+    """
+    nafparser = load_naf(io.BytesIO(compression.decompress(payload)), select_layers(layers))
+    if direct:
+        from naffoliapy.foliawriter import naf2folia_direct
+        output = io.BytesIO()
+        naf2folia_direct(nafparser, output, docid or naf_docid(nafparser), layers, collector=collector)
+        return output.getvalue()
+    foliadoc = naf2folia(nafparser, docid or naf_docid(nafparser), layers, collector=collector, bulk=bulk, validate=validate)
+    return foliadoc.xmlstring().encode('utf-8')
+
+def save_folia(foliadoc, foliafile, compress=None):
+    """
+    Saves a FoLiA document, compressed if asked for or if the filename has a compression extension
+    :param foliadoc: folia.Document instance
+    :param foliafile: path to the FoLiA output document (str)
+    :param compress: compression format ('gz', 'xz' or 'zst'), by default it follows the extension of the filename
+    """
+    if compression.output_format(foliafile, compress) is None:
+        foliadoc.save(foliafile)
+    else:
+        with compression.open_output(foliafile, compress) as f:
+            f.write(foliadoc.xmlstring().encode('utf-8'))
+
+def convert_file(naffile, foliafile, docid=None, stream=False, layers=None, profiler=None, collector=None, cache=None, incremental=False, compress=None, bulk=False, validate=True, direct=False):
+    """
+    Converts a NAF file and saves the result as a FoLiA file, used as the conversion function for batch mode
+    :param naffile: path to the NAF input document (str), may be compressed (see naffoliapy.compression)
+    :param foliafile: path to the FoLiA output document (str)
+    :param docid: the ID for the FoLiA document, will be derived from the filename if not specified (str)
+    :param stream: convert one sentence at a time with bounded memory use, see naffoliapy.nafstream (bool)
+    :param layers: names of the layers to convert, None for all (see naf2folia())
+    :param profiler: a naffoliapy.profiling.Profiler that measures every stage of the conversion, the streaming conversion is measured as a whole
+    :param collector: a naffoliapy.diagnostics.WarningCollector to add the warnings to, if not specified the first warnings of every kind are written to stderr
+    :param cache: a naffoliapy.cache.ConversionCache, the document is only converted if it is not in the cache yet
+    :param incremental: only convert the layers that changed since the FoLiA document was last converted, see naffoliapy.incremental (bool)
+    :param compress: compression format of the FoLiA document ('gz', 'xz' or 'zst'), by default it follows the extension of its filename
+    :param bulk: build the FoLiA document with deferred validation (see naf2folia()), not used with stream or incremental
+    :param validate: with bulk, False skips the validation of the finished document (see naf2folia())
+    :param direct: write the FoLiA XML directly rather than building the FoLiA document, see naffoliapy.foliawriter (bool), not used with stream or incremental
+    :return: summary of the warnings (dict, see WarningCollector.summary())
+    """
+    if not docid:
+        docid = derive_docid(naffile)
+    if profiler is None:
+        profiler = NULL_PROFILER
+    if cache is not None:
+        options = {'docid': docid, 'stream': bool(stream), 'layers': sorted(select_layers(layers))}
+        if compression.output_format(foliafile, compress):
+            options['compression'] = compression.output_format(foliafile, compress)
+        key = cache.key(naffile, 'naf2folia', VERSION, options)
+        metadata = cache.get(key, foliafile)
+        if metadata is not None:
+            if collector is not None:
+                collector.update(metadata['warnings'])
+            return metadata['warnings']
+    warnings = collector if collector is not None else WarningCollector(stream=sys.stderr)
+    if stream:
+        from naffoliapy.nafstream import naf2folia_stream
+        with profiler.stage('stream'):
+            naf2folia_stream(naffile, foliafile, docid, layers, warnings, compress)
+    elif incremental:
+        from naffoliapy.incremental import naf2folia_incremental
+        naf2folia_incremental(naffile, foliafile, docid, layers, profiler, warnings, compress)
+    elif direct:
+        from naffoliapy.foliawriter import naf2folia_direct
+        naf2folia_direct(naffile, foliafile, docid, layers, profiler, warnings, compress)
+    else:
+        foliadoc = naf2folia(naffile, docid, layers, profiler, warnings, bulk, validate)
+        with profiler.stage('serialize'):
+            save_folia(foliadoc, foliafile, compress)
+    if collector is None:
+        warnings.flush()
+    if cache is not None:
+        cache.put(key, foliafile, converter='naf2folia', input=naffile, warnings=warnings.summary())
+    return warnings.summary()
+
+def convert_file_stream(naffile, foliafile):
+    #Module-level so it can be passed to batch worker processes
+    convert_file(naffile, foliafile, stream=True)
+
+def preload():
+    #Imports the lazily imported modules (see naffoliapy.lazy) in a new batch worker process, so this does not count
+    #towards the time limit of its first document; using an attribute of such a module imports it
+    return etree.XMLParser, naf.KafNafParser, folia.Document
+
 def main():
-    parser = argparse.ArgumentParser(description="NAF to FoLiA convertor", formatter_class=argparse.ArgumentDefaultsHelpFormatter)
-    parser.add_argument('naffile', nargs='?', help='Path to a NAF input document')
-    parser.add_argument('foliafile', nargs='?', help='Path to a FoLiA output document')
+    parser = argparse.ArgumentParser(description="NAF to FoLiA convertor", formatter_class=argparse.ArgumentDefaultsHelpFormatter, fromfile_prefix_chars='@')
+    parser.add_argument('files', nargs='*', metavar='file', help='Path to a NAF input document, optionally followed by the path to a FoLiA output document (- for stdin and stdout, stdout is the default). In batch mode (--outputdir): any number of NAF documents, directories or glob patterns; use @file to read these from a manifest file with one per line')
     parser.add_argument('--id', type=str,help="Document ID for the FoLiA document (will be derived from the filename if not set)", action='store',default="",required=False)
+    parser.add_argument('-O','--outputdir', type=str,help="Batch mode: convert all input documents and write them to this directory, mirroring the input tree", action='store',default="",required=False)
+    parser.add_argument('-j','--workers', type=int,help="Batch mode: number of worker processes (defaults to the number of CPUs)", action='store',default=None,required=False)
+    parser.add_argument('--extensions', type=str,help="Batch mode: comma separated list of filename extensions of NAF documents to convert when searching directories", action='store',default=".naf,.xml",required=False)
+    parser.add_argument('--stream', help="Convert one sentence at a time and write the output as it goes, so memory use does not grow with the document size (for very large documents)", action='store_true',required=False)
+    parser.add_argument('--layers', type=str,help="Comma separated list of layers to convert, the others are not read at all. Choose from: " + ','.join(LAYERS), action='store',default=None,required=False)
+    parser.add_argument('--slowest', type=int,help="Batch mode: number of slowest documents to list in the summary", action='store',default=10,required=False)
+    parser.add_argument('--shard', type=str,help="Batch mode: only convert shard i of N shards (i/N, e.g. 1/4), to divide a corpus over several machines; every document is assigned to the same shard on every machine", action='store',default="",required=False)
+    parser.add_argument('--timeout', type=float,help="Batch mode: maximum time in seconds to convert a single document, the worker process converting a document that takes longer is killed and replaced, and the document fails", action='store',default=None,required=False)
+    parser.add_argument('--max-memory', type=float,help="Batch mode: maximum memory use (resident set size) of a worker process in megabytes, a worker that uses more is killed and replaced, and the document it was converting fails (Linux only)", action='store',default=None,required=False)
+    parser.add_argument('--recycle', type=int,help="Batch mode: replace every worker process after it converted this number of documents, to cap slow growth of their memory use", action='store',default=None,required=False)
+    parser.add_argument('--quarantine', type=str,help="Batch mode: copy the documents that hit --timeout or --max-memory, or crash their worker process, to this directory, with a log of the reasons", action='store',default="",required=False)
+    parser.add_argument('--journal', type=str,help="Batch mode: record every converted document in this journal, and skip the documents it records whose input and output did not change since, so an interrupted conversion can be started again (use a journal per shard)", action='store',default="",required=False)
+    parser.add_argument('--profile', type=str,help="Measure the time, number of elements and memory use of every stage of the conversion and write a report to this JSON file", action='store',default="",required=False)
+    parser.add_argument('--warnings', type=str,help="Write a summary of the warnings, grouped and counted by category, to this JSON file rather than to stderr", action='store',default="",required=False)
+    parser.add_argument('--max-warnings', type=int,help="Maximum number of different warnings to report per category", action='store',default=10,required=False)
+    parser.add_argument('--incremental', help="Only convert the layers that are new or changed since the FoLiA output document was last converted with --incremental, and patch them into it", action='store_true',required=False)
+    parser.add_argument('--framed', type=str,help="Pipe mode: read a stream of NAF documents from stdin and write the FoLiA documents to stdout, every document followed by a NUL byte (nul) or preceded by its size in bytes and a newline (length)", action='store',choices=('nul', 'length'),default=None,required=False)
+    parser.add_argument('--cache', type=str,help="Cache the converted documents in this directory, documents that did not change since they were last converted with the same options are copied from the cache rather than converted again", action='store',default="",required=False)
+    parser.add_argument('--cache-size', type=float,help="Maximum size of the cache in megabytes, the least recently used documents are removed when it grows larger", action='store',default=None,required=False)
+    parser.add_argument('--cache-link', help="Hard link documents from the cache rather than copying them (the output documents must then not be modified in place)", action='store_true',required=False)
+    parser.add_argument('--bulk', help="Build the FoLiA document without checking every element as it is added, and check the finished document once instead, which is faster for large documents", action='store_true',required=False)
+    parser.add_argument('--trusted', help="Like --bulk, but also skip the check of the finished document, for input that is known to convert to valid FoLiA", action='store_true',required=False)
+    parser.add_argument('--direct', help="Write the FoLiA XML directly from the NAF document rather than building the FoLiA document in memory and serialising it, which is faster and uses less memory; the output is the same", action='store_true',required=False)
+    parser.add_argument('--compress', type=str,help="Compress the FoLiA output with gzip (gz), xz or zstandard (zst), in batch mode the extension is added to the output filenames. Output filenames ending in .gz, .xz or .zst are compressed without this option, compressed input is always recognised", action='store',choices=compression.FORMATS,default=None,required=False)
     args = parser.parse_args()
-
-    if not args.naffile:
+    try:
+        args.layers = select_layers(args.layers)
+    except ValueError as e:
+        parser.error(str(e))
+
+    if args.incremental and (args.stream or args.cache):
+        parser.error("--incremental can not be combined with --stream or --cache")
+    args.bulk = args.bulk or args.trusted
+    if args.bulk and (args.stream or args.incremental):
+        parser.error("--bulk and --trusted can not be combined with --stream or --incremental")
+    if args.direct and (args.stream or args.incremental or args.bulk):
+        parser.error("--direct can not be combined with --stream, --incremental, --bulk or --trusted")
+    cache = None
+    if args.cache:
+        from naffoliapy.cache import ConversionCache
+        cache = ConversionCache(args.cache, int(args.cache_size * 1024 * 1024) if args.cache_size else None, args.cache_link)
+
+    if args.outputdir:
+        if args.id:
+            parser.error("--id can not be used in batch mode, document IDs are derived from the filenames")
+        if args.profile:
+            parser.error("--profile can not be used in batch mode, use naffoliapy-benchmark to measure the conversion of many documents")
+        if args.warnings:
+            parser.error("--warnings can not be used in batch mode")
+        if args.framed:
+            parser.error("--framed can not be used in batch mode")
+        if args.shard:
+            from naffoliapy.batch import parse_shard
+            try:
+                args.shard = parse_shard(args.shard)
+            except ValueError as e:
+                parser.error(str(e))
+        if args.max_memory:
+            from naffoliapy.supervisor import memory_supported
+            if not memory_supported():
+                parser.error("--max-memory is not supported on this system")
+        batch_main(args, cache)
+        return
+    elif args.shard or args.journal or args.timeout or args.max_memory or args.recycle or args.quarantine:
+        parser.error("--shard, --journal, --timeout, --max-memory, --recycle and --quarantine can only be used in batch mode (--outputdir)")
+
+    if args.framed:
+        if args.files not in ([], ['-']):
+            parser.error("--framed reads the NAF documents from stdin and writes the FoLiA documents to stdout")
+        if args.id or args.stream or cache is not None or args.incremental or args.profile or args.warnings:
+            parser.error("--framed can not be combined with --id, --stream, --cache, --incremental, --profile or --warnings")
+        if args.compress and args.framed != 'length':
+            parser.error("--compress requires --framed length, compressed documents may contain NUL bytes")
+        framed_main(args)
+        return
+
+    if not args.files:
         parser.print_help()
         sys.exit(2)
-
-    foliadoc = naf2folia(args.naffile, args.id)
-
-    if args.foliafile:
-        foliadoc.save(args.foliafile)
+    elif len(args.files) > 2:
+        parser.error("Expected a NAF input document and optionally a FoLiA output document, use --outputdir to convert multiple documents")
+    args.naffile = args.files[0]
+    args.foliafile = args.files[1] if len(args.files) > 1 and args.files[1] != '-' else None
+    profiler = Profiler() if args.profile else NULL_PROFILER
+    collector = WarningCollector(args.max_warnings, None if args.warnings else sys.stderr)
+
+    if cache is not None or args.incremental:
+        if not args.foliafile or args.naffile == '-':
+            parser.error("--cache and --incremental require a NAF input document and a FoLiA output document")
+        convert_file(args.naffile, args.foliafile, args.id, args.stream, args.layers, profiler, collector, cache, args.incremental, args.compress, args.bulk, not args.trusted, args.direct)
+    elif args.stream:
+        from naffoliapy.nafstream import naf2folia_stream
+        from naffoliapy.pipe import stdin, stdout, spooled
+        output = args.foliafile or stdout()
+        with profiler.stage('stream'):
+            if args.naffile == '-':
+                #the streaming conversion reads the document more than once
+                with spooled(stdin()) as naffile:
+                    naf2folia_stream(naffile, output, args.id or 'untitled', args.layers, collector, args.compress)
+            else:
+                naf2folia_stream(args.naffile, output, args.id, args.layers, collector, args.compress)
+    elif args.direct:
+        from naffoliapy.foliawriter import naf2folia_direct
+        from naffoliapy.pipe import stdin, stdout
+        naffile = args.naffile
+        if naffile == '-':
+            with profiler.stage('load'):
+                naffile = load_naf(compression.open_stream(stdin()), args.layers)
+            args.id = args.id or naf_docid(naffile)
+        naf2folia_direct(naffile, args.foliafile or stdout(), args.id, args.layers, profiler, collector, args.compress)
     else:
-        print(foliadoc.xmlstring())
+        naffile = args.naffile
+        if naffile == '-':
+            from naffoliapy.pipe import stdin
+            with profiler.stage('load'):
+                naffile = load_naf(compression.open_stream(stdin()), args.layers)
+            args.id = args.id or naf_docid(naffile)
+        foliadoc = naf2folia(naffile, args.id, args.layers, profiler, collector, args.bulk, not args.trusted)
+        with profiler.stage('serialize'):
+            if args.foliafile:
+                save_folia(foliadoc, args.foliafile, args.compress)
+            elif args.compress:
+                from naffoliapy.pipe import stdout
+                with compression.open_output(stdout(), args.compress) as f:
+                    f.write(foliadoc.xmlstring().encode('utf-8'))
+            else:
+                print(foliadoc.xmlstring())
+
+    collector.flush()
+    if args.warnings:
+        collector.save(args.warnings)
+    if args.profile:
+        profiler.save(args.profile, converter='naf2folia', document=args.naffile)
+
+def framed_main(args):
+    from naffoliapy.pipe import convert_frames
+
+    collector = WarningCollector(args.max_warnings, sys.stderr)
+    documents, failures = convert_frames(lambda payload, number: compression.compress(naf2folia_bytes(payload, None, args.layers, collector, args.bulk, not args.trusted, args.direct), args.compress), args.framed)
+    collector.flush()
+    if failures:
+        print(str(failures) + " of " + str(documents) + " documents failed", file=sys.stderr)
+        sys.exit(1)
+
+def batch_main(args, cache=None):
+    from naffoliapy import batch
+
+    extensions = tuple( extension.strip() for extension in args.extensions.split(',') if extension.strip() )
+    outputextension = '.folia.xml' + ('.' + args.compress if args.compress else '')
+    inputs = batch.collect_inputs(args.files, extensions)
+    if not inputs:
+        print("No input documents found",file=sys.stderr)
+        sys.exit(2)
+    if args.shard:
+        inputs = batch.select_shard(inputs, *args.shard)
+    jobs = [ (naffile, batch.output_path(relpath, args.outputdir, ('.naf.xml',) + extensions, outputextension)) for naffile, relpath in inputs ]
+
+    journal = None
+    if args.journal:
+        from naffoliapy.journal import Journal
+        journal = Journal(args.journal, {'converter': 'naf2folia', 'version': VERSION, 'stream': bool(args.stream), 'layers': sorted(args.layers)})
+        pending = journal.pending(jobs)
+        if len(pending) < len(jobs):
+            print("Skipping " + str(len(jobs) - len(pending)) + " documents converted earlier (" + args.journal + ")",file=sys.stderr)
+        jobs = pending
+
+    quarantine = None
+    if args.quarantine:
+        from naffoliapy.supervisor import Quarantine
+        quarantine = Quarantine(args.quarantine)
+
+    begintime = time.time()
+    if args.layers != frozenset(LAYERS) or cache is not None or args.incremental or args.compress or args.bulk or args.direct:
+        function = functools.partial(convert_file, stream=args.stream, layers=args.layers, cache=cache, incremental=args.incremental, compress=args.compress, bulk=args.bulk, validate=not args.trusted, direct=args.direct)
+    else:
+        function = convert_file_stream if args.stream else convert_file
+    try:
+        results = batch.convert_batch(jobs, function, args.workers, journal, args.timeout, int(args.max_memory * 1024 * 1024) if args.max_memory else None, args.recycle, quarantine, preload)
+    finally:
+        if journal is not None:
+            journal.close()
+    batch.print_summary(results, time.time() - begintime, args.slowest)
+    if any( error is not None for _, _, _, error in results ):
+        sys.exit(1)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,563 @@
+#!/usr/bin/env python
+#-*- coding:utf-8 -*-
+
+# Streaming NAF2FoLiA Converter
+# Licensed under GPLv3
+
+"""
+Streaming NAF to FoLiA conversion. Rather than loading the whole NAF document and building the whole FoLiA
+document in memory, the NAF layers are read incrementally and the FoLiA document is built and written one
+sentence at a time. Every layer is read by its own cursor, the cursors advance in lockstep sentence by
+sentence, so only the annotations of the current sentence are held in memory.
+
+A first pass over the document determines which sentence every element belongs to. Elements a layer
+lists ahead of their sentence are held until that sentence is written, so memory use grows only with how far
+a layer strays from document order. Elements that can not be placed in a single sentence (because they
+cross a sentence boundary or refer to non-existing IDs) are reported and skipped.
+
+Coreference chains cross sentences, they are buffered separately and written at the end of the text.
+Apart from that, only the raw text and the sentence numbers of the elements are kept for the whole document,
+as arrays by position with a few bytes per element (see IdPositions).
+
+Because sentences are written before the whole document is known, sets are always written out explicitly,
+even where the non-streaming converter leaves them out as the default set. The result is equivalent.
+"""
+
+from __future__ import print_function, unicode_literals, division, absolute_import
+
+import sys
+import shutil
+import tempfile
+from collections import OrderedDict
+from array import array
+from xml.sax.saxutils import quoteattr
+
+from lxml import etree
+import KafNafParserPy as naf
+from pynlpl.formats import folia
+
+from naffoliapy import naf2folia as n2f
+from naffoliapy import compression
+from naffoliapy.diagnostics import WarningCollector
+
+
+#Unsupported layers that will be reported if they have content
+UNSUPPORTED_LAYERS = (
+    ('temporalRelations', "Temporal Relations"),
+    ('causalRelations', "Causal Relations"),
+    ('constituency', "Constituency Parse (syntax)"),
+    ('factualitylayer', "Factuality"),
+    ('factualities', "Factuality"),
+)
+
+XLINK = "http://www.w3.org/1999/xlink"
+
+NAMESPACE_DECLARATIONS = (
+    b' xmlns="' + folia.NSFOLIA.encode('ascii') + b'"',
+    b' xmlns:xlink="' + XLINK.encode('ascii') + b'"',
+)
+
+
+def _opinion_ids(naf_opinion):
+    ids = []
+    if naf_opinion.get_expression():
+        ids += naf_opinion.get_expression().get_span().get_span_ids()
+        if naf_opinion.get_holder():
+            ids += naf_opinion.get_holder().get_span().get_span_ids()
+        if naf_opinion.get_target():
+            ids += naf_opinion.get_target().get_span().get_span_ids()
+    return ids
+
+def _convert_opinion(naf_opinion, foliadoc, resolver):
+    if naf_opinion.get_expression():
+        n2f.convert_opinion(naf_opinion, foliadoc, resolver)
+
+TERM_LAYER = ('terms', 'term', n2f.Term,
+    lambda term: term.span,
+    n2f.convert_term)
+
+#Sentence-level layers, in the order the non-streaming converter processes them:
+#(layer tag, element tag, wrapper, function returning the term/token IDs an element refers to, converter)
+SENTENCE_LAYERS = (
+    ('entities', 'entity', lambda node: naf.entity_data.Centity(node),
+        lambda e: [ target_id for reference in e.get_references() for target_id in reference.get_span().get_span_ids() ],
+        n2f.convert_entity),
+    ('markables', 'mark', lambda node: naf.markable_data.Cmarkable(node),
+        lambda e: e.get_span().get_span_ids(),
+        n2f.convert_markable),
+    ('chunks', 'chunk', lambda node: naf.chunk_data.Cchunk(node),
+        lambda e: e.get_span().get_span_ids(),
+        n2f.convert_chunk),
+    ('srl', 'predicate', lambda node: naf.srl_data.Cpredicate(node),
+        lambda e: e.get_span().get_span_ids() + [ target_id for role in e.get_roles() for target_id in role.get_span().get_span_ids() ],
+        n2f.convert_predicate),
+    ('deps', 'dep', lambda node: naf.dependency_data.Cdependency(node),
+        lambda e: [e.get_from(), e.get_to()],
+        n2f.convert_dependency),
+    ('timeExpressions', 'timex3', lambda node: naf.time_data.Ctime(node),
+        lambda e: e.get_span().get_span_ids() if e.get_span() else [],
+        n2f.convert_timeexpression),
+    ('opinions', 'opinion', lambda node: naf.opinion_data.Copinion(node),
+        _opinion_ids,
+        _convert_opinion),
+)
+
+
+def iterlayer(naffile, layername, tag):
+    """
+    Iterates over the elements of a single NAF layer, parsing incrementally. Elements of other layers
+    are discarded as soon as they are parsed, so memory use does not depend on the document size.
+    :param naffile: path to the NAF document (str)
+    :param layername: the tag of the layer (str)
+    :param tag: the tag of the elements in the layer to return (str)
+    :return: generator of lxml elements, detached from the document
+    """
+    depth = 0
+    inlayer = False
+    #opened here rather than by iterparse, so the file is closed when the generator is closed before the end
+    with open(naffile, 'rb') as f:
+        for event, node in etree.iterparse(f, events=('start','end'), remove_blank_text=True):
+            if event == 'start':
+                depth += 1
+                if depth == 2 and node.tag == layername:
+                    inlayer = True
+                continue
+            if depth == 3:
+                #a child of a layer
+                node.getparent().remove(node)
+                if inlayer and node.tag == tag:
+                    yield node
+                else:
+                    node.clear()
+            elif depth == 2:
+                #a layer
+                if inlayer:
+                    return
+                node.getparent().remove(node)
+                node.clear()
+            depth -= 1
+
+
+class IdPositions(object):
+    """
+    The positions of the elements of a NAF layer, looked up by their ID. NAF documents nearly always number their
+    elements with a prefix and the position counting from 1 (w1, w2, ...); such IDs are not stored, their position
+    follows from the ID, only the IDs that do not follow the pattern are kept in a dict. That takes one byte per
+    element rather than a dict entry.
+    """
+
+    def __init__(self):
+        self.prefix = None
+        self.size = 0
+        self.irregular = bytearray() #1 for the positions whose ID does not follow the pattern
+        self.others = {} #ID => position, for the IDs that do not follow the pattern
+
+    def add(self, id):
+        """Adds the ID of the next element"""
+        if self.prefix is None and id is not None:
+            self.prefix = id.rstrip('0123456789')
+        if id is not None and id == self.prefix + str(self.size + 1):
+            self.irregular.append(0)
+        else:
+            self.irregular.append(1)
+            self.others[id] = self.size
+        self.size += 1
+
+    def get(self, id, default=None):
+        """Returns the position of the element with the given ID, the last one if there are several"""
+        position = self.others.get(id)
+        if position is not None:
+            return position
+        if self.prefix is not None and id is not None and id.startswith(self.prefix):
+            number = id[len(self.prefix):]
+            try:
+                position = int(number) - 1
+            except ValueError:
+                return default
+            if str(position + 1) == number and 0 <= position < self.size and not self.irregular[position]:
+                return position
+        return default
+
+
+class NAFSurvey(object):
+    """
+    Result of a first streaming pass over a NAF document: the header, raw text and the layers that are
+    present, along with the buffered coreference chains. The pass also determines which sentence every
+    term and every element of the sentence-level layers belongs to, so the layers can be read back in
+    step with the text even when their elements are not in document order.
+    """
+
+    def __init__(self, naffile, tags=None):
+        """
+        :param naffile: path to the NAF document (str)
+        :param tags: tags of the NAF layers to read, the elements of other layers are discarded unseen, None for all
+        """
+        self.language = None
+        self.header = None
+        self.raw = None
+        self.layers = OrderedDict() #layer tag => number of elements
+        self.corefs = []
+        self.placement = {} #layer tag => array with the sentence number of every element, -1 if it has none
+        self.sentences = 0
+
+        placed = dict( (layername, (tag, wrapper, getids)) for layername, tag, wrapper, getids, _ in (TERM_LAYER,) + SENTENCE_LAYERS )
+        tokens = IdPositions()
+        token_sentences = array('i') #sentence number of every token
+        terms = IdPositions() #their sentence numbers are in the placement of the terms layer
+
+        def token_sentence(w_id):
+            position = tokens.get(w_id)
+            return -1 if position is None else token_sentences[position]
+
+        def target_sentence(target_id):
+            position = terms.get(target_id)
+            return token_sentence(target_id) if position is None else self.placement['terms'][position]
+
+        sentence = -1
+        prevsent_id = None
+
+        depth = 0
+        for event, node in etree.iterparse(naffile, events=('start','end'), remove_blank_text=True):
+            if event == 'start':
+                depth += 1
+                if depth == 1:
+                    self.language = node.get('{http://www.w3.org/XML/1998/namespace}lang')
+                elif depth == 2 and node.tag not in ('nafHeader', 'kafHeader', 'raw') and (tags is None or node.tag in tags):
+                    self.layers.setdefault(node.tag, 0)
+                    if node.tag in placed:
+                        self.placement.setdefault(node.tag, array('i'))
+                continue
+            if depth == 3:
+                layername = node.getparent().tag
+                if tags is not None and layername not in tags and layername not in ('nafHeader', 'kafHeader'):
+                    node.getparent().remove(node)
+                    node.clear()
+                elif layername not in ('nafHeader', 'kafHeader'): #the header is kept as a whole
+                    node.getparent().remove(node)
+                    if layername == 'text' and node.tag == 'wf':
+                        #same grouping as _sentences()
+                        if node.get('sent') != prevsent_id:
+                            sentence += 1
+                            prevsent_id = node.get('sent')
+                        tokens.add(node.get('id'))
+                        token_sentences.append(sentence)
+                    elif layername in placed and node.tag == placed[layername][0]:
+                        if layername == 'terms':
+                            #read from the node, n2f.Term would intern IDs that are only looked up here
+                            sentences = set( token_sentence(target.get('id')) for target in node.iterfind('span/target') )
+                        else:
+                            _, wrapper, getids = placed[layername]
+                            sentences = set( target_sentence(target_id) for target_id in getids(wrapper(node)) )
+                        if not sentences:
+                            #refers to nothing, leave it to the converter to report
+                            sentences = set([0])
+                        self.placement[layername].append(sentences.pop() if len(sentences) == 1 else -1)
+                        if layername == 'terms':
+                            terms.add(node.get('id'))
+                    if layername == 'coreferences' and node.tag == 'coref':
+                        self.corefs.append(naf.coreference_data.Ccoreference(node))
+                    else:
+                        node.clear()
+                    self.layers[layername] += 1
+            elif depth == 2:
+                if node.tag in ('nafHeader', 'kafHeader'):
+                    self.header = naf.header_data.CHeader(node)
+                elif node.tag == 'raw':
+                    self.raw = node.text
+                node.getparent().remove(node)
+            depth -= 1
+        self.sentences = sentence + 1
+
+    def nonempty(self, layername):
+        return self.layers.get(layername, 0) > 0
+
+
+class LayerCursor(object):
+    """
+    Reads the elements of a sentence-level NAF layer sentence by sentence: take() returns the elements
+    of one sentence. Reading stops after the last element of that sentence; elements of later sentences
+    met on the way are held until their sentence comes along, so memory stays bounded as long as the
+    layer is more or less in document order.
+    """
+
+    def __init__(self, naffile, layername, tag, wrapper, placement):
+        self.layername = layername
+        self.elements = iterlayer(naffile, layername, tag)
+        self.wrapper = wrapper
+        self.placement = placement
+        self.position = 0
+        self.last = array('i', [-1]) * (max(placement) + 1 if placement else 0) #position of the last element of every sentence
+        for position, sentence in enumerate(placement):
+            if sentence >= 0:
+                self.last[sentence] = position
+        self.pending = {} #sentence number => [elements]
+
+    def take(self, sentence):
+        """
+        Returns the elements of the given sentence (sentence numbers must be passed in increasing order)
+        :param sentence: the sentence number, counting from 0 (int)
+        :return: list of KafNafParserPy elements, in the order of the layer
+        """
+        ready = self.pending.pop(sentence, [])
+        last = self.last[sentence] if sentence < len(self.last) else -1
+        while self.position <= last:
+            node = next(self.elements)
+            elementsentence = self.placement[self.position]
+            if elementsentence == sentence:
+                ready.append(self.wrapper(node))
+            elif elementsentence > sentence:
+                self.pending.setdefault(elementsentence, []).append(self.wrapper(node))
+            self.position += 1
+        return ready
+
+    def discard(self):
+        """Returns how many elements of the layer could not be placed in a single sentence"""
+        return sum( 1 for sentence in self.placement if sentence == -1 )
+
+    def close(self):
+        """Stops reading the layer, closing the document"""
+        self.elements.close()
+
+
+class SentenceWindow(object):
+    """
+    Resolves NAF term and token IDs to FoLiA words for the sentence currently being converted,
+    same interface as naf2folia.NAFResolver
+    """
+
+    def __init__(self, exrefs):
+        self.words = {} #token id => folia.Word
+        self.terms = {} #term id => [token id]
+        self.layers = n2f.LayerRegistry()
+        self.exrefs = exrefs
+
+    def clear(self):
+        self.words.clear()
+        self.terms.clear()
+        self.layers.clear()
+
+    def span(self, nafspan):
+        span = []
+        for target_id in nafspan.get_span_ids():
+            if target_id in self.terms:
+                span += self.term(target_id)
+            else:
+                span.append(self.words[target_id])
+        return span
+
+    def term(self, term_id):
+        return [ self.words[w_id] for w_id in self.terms[term_id] ]
+
+    def tokens(self, token_ids):
+        return [ self.words[w_id] for w_id in token_ids ]
+
+    def sentence(self, word):
+        #words are added directly to the sentence being converted
+        return word.parent
+
+
+class CoreferenceResolver(object):
+    """
+    Resolves NAF term IDs to FoLiA words for the buffered coreference chains, once all sentences have
+    been written. The words are lightweight stand-ins carrying only the ID and text.
+    """
+
+    def __init__(self, foliadoc, term_tokens, token_text, exrefs):
+        self.terms = term_tokens
+        self.words = {}
+        self.layers = n2f.LayerRegistry()
+        self.exrefs = exrefs
+        for w_id, text in token_text.items():
+            word = folia.Word(foliadoc, id=foliadoc.id + '.' + w_id)
+            word.append(folia.TextContent, text)
+            self.words[w_id] = word
+
+    def term(self, term_id):
+        return [ self.words[w_id] for w_id in self.terms.get(term_id, []) ]
+
+
+def _sentences(tokens):
+    #Groups NAF tokens into sentences, yields (para_id, sent_id, tokens, first token of the next sentence).
+    #Like convert_text_layer(), a new sentence starts only when the sentence number changes, the paragraph
+    #of a sentence is that of its first token
+    sentence = []
+    for naf_token in tokens:
+        if sentence and naf_token.get_sent() != sentence[0].get_sent():
+            yield sentence[0].get_para(), sentence[0].get_sent(), sentence, naf_token
+            sentence = []
+        sentence.append(naf_token)
+    if sentence:
+        yield sentence[0].get_para(), sentence[0].get_sent(), sentence, None
+
+def _unprefix(xml):
+    #Same patch folia.Document.xmlstring() applies, so the output uses the default namespace like the object path
+    return xml.replace(b'ns0:', b'').replace(b':ns0', b'')
+
+def _serialize(element, foliadoc, final=False):
+    #Serialises a FoLiA element, without the namespace declarations the document root already provides.
+    #FoLiA leaves out the set of an annotation when it is the only one declared for its type, but unless all
+    #declarations are final a second set may still get declared by a later sentence, so the sets are forced out
+    #by temporarily declaring a placeholder
+    placeholders = []
+    for annotationtype, sets in foliadoc.annotationdefaults.items():
+        if not final and len(sets) == 1 and list(sets.keys())[0] not in (None, 'undefined'): #structure elements never get a set
+            sets[None] = {}
+            placeholders.append(sets)
+    try:
+        node = element.xml()
+    finally:
+        for sets in placeholders:
+            del sets[None]
+    etree.cleanup_namespaces(node, top_nsmap={'xlink': XLINK})
+    xml = _unprefix(etree.tostring(node, encoding='utf-8', pretty_print=True))
+    end = xml.index(b'>')
+    head = xml[:end]
+    for declaration in NAMESPACE_DECLARATIONS:
+        head = head.replace(declaration, b'', 1)
+    return head + xml[end:]
+
+def _forget(element, foliadoc):
+    #Removes an element and everything it contains from the document index, so it can be freed
+    if element.id and element.id in foliadoc.index:
+        del foliadoc.index[element.id]
+    for child in element.data:
+        if isinstance(child, folia.AbstractElement) and child.parent is element:
+            _forget(child, foliadoc)
+
+
+def naf2folia_stream(naffile, output, docid=None, layers=None, collector=None, compress=None):
+    """
+    Converts a NAF document to FoLiA one sentence at a time, writing the FoLiA document as it goes.
+    :param naffile: path to the NAF input document (str), may be compressed (see naffoliapy.compression)
+    :param output: path to the FoLiA output document (str) or a binary file object
+    :param docid: the ID for the FoLiA document, will be derived from the filename if not specified (str)
+    :param layers: names of the layers to convert, None for all (see naf2folia.naf2folia())
+    :param collector: a naffoliapy.diagnostics.WarningCollector to add the warnings to, if not specified the first warnings of every kind are written to stderr
+    :param compress: compression format of the output ('gz', 'xz' or 'zst'), by default it follows the extension of the output filename
+    """
+    warnings = collector if collector is not None else WarningCollector(stream=sys.stderr)
+    if not docid:
+        docid = n2f.derive_docid(naffile)
+    with compression.decompressed(naffile) as source:
+        _naf2folia_stream(source, output, docid, n2f.select_layers(layers), warnings, compress)
+    if collector is None:
+        warnings.flush()
+
+def _naf2folia_stream(naffile, output, docid, layers, warnings, compress):
+
+    survey = NAFSurvey(naffile, n2f.naf_layer_tags(layers))
+
+    foliadoc = folia.Document(id=docid)
+    foliadoc.declare(folia.Word, 'undefined')
+    foliadoc.declare(folia.Sentence, 'undefined')
+    foliadoc.metadata['language'] = survey.language
+    n2f.convert_metadata(survey.header, foliadoc)
+
+    textbody = foliadoc.append(folia.Text(foliadoc, id=foliadoc.id+'.text'))
+    if survey.raw:
+        textbody.append(folia.TextContent, survey.raw)
+
+    #terms and tokens the coreference chains refer to
+    coref_terms = set( term_id for naf_coref in survey.corefs for naf_span in naf_coref.get_spans() for term_id in naf_span.get_span_ids() )
+    coref_term_tokens = {}
+    coref_token_text = {}
+
+    layername, tag, wrapper, _, _ = TERM_LAYER
+    termcursor = LayerCursor(naffile, layername, tag, wrapper, survey.placement.get(layername, array('i')))
+    cursors = [ (LayerCursor(naffile, layername, tag, wrapper, survey.placement[layername]), converter) for layername, tag, wrapper, _, converter in SENTENCE_LAYERS if survey.nonempty(layername) ]
+    exrefs = n2f.ExternalReferences(foliadoc, warnings)
+    window = SentenceWindow(exrefs)
+
+    body = tempfile.TemporaryFile()
+    prevpara_id = None
+    paragraph = None
+    textnodes = iterlayer(naffile, 'text', 'wf')
+    try:
+        for sentencenumber, (para_id, sent_id, naf_tokens, next_naf_token) in enumerate(_sentences( naf.text_data.Cwf(node=node, type='NAF') for node in textnodes )):
+            if para_id != prevpara_id:
+                if paragraph is not None:
+                    body.write(b'</p>\n')
+                    textbody.remove(paragraph)
+                elif prevpara_id is None:
+                    #first paragraph, declare for completion's sake
+                    foliadoc.declare(folia.Paragraph, 'undefined')
+                paragraph = textbody.append(folia.Paragraph, id=foliadoc.id+ '.para' + para_id)
+                body.write(b'<p xml:id=' + quoteattr(paragraph.id).encode('utf-8') + b'>\n')
+                prevpara_id = para_id
+            if paragraph is not None:
+                sentence = paragraph.append(folia.Sentence, id=foliadoc.id+ '.sent' + sent_id)
+            else:
+                sentence = textbody.append(folia.Sentence, id=foliadoc.id+ '.sent' + sent_id)
+
+            prevword = None
+            prev_naf_token = None
+            for naf_token in naf_tokens:
+                if prev_naf_token is not None and n2f.tokens_adjacent(prev_naf_token, naf_token):
+                    prevword.space = False
+                prevword = n2f.convert_token(naf_token, sentence, textbody, survey.raw, warnings)
+                window.words[naf_token.get_id()] = prevword
+                prev_naf_token = naf_token
+            if next_naf_token is not None and n2f.tokens_adjacent(prev_naf_token, next_naf_token):
+                #the space after the last word depends on the first token of the next sentence
+                prevword.space = False
+
+            for term in termcursor.take(sentencenumber):
+                term_id = term.id
+                window.terms[term_id] = term.span
+                if 'terms' in layers:
+                    n2f.convert_term(term, foliadoc, exrefs)
+                if term_id in coref_terms:
+                    coref_term_tokens[term_id] = window.terms[term_id]
+                    for w_id in window.terms[term_id]:
+                        coref_token_text[w_id] = window.words[w_id].text()
+
+            for cursor, converter in cursors:
+                for naf_element in cursor.take(sentencenumber):
+                    converter(naf_element, foliadoc, window)
+
+            body.write(_serialize(sentence, foliadoc))
+            sentence.parent.remove(sentence)
+            _forget(sentence, foliadoc)
+            window.clear()
+
+        if paragraph is not None:
+            body.write(b'</p>\n')
+            textbody.remove(paragraph)
+
+        for cursor in [termcursor] + [ cursor for cursor, _ in cursors ]:
+            discarded = cursor.discard()
+            if discarded:
+                warnings.warn('unplaceable-elements', str(discarded) + " element(s) in NAF layer '" + cursor.layername + "' could not be placed in a single sentence (they cross a sentence boundary or refer to non-existing IDs). Skipping...")
+    finally:
+        #layers that were not read to the end still have the document open
+        textnodes.close()
+        for cursor in [termcursor] + [ cursor for cursor, _ in cursors ]:
+            cursor.close()
+
+    if survey.corefs:
+        resolver = CoreferenceResolver(foliadoc, coref_term_tokens, coref_token_text, exrefs)
+        for naf_coref in survey.corefs:
+            n2f.convert_coreference(naf_coref, foliadoc, resolver)
+        for layer in list(textbody.select(folia.CoreferenceLayer, recursive=False)):
+            body.write(_serialize(layer, foliadoc, final=True))
+            textbody.remove(layer)
+
+    for layername, annotationtitle in UNSUPPORTED_LAYERS:
+        if survey.nonempty(layername):
+            warnings.warn('unsupported-annotation', "The following annotation type in NAF can not be converted to FoLiA yet: " +  annotationtitle + ". Skipping....")
+
+    #now all declarations are known, write the document with the body in place
+    root = foliadoc.xml()
+    placeholder = etree.Comment('body')
+    root.find('{' + folia.NSFOLIA + '}text').append(placeholder)
+    head, tail = _unprefix(etree.tostring(root, xml_declaration=True, encoding='utf-8', pretty_print=True)).split(etree.tostring(placeholder))
+
+    f = compression.open_output(output, compress)
+    try:
+        f.write(head.rstrip() + b'\n')
+        body.seek(0)
+        shutil.copyfileobj(body, f)
+        f.write(tail.lstrip())
+    finally:
+        body.close()
+        f.close()
@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+#-*- coding:utf-8 -*-
+
+# Pipe mode for NAFFoLiAPy
+# Licensed under GPLv3
+
+'''
+Reading documents from stdin and writing them to stdout, so the converters can be used in Unix pipelines without
+temporary files. A single document is passed as is (use ``-`` as the input or output file). A stream of documents
+is passed framed (``--framed``), so one converter process handles all of them:
+
+* ``nul``: every document is followed by a NUL byte, which can not occur in XML
+* ``length``: every document is preceded by its size in bytes, in decimal, and a newline
+
+    $ tokenizer --framed nul < articles.txt | naf2folia --framed nul | folia-indexer --framed nul
+
+A document that fails to convert is reported on stderr and written as an empty frame, so the output frames stay in
+step with the input frames.
+'''
+
+from __future__ import print_function, unicode_literals, division, absolute_import
+
+import sys
+import os
+import shutil
+import tempfile
+from contextlib import contextmanager
+
+FRAMINGS = ('nul', 'length')
+CHUNKSIZE = 64 * 1024
+
+
+def stdin():
+    return getattr(sys.stdin, 'buffer', sys.stdin)
+
+def stdout():
+    return getattr(sys.stdout, 'buffer', sys.stdout)
+
+def read_frames(stream, framing):
+    """
+    Reads framed documents from a stream
+    :param stream: binary file object
+    :param framing: 'nul' or 'length'
+    :return: generator of documents (bytes)
+    """
+    if framing == 'nul':
+        buffer = b''
+        for chunk in iter(lambda: stream.read(CHUNKSIZE), b''):
+            frames = (buffer + chunk).split(b'\0')
+            buffer = frames.pop()
+            for frame in frames:
+                #whitespace between the documents (a newline after the NUL byte) is not part of them
+                yield frame.lstrip()
+        if buffer.strip():
+            #the last document need not be terminated
+            yield buffer.lstrip()
+    elif framing == 'length':
+        while True:
+            header = stream.readline()
+            if not header:
+                break
+            elif not header.strip():
+                continue
+            try:
+                size = int(header)
+            except ValueError:
+                raise IOError("Invalid frame header: " + repr(header[:100]))
+            frame = stream.read(size)
+            if len(frame) != size:
+                raise IOError("Stream ended in the middle of a document (" + str(len(frame)) + " of " + str(size) + " bytes)")
+            yield frame
+    else:
+        raise ValueError("Unknown framing: " + framing)
+
+def write_frame(stream, document, framing):
+    """Writes a framed document to a stream and flushes it, so the next stage of the pipeline can start on it"""
+    if framing == 'nul':
+        stream.write(document + b'\0')
+    elif framing == 'length':
+        stream.write(str(len(document)).encode('ascii') + b'\n' + document)
+    else:
+        raise ValueError("Unknown framing: " + framing)
+    stream.flush()
+
+def convert_frames(function, framing, instream=None, outstream=None):
+    """
+    Converts a stream of framed documents
+    :param function: conversion function, called with the input document (bytes) and its number, returns the output document (bytes)
+    :param framing: 'nul' or 'length'
+    :param instream: binary file object to read from, defaults to stdin
+    :param outstream: binary file object to write to, defaults to stdout
+    :return: tuple of the number of documents and the number of documents that failed (int)
+    """
+    instream = instream if instream is not None else stdin()
+    outstream = outstream if outstream is not None else stdout()
+    documents = failures = 0
+    for document in read_frames(instream, framing):
+        documents += 1
+        try:
+            output = function(document, documents)
+        except Exception as e:
+            failures += 1
+            print("ERROR: Document " + str(documents) + " in the stream failed: " + e.__class__.__name__ + ": " + str(e), file=sys.stderr)
+            output = b''
+        write_frame(outstream, output, framing)
+    return documents, failures
+
+@contextmanager
+def spooled(stream, suffix='.xml'):
+    """
+    Copies a stream to a temporary file, for the streaming converters, which read their input more than once
+    :return: context manager giving the path of the temporary file (str)
+    """
+    fd, filename = tempfile.mkstemp(suffix=suffix, prefix='naffoliapy-')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            shutil.copyfileobj(stream, f, CHUNKSIZE)
+        yield filename
+    finally:
+        os.unlink(filename)
@@ -0,0 +1,139 @@
+#!/usr/bin/env python
+#-*- coding:utf-8 -*-
+
+# Profiling of the conversion stages for NAFFoLiAPy
+# Licensed under GPLv3
+
+'''
+Records how long every stage of a conversion takes, how many elements it processed and how much the memory use
+of the process changed. Pass a Profiler to naf2folia() or folia2naf() (or use --profile on the command line):
+
+    profiler = Profiler(callback=lambda stage: print(stage['name'], stage['seconds']))
+    naf2folia('document.naf', profiler=profiler)
+    print(json.dumps(profiler.report()))
+
+Converters use NULL_PROFILER when no profiler is passed, its stages do nothing.
+'''
+
+from __future__ import print_function, unicode_literals, division, absolute_import
+
+import sys
+import os
+import io
+import json
+import time
+from collections import OrderedDict
+
+try:
+    _PAGESIZE = os.sysconf('SC_PAGE_SIZE')
+except (AttributeError, ValueError, OSError):
+    _PAGESIZE = None
+
+
+def current_memory():
+    """Returns the resident set size of the current process in bytes, or the peak if the current size is not available"""
+    if _PAGESIZE:
+        try:
+            with open('/proc/self/statm', 'rb') as f:
+                return int(f.read().split()[1]) * _PAGESIZE
+        except (IOError, OSError):
+            pass
+    import resource
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+class Stage(object):
+    """A stage being measured, a context manager. Set count to the number of elements the stage processed."""
+
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+        self.count = 0
+
+    def __enter__(self):
+        self.memory = current_memory()
+        self.begintime = time.time()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        seconds = time.time() - self.begintime
+        self.profiler.add(self.name, seconds, self.count, current_memory() - self.memory)
+        return False
+
+
+class Profiler(object):
+    """
+    Collects the measurements of the stages of a conversion. A stage that is run more than once (the external
+    references of every element, for instance) is added up.
+    """
+
+    enabled = True
+
+    def __init__(self, callback=None):
+        """
+        :param callback: function called with a dictionary of the name, seconds, count and memory_delta of a stage every time one finishes
+        """
+        self.callback = callback
+        self.stages = OrderedDict() #name => dictionary of measurements
+        self.begintime = time.time()
+
+    def stage(self, name):
+        """
+        Measures a stage
+        :param name: name of the stage (str)
+        :return: a context manager
+        """
+        return Stage(self, name)
+
+    def add(self, name, seconds, count=0, memory_delta=0):
+        """Adds the measurements of a (run of a) stage"""
+        stage = self.stages.get(name)
+        if stage is None:
+            stage = self.stages[name] = OrderedDict([('name', name), ('seconds', 0.0), ('count', 0), ('calls', 0), ('memory_delta', 0)])
+        stage['seconds'] += seconds
+        stage['count'] += count
+        stage['calls'] += 1
+        stage['memory_delta'] += memory_delta
+        if self.callback is not None:
+            self.callback(OrderedDict([('name', name), ('seconds', seconds), ('count', count), ('memory_delta', memory_delta)]))
+
+    def report(self, **info):
+        """
+        Returns the measurements as a dictionary that can be serialised to JSON
+        :param info: additional information to include, like the document
+        """
+        report = OrderedDict(sorted(info.items()))
+        report['seconds'] = time.time() - self.begintime
+        report['memory'] = current_memory()
+        report['stages'] = list(self.stages.values())
+        return report
+
+    def save(self, filename, **info):
+        """Writes the report to a JSON file"""
+        with io.open(filename, 'w', encoding='utf-8') as f:
+            f.write(json.dumps(self.report(**info), indent=4, ensure_ascii=False))
+
+
+class NullStage(object):
+    count = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+class NullProfiler(object):
+    """Profiler that does not measure anything, used when profiling is off"""
+
+    enabled = False
+    _stage = NullStage()
+
+    def stage(self, name):
+        return self._stage
+
+    def add(self, name, seconds, count=0, memory_delta=0):
+        pass
+
+NULL_PROFILER = NullProfiler()
@@ -0,0 +1,383 @@
+#!/usr/bin/env python
+#-*- coding:utf-8 -*-
+
+# Conversion server for NAFFoLiAPy
+# Licensed under GPLv3
+
+'''
+A long-running local conversion server, for pipelines that convert many small documents one at a time and would
+otherwise spend more time starting Python and importing the converters than converting. The server keeps a pool of
+worker processes that have the converters loaded, and accepts documents over HTTP on a Unix socket or on localhost:
+
+    $ naffoliapy-server --socket /tmp/naffoliapy.sock -j 4 &
+    $ naffoliapy-client --socket /tmp/naffoliapy.sock naf2folia document.naf document.folia.xml
+    $ naffoliapy-client --socket /tmp/naffoliapy.sock health
+
+Endpoints:
+
+* ``POST /naf2folia`` and ``POST /folia2naf`` take the input document as the request body and return the converted
+  document. Options are passed as query parameters: ``filename`` (to derive the document ID from), ``id``, ``layers``
+  and ``stream``. The number of warnings is returned in the ``X-Warnings`` header. A document that can not be
+  converted gives status 422, a full queue gives status 503.
+* ``GET /health`` returns the status of the server as JSON.
+* ``GET /queue`` returns the number of queued, running, completed, failed and rejected conversions as JSON.
+'''
+
+from __future__ import print_function, unicode_literals, division, absolute_import
+
+import sys
+import os
+import json
+import time
+import shutil
+import socket
+import signal
+import tempfile
+import argparse
+import threading
+import socketserver
+from concurrent.futures import ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qs, urlencode
+import http.client
+
+VERSION = '0.1'
+DEFAULT_PORT = 8300
+CONVERTERS = ('naf2folia', 'folia2naf')
+
+
+class QueueFull(Exception):
+    pass
+
+class ConversionError(Exception):
+    pass
+
+
+def _warm():
+    #Runs in every new worker process, so the first request does not pay for the imports
+    from naffoliapy import naf2folia, folia2naf
+    naf2folia.preload()
+    folia2naf.preload()
+    return os.getpid()
+
+def _convert(converter, payload, options):
+    #Runs in a worker process; the converters work on files, so the documents are passed through a temporary directory
+    from naffoliapy.diagnostics import WarningCollector
+    tmpdir = tempfile.mkdtemp(prefix='naffoliapy-')
+    try:
+        inputfile = os.path.join(tmpdir, os.path.basename(options.get('filename') or 'document.xml'))
+        outputfile = os.path.join(tmpdir, 'output.xml')
+        with open(inputfile, 'wb') as f:
+            f.write(payload)
+        collector = WarningCollector()
+        try:
+            if converter == 'naf2folia':
+                from naffoliapy.naf2folia import convert_file
+                convert_file(inputfile, outputfile, options.get('id'), options.get('stream', False), options.get('layers'), collector=collector)
+            else:
+                from naffoliapy.folia2naf import convert_file_to_naf
+                convert_file_to_naf(inputfile, outputfile, options.get('stream', False), collector=collector)
+        except Exception as e:
+            #not every exception can be passed back from the worker process (lxml's keep their error log)
+            raise ConversionError(e.__class__.__name__ + ": " + str(e))
+        with open(outputfile, 'rb') as f:
+            return f.read(), len(collector)
+    finally:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+
+class ConversionServer(object):
+    """A pool of worker processes with the converters loaded, and the bookkeeping of the conversions it runs"""
+
+    def __init__(self, workers=None, maxqueue=None):
+        """
+        :param workers: number of worker processes, defaults to the number of CPUs (int)
+        :param maxqueue: maximum number of conversions waiting for a worker, further requests are rejected, defaults to four per worker (int)
+        """
+        self.workers = workers or os.cpu_count() or 1
+        self.maxqueue = maxqueue if maxqueue is not None else 4 * self.workers
+        self.lock = threading.Lock()
+        self.pending = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.restarts = 0
+        self.begintime = time.time()
+        self.executor = None
+        self.start()
+
+    def start(self):
+        """Starts the worker processes and waits until they have loaded the converters"""
+        self.executor = ProcessPoolExecutor(max_workers=self.workers)
+        wait([ self.executor.submit(_warm) for _ in range(self.workers) ])
+
+    def convert(self, converter, payload, options=None):
+        """
+        Converts a document in one of the worker processes, blocks until it is done
+        :param converter: 'naf2folia' or 'folia2naf'
+        :param payload: the input document (bytes)
+        :param options: filename, id, layers and stream (dict)
+        :return: tuple of the converted document (bytes) and the number of warnings (int)
+        """
+        with self.lock:
+            if self.pending - self.workers >= self.maxqueue:
+                self.rejected += 1
+                raise QueueFull("Queue is full (" + str(self.maxqueue) + " documents waiting)")
+            self.pending += 1
+            executor = self.executor
+        try:
+            result = executor.submit(_convert, converter, payload, options or {}).result()
+        except BrokenProcessPool:
+            #a worker died (killed, out of memory), the pool has to be replaced
+            with self.lock:
+                self.failed += 1
+                if self.executor is executor:
+                    self.restarts += 1
+                    self.executor = ProcessPoolExecutor(max_workers=self.workers)
+            raise ConversionError("Worker process died during the conversion")
+        except Exception:
+            with self.lock:
+                self.failed += 1
+            raise
+        finally:
+            with self.lock:
+                self.pending -= 1
+        with self.lock:
+            self.completed += 1
+        return result
+
+    def queue(self):
+        """Returns the number of queued, running, completed, failed and rejected conversions (dict)"""
+        with self.lock:
+            return {
+                'queued': max(0, self.pending - self.workers),
+                'running': min(self.pending, self.workers),
+                'completed': self.completed,
+                'failed': self.failed,
+                'rejected': self.rejected,
+                'maxqueue': self.maxqueue,
+            }
+
+    def health(self):
+        """Returns the status of the server (dict)"""
+        return {
+            'status': 'ok',
+            'version': VERSION,
+            'workers': self.workers,
+            'restarts': self.restarts,
+            'uptime': time.time() - self.begintime,
+        }
+
+    def shutdown(self):
+        self.executor.shutdown(wait=True)
+
+
+class RequestHandler(BaseHTTPRequestHandler):
+    server_version = 'naffoliapy/' + VERSION
+    protocol_version = 'HTTP/1.1'
+
+    def address_string(self):
+        #Unix socket clients have no address
+        return self.client_address[0] if self.client_address else 'local'
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            BaseHTTPRequestHandler.log_message(self, format, *args)
+
+    def respond(self, status, body, contenttype='application/json', headers=None):
+        if not isinstance(body, bytes):
+            body = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', contenttype)
+        self.send_header('Content-Length', str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        path = urlsplit(self.path).path
+        if path == '/health':
+            self.respond(200, self.server.conversion.health())
+        elif path == '/queue':
+            self.respond(200, self.server.conversion.queue())
+        else:
+            self.respond(404, {'error': "No such endpoint: " + path})
+
+    def do_POST(self):
+        url = urlsplit(self.path)
+        converter = url.path.strip('/')
+        if 'Content-Length' not in self.headers:
+            self.respond(411, {'error': "Content-Length required"})
+            return
+        payload = self.rfile.read(int(self.headers['Content-Length']))
+        if converter not in CONVERTERS:
+            self.respond(404, {'error': "No such endpoint: " + url.path})
+            return
+        query = dict( (key, values[-1]) for key, values in parse_qs(url.query).items() )
+        options = {
+            'filename': query.get('filename'),
+            'id': query.get('id'),
+            'layers': query.get('layers'),
+            'stream': query.get('stream', '').lower() in ('1', 'true', 'yes'),
+        }
+        try:
+            output, warnings = self.server.conversion.convert(converter, payload, options)
+        except QueueFull as e:
+            self.respond(503, {'error': str(e)}, headers={'Retry-After': '1'})
+        except ConversionError as e:
+            self.respond(422, {'error': str(e)})
+        except Exception as e:
+            self.respond(422, {'error': e.__class__.__name__ + ": " + str(e)})
+        else:
+            self.respond(200, output, 'application/xml', {'X-Warnings': str(warnings)})
+
+
+class ThreadingHTTPServer(socketserver.ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+class ThreadingUnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+def make_server(conversion, socketpath=None, host='127.0.0.1', port=DEFAULT_PORT, verbose=False):
+    """
+    Creates the HTTP server for a ConversionServer, call serve_forever() on it to start serving
+    :param conversion: ConversionServer instance
+    :param socketpath: path of the Unix socket to listen on, if not set the server listens on host and port (str)
+    :return: a socketserver.BaseServer instance
+    """
+    if socketpath:
+        if os.path.exists(socketpath):
+            #left behind by a server that did not shut down, unless one is still listening
+            try:
+                status, _, _ = request('GET', '/health', socketpath=socketpath, timeout=1)
+            except (IOError, OSError):
+                os.unlink(socketpath)
+            else:
+                raise IOError("A server is already listening on " + socketpath)
+        httpserver = ThreadingUnixServer(socketpath, RequestHandler)
+    else:
+        httpserver = ThreadingHTTPServer((host, port), RequestHandler)
+    httpserver.conversion = conversion
+    httpserver.verbose = verbose
+    return httpserver
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, socketpath, timeout=None):
+        http.client.HTTPConnection.__init__(self, 'localhost', timeout=timeout)
+        self.socketpath = socketpath
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        if self.timeout is not None:
+            self.sock.settimeout(self.timeout)
+        self.sock.connect(self.socketpath)
+
+def request(method, path, body=None, socketpath=None, host='127.0.0.1', port=DEFAULT_PORT, timeout=None):
+    """
+    Sends a request to a conversion server
+    :return: tuple of the status (int), headers (dict) and body (bytes) of the response
+    """
+    if socketpath:
+        connection = UnixHTTPConnection(socketpath, timeout)
+    else:
+        connection = http.client.HTTPConnection(host, port, timeout=timeout)
+    try:
+        connection.request(method, path, body)
+        response = connection.getresponse()
+        return response.status, dict(response.getheaders()), response.read()
+    finally:
+        connection.close()
+
+def convert(converter, payload, socketpath=None, host='127.0.0.1', port=DEFAULT_PORT, timeout=None, **options):
+    """
+    Converts a document with a conversion server
+    :param converter: 'naf2folia' or 'folia2naf'
+    :param payload: the input document (bytes)
+    :param options: filename, id, layers and stream, see the endpoints
+    :return: tuple of the converted document (bytes) and the number of warnings (int)
+    """
+    query = urlencode(dict( (key, value) for key, value in options.items() if value ))
+    status, headers, body = request('POST', '/' + converter + ('?' + query if query else ''), payload, socketpath, host, port, timeout)
+    if status != 200:
+        try:
+            message = json.loads(body.decode('utf-8'))['error']
+        except (ValueError, KeyError):
+            message = body.decode('utf-8', 'replace')
+        raise ConversionError(message)
+    return body, int(headers.get('X-Warnings', 0))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='naffoliapy-server', description="Conversion server for naf2folia and folia2naf, with a pool of worker processes that have the converters loaded", formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('--socket', type=str, help="Listen on this Unix socket rather than on a TCP port", default=None)
+    parser.add_argument('--host', type=str, help="Address to listen on (only localhost is safe, the server has no authentication)", default='127.0.0.1')
+    parser.add_argument('--port', type=int, help="TCP port to listen on", default=DEFAULT_PORT)
+    parser.add_argument('-j', '--workers', type=int, help="Number of worker processes (defaults to the number of CPUs)", default=None)
+    parser.add_argument('--max-queue', type=int, help="Maximum number of documents waiting for a worker, further requests are rejected (defaults to four per worker)", default=None)
+    parser.add_argument('-v', '--verbose', action='store_true', help="Log every request to stderr")
+    args = parser.parse_args(argv)
+
+    conversion = ConversionServer(args.workers, args.max_queue)
+    try:
+        httpserver = make_server(conversion, args.socket, args.host, args.port, args.verbose)
+    except (IOError, OSError) as e:
+        conversion.shutdown()
+        parser.error(str(e))
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    print("Listening on " + (args.socket or args.host + ":" + str(args.port)) + " with " + str(conversion.workers) + " worker(s)", file=sys.stderr)
+    try:
+        httpserver.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        httpserver.server_close()
+        conversion.shutdown()
+        if args.socket and os.path.exists(args.socket):
+            os.unlink(args.socket)
+
+def client_main(argv=None):
+    parser = argparse.ArgumentParser(prog='naffoliapy-client', description="Converts documents with a running naffoliapy-server", formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('command', choices=CONVERTERS + ('health', 'queue'), help="naf2folia or folia2naf: convert a document; health, queue: show the status of the server")
+    parser.add_argument('inputfile', nargs='?', default=None, help="Input document")
+    parser.add_argument('outputfile', nargs='?', default=None, help="Output document (defaults to stdout)")
+    parser.add_argument('--socket', type=str, help="Unix socket of the server", default=None)
+    parser.add_argument('--host', type=str, help="Address of the server", default='127.0.0.1')
+    parser.add_argument('--port', type=int, help="TCP port of the server", default=DEFAULT_PORT)
+    parser.add_argument('--id', type=str, help="naf2folia: document ID for the FoLiA document (derived from the input filename if not set)", default=None)
+    parser.add_argument('--layers', type=str, help="naf2folia: comma separated list of layers to convert", default=None)
+    parser.add_argument('--stream', action='store_true', help="Convert with bounded memory use, see --stream of the converters")
+    parser.add_argument('--timeout', type=float, help="Seconds to wait for the server", default=None)
+    args = parser.parse_args(argv)
+
+    try:
+        if args.command in CONVERTERS:
+            if not args.inputfile:
+                parser.error(args.command + " requires an input document")
+            with open(args.inputfile, 'rb') as f:
+                payload = f.read()
+            output, warnings = convert(args.command, payload, args.socket, args.host, args.port, args.timeout, filename=os.path.basename(args.inputfile), id=args.id, layers=args.layers, stream='true' if args.stream else None)
+            if args.outputfile:
+                with open(args.outputfile, 'wb') as f:
+                    f.write(output)
+            else:
+                getattr(sys.stdout, 'buffer', sys.stdout).write(output)
+            if warnings:
+                print(str(warnings) + " warning(s), run the converter directly to see them", file=sys.stderr)
+        else:
+            status, _, body = request('GET', '/' + args.command, None, args.socket, args.host, args.port, args.timeout)
+            print(json.dumps(json.loads(body.decode('utf-8')), indent=4))
+            if status != 200:
+                sys.exit(1)
+    except ConversionError as e:
+        print("ERROR: " + str(e), file=sys.stderr)
+        sys.exit(1)
+    except (IOError, OSError) as e:
+        print("ERROR: Could not reach the server: " + str(e), file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
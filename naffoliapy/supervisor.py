@@ -0,0 +1,236 @@
+#!/usr/bin/env python
+#-*- coding:utf-8 -*-
+
+# Supervised worker processes for batch conversion in NAFFoLiAPy
+# Licensed under GPLv3
+
+'''
+Batch conversion with limits on every document. One pathological document (an enormous layer, input that makes a
+converter loop or blow up) should not stall or bring down the conversion of a whole corpus, so every document is
+converted in a worker process that is watched: a worker that takes longer than the time limit for a document, or
+grows beyond the memory limit, is killed and replaced by a new one, and the document is recorded as failed. The
+other workers keep converting. Workers can also be replaced after a number of documents, so slow growth of their
+memory use is capped:
+
+    $ naf2folia --timeout 300 --max-memory 2000 --recycle 100 --quarantine quarantine/ --outputdir folia/ naf/
+
+The documents that hit a limit, or crashed their worker, are copied to the quarantine directory, if one is given,
+and listed with the reason in the quarantine.jsonl file there. Their incomplete output is removed. They are not
+recorded in a journal (see naffoliapy.journal), a restart tries them again.
+
+The memory use of a worker is its resident set size, read from /proc, so memory limits are only available on Linux.
+'''
+
+from __future__ import print_function, unicode_literals, division, absolute_import
+
+import os
+import io
+import json
+import time
+import shutil
+import signal
+import multiprocessing
+from collections import deque
+from multiprocessing.connection import wait
+
+#how often the memory use of the workers is checked, in seconds
+POLL_INTERVAL = 0.1
+
+PAGESIZE = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+
+
+def memory_supported():
+    """Returns True if the memory use of worker processes can be measured on this system"""
+    return os.path.exists('/proc/self/statm')
+
+def rss(pid):
+    """
+    Returns the resident set size of a process
+    :param pid: process ID (int)
+    :return: size in bytes (int), None if it can not be determined
+    """
+    try:
+        with open('/proc/' + str(pid) + '/statm', 'rb') as f:
+            return int(f.read().split()[1]) * PAGESIZE
+    except (IOError, OSError, ValueError, IndexError):
+        return None
+
+
+class Quarantine(object):
+    """A directory with copies of the documents that hit a limit, and a log of why"""
+
+    def __init__(self, directory):
+        """
+        :param directory: the quarantine directory, created if it does not exist (str)
+        """
+        self.directory = directory
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self.logfile = os.path.join(directory, 'quarantine.jsonl')
+
+    def add(self, inputfile, outputfile, reason):
+        """
+        Copies a document to the quarantine and adds it to the log
+        :param inputfile: path to the input document (str)
+        :param outputfile: path of the output document it was converted to (str)
+        :param reason: why the document is quarantined (str)
+        :return: path to the copy of the input document (str)
+        """
+        filename = os.path.basename(inputfile)
+        copy = os.path.join(self.directory, filename)
+        n = 1
+        while os.path.exists(copy):
+            n += 1
+            copy = os.path.join(self.directory, str(n) + '.' + filename)
+        try:
+            shutil.copyfile(inputfile, copy)
+        except (IOError, OSError):
+            copy = None
+        with io.open(self.logfile, 'a', encoding='utf-8') as f:
+            f.write(json.dumps({'input': os.path.abspath(inputfile), 'output': os.path.abspath(outputfile), 'copy': copy and os.path.basename(copy), 'reason': reason, 'time': time.time()}, sort_keys=True) + '\n')
+        return copy
+
+
+def _work(run, function, connection, initializer):
+    #Runs in a worker process: prepares, tells the supervisor it is ready and converts the documents it is sent,
+    #until it is sent None
+    if initializer is not None:
+        initializer()
+    connection.send(None)
+    while True:
+        try:
+            job = connection.recv()
+        except EOFError:
+            #the supervisor is gone
+            return
+        if job is None:
+            return
+        connection.send(run(function, *job))
+
+
+class _Worker(object):
+    """A worker process and the document it is converting"""
+
+    def __init__(self, context, run, function, initializer):
+        self.connection, connection = context.Pipe()
+        self.process = context.Process(target=_work, args=(run, function, connection, initializer))
+        self.process.daemon = True
+        self.process.start()
+        connection.close()
+        self.ready = False
+        self.job = None
+        self.started = None
+        self.jobs = 0
+
+    def submit(self, job):
+        self.job = job
+        self.started = time.time()
+        self.jobs += 1
+        self.connection.send(job)
+
+    def stop(self):
+        try:
+            self.connection.send(None)
+        except (IOError, OSError):
+            pass
+        self.process.join()
+        self.connection.close()
+
+    def kill(self):
+        if self.process.is_alive():
+            os.kill(self.process.pid, getattr(signal, 'SIGKILL', signal.SIGTERM))
+        self.process.join()
+        self.connection.close()
+
+
+def convert_supervised(jobs, run, function, workers, done, failed, timeout=None, maxmemory=None, recycle=None, quarantine=None, initializer=None):
+    """
+    Converts a batch of documents in supervised worker processes, used by naffoliapy.batch.convert_batch()
+    :param jobs: list of (inputfile, outputfile) tuples
+    :param run: function that converts a document in a worker, called with function, inputfile and outputfile, must be defined at module level
+    :param function: conversion function, passed to run
+    :param workers: number of worker processes (int)
+    :param done: called in this process with what run returned, for every document that was converted or failed with an error
+    :param failed: called in this process with an (inputfile, outputfile, duration, error) tuple for every document whose worker was killed or died
+    :param timeout: maximum time a document may take to convert, in seconds (float), None for no limit
+    :param maxmemory: maximum resident set size of a worker, in bytes (int), None for no limit
+    :param recycle: replace every worker after it converted this number of documents (int), None to keep the workers
+    :param quarantine: a Quarantine for the documents that hit a limit or crashed their worker
+    :param initializer: called in every new worker before it is given documents, e.g. to do the imports, which then do not count towards the time limit of its first document, must be defined at module level
+    """
+    if maxmemory and not memory_supported():
+        raise ValueError("Memory limits are not supported on this system, they need /proc")
+    if not jobs:
+        return
+    context = multiprocessing.get_context()
+    queue = deque(jobs)
+    pool = [ _Worker(context, run, function, initializer) for _ in range(max(1, min(workers, len(jobs)))) ]
+
+    def restart(worker):
+        #a new worker in its place, if there is work left for it
+        if queue:
+            pool[pool.index(worker)] = _Worker(context, run, function, initializer)
+        else:
+            pool.remove(worker)
+
+    def kill(worker, reason):
+        inputfile, outputfile = worker.job
+        duration = time.time() - worker.started
+        worker.kill()
+        if os.path.exists(outputfile):
+            #incomplete
+            os.unlink(outputfile)
+        if quarantine is not None:
+            quarantine.add(inputfile, outputfile, reason)
+        failed((inputfile, outputfile, duration, reason))
+        restart(worker)
+
+    try:
+        while True:
+            watched = [ worker for worker in pool if worker.job is not None or not worker.ready ]
+            if not watched:
+                break
+            busy = [ worker for worker in watched if worker.job is not None ]
+            waittime = None
+            if timeout and busy:
+                waittime = max(0.0, min( worker.started + timeout for worker in busy ) - time.time())
+            if maxmemory:
+                waittime = POLL_INTERVAL if waittime is None else min(waittime, POLL_INTERVAL)
+            ready = wait([ worker.connection for worker in watched ] + [ worker.process.sentinel for worker in watched ], waittime)
+            now = time.time()
+            for worker in watched:
+                if worker.connection in ready or worker.process.sentinel in ready:
+                    try:
+                        result = worker.connection.recv()
+                    except (EOFError, IOError, OSError):
+                        worker.process.join()
+                        if worker.job is None:
+                            raise RuntimeError("A worker process failed to start, it exited with code " + str(worker.process.exitcode))
+                        kill(worker, "WorkerDied: the worker process exited with code " + str(worker.process.exitcode))
+                        continue
+                    if not worker.ready:
+                        worker.ready = True
+                        continue
+                    worker.job = None
+                    done(result)
+                    if recycle and worker.jobs >= recycle:
+                        worker.stop()
+                        restart(worker)
+                elif worker.job is None:
+                    #starting
+                    continue
+                elif timeout and now - worker.started > timeout:
+                    kill(worker, "Timeout: the conversion took longer than " + "%g" % timeout + "s")
+                elif maxmemory:
+                    size = rss(worker.process.pid)
+                    if size is not None and size > maxmemory:
+                        kill(worker, "MemoryLimit: the worker used " + str(size // (1024 * 1024)) + " MB, more than the limit of " + str(maxmemory // (1024 * 1024)) + " MB")
+            for worker in pool:
+                if worker.ready and worker.job is None and queue:
+                    worker.submit(queue.popleft())
+    finally:
+        for worker in pool:
+            if worker.ready and worker.job is None:
+                worker.stop()
+            else:
+                worker.kill()
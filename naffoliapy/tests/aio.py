@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+
+import io
+import os
+import re
+import gzip
+import asyncio
+import unittest
+from naffoliapy import aio
+from naffoliapy.naf2folia import naf2folia_bytes
+from naffoliapy.folia2naf import folia2naf_bytes
+from naffoliapy.diagnostics import WarningCollector
+
+EXAMPLE_PATH = os.path.join(os.path.split(__file__)[0], "../../examples/")
+NAFFILE = os.path.join(EXAMPLE_PATH, "100911_Northrop_Grumman_and_Airbus_parent_EADS_defeat_Boeing.naf.xml")
+#a smaller document for the tests that convert many
+SMALL_NAFFILE = os.path.join(EXAMPLE_PATH, "potgrond.txt.out.naf")
+FOLIAFILE = os.path.join(EXAMPLE_PATH, "potgrond.frog.folia.xml")
+
+
+def read(filename):
+    with open(filename, 'rb') as f:
+        return f.read()
+
+def untimed(naf):
+    """Leaves out the time stamps of a NAF document, which differ between conversions"""
+    return re.sub(rb'[Tt]imestamp="[^"]*"', b'', naf)
+
+def run(coroutine):
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        loop.close()
+
+
+class AIO_Test(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.naf = read(NAFFILE)
+        cls.small_naf = read(SMALL_NAFFILE)
+        cls.folia = read(FOLIAFILE)
+        cls.expected_folia = naf2folia_bytes(cls.naf, collector=WarningCollector())
+        cls.expected_small_folia = naf2folia_bytes(cls.small_naf, collector=WarningCollector())
+        cls.expected_naf = folia2naf_bytes(cls.folia, collector=WarningCollector())
+        cls.executor = aio.create_executor('process', 2)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.executor.shutdown()
+
+    def test001_convert(self):
+        """AIO - Documents are converted without blocking the event loop"""
+        async def main():
+            ticks = 0
+            async def tick():
+                nonlocal ticks
+                while True:
+                    await asyncio.sleep(0.01)
+                    ticks += 1
+            ticker = asyncio.ensure_future(tick())
+            collector = WarningCollector()
+            folia = await aio.naf2folia_async(self.naf, collector=collector)
+            naf = await aio.folia2naf_async(FOLIAFILE, collector=collector, executor=self.executor)
+            ticker.cancel()
+            return folia, naf, ticks, len(collector)
+        folia, naf, ticks, warnings = run(main())
+        self.assertEqual( folia, self.expected_folia )
+        self.assertEqual( untimed(naf), untimed(self.expected_naf) )
+        self.assertTrue( ticks > 5 )
+        self.assertTrue( warnings > 0 )
+
+    def test002_output(self):
+        """AIO - Documents are read from and written to streams, and compressed"""
+        async def main():
+            output = io.BytesIO()
+            await aio.naf2folia_async(io.BytesIO(self.naf), output=output, collector=WarningCollector(), compress='gz', executor=self.executor)
+            return output.getvalue()
+        self.assertEqual( gzip.decompress(run(main())), self.expected_folia )
+        with self.assertRaises(aio.ConversionError):
+            run(aio.folia2naf_async(b'<not a document', collector=WarningCollector()))
+        with self.assertRaises(TypeError):
+            run(aio.folia2naf_async(self.folia, layers='text'))
+
+    def test003_as_completed(self):
+        """AIO - Many documents are converted, a limited number at a time, and failures are reported with their document"""
+        taken = []
+        def documents():
+            for i in range(6):
+                taken.append(i)
+                yield b'<not a document' if i == 3 else self.small_naf
+        async def main():
+            conversions = []
+            async for conversion in aio.as_completed(documents(), executor=self.executor, concurrency=2):
+                conversions.append(conversion)
+                self.assertTrue( len(taken) - len(conversions) <= 2 )
+            return conversions
+        conversions = run(main())
+        self.assertEqual( sorted( conversion.index for conversion in conversions ), list(range(6)) )
+        for conversion in conversions:
+            if conversion.index == 3:
+                self.assertIsInstance( conversion.error, aio.ConversionError )
+            else:
+                self.assertIsNone( conversion.error )
+                self.assertEqual( conversion.data, self.expected_small_folia )
+                self.assertTrue( conversion.warnings['categories'] )
+
+    def test004_cancel(self):
+        """AIO - Conversions that did not start are cancelled when the consumer stops"""
+        taken = []
+        def documents():
+            for i in range(100):
+                taken.append(i)
+                yield self.small_naf
+        async def main():
+            conversions = aio.as_completed(documents(), executor=self.executor, concurrency=2)
+            async for conversion in conversions:
+                break
+            await conversions.aclose()
+        run(main())
+        self.assertTrue( len(taken) <= 4 )
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+
+import io
+import os
+import re
+import sys
+import time
+import shutil
+import tempfile
+import unittest
+from lxml import etree
+from pynlpl.formats import folia
+from naffoliapy import batch
+from naffoliapy.naf2folia import derive_docid, convert_file
+
+CORPUS_PATH = os.path.join(os.path.split(__file__)[0], "../../corpora/meantime_dutch_naf/")
+EXAMPLE_PATH = os.path.join(os.path.split(__file__)[0], "../../examples/")
+
+
+class Batch_InputTest(unittest.TestCase):
+
+    def test001_directory(self):
+        """Batch - Directories are searched recursively and mirrored"""
+        inputs = batch.collect_inputs([CORPUS_PATH], ('.naf',))
+        self.assertTrue( len(inputs) > 100 )
+        for inputfile, relpath in inputs:
+            self.assertEqual( os.path.join(CORPUS_PATH, relpath), inputfile )
+        self.assertIn( os.path.join('gm-out','31965_GM_posts_first_annual_loss_since_1992.xml.out.naf'), [ relpath for _, relpath in inputs ] )
+
+    def test002_glob(self):
+        """Batch - Glob patterns are expanded, files are placed relative to their common directory"""
+        inputs = batch.collect_inputs([os.path.join(CORPUS_PATH, '*-out', '3*.naf')])
+        self.assertTrue( len(inputs) > 1 )
+        for _, relpath in inputs:
+            self.assertTrue( relpath.split(os.sep)[0].endswith('-out') )
+
+    def test003_output_path(self):
+        """Batch - Output path in the mirrored tree"""
+        self.assertEqual( batch.output_path(os.path.join('gm','doc.naf.xml'), 'out', ('.naf.xml','.xml'), '.folia.xml'), os.path.join('out','gm','doc.folia.xml') )
+        self.assertEqual( batch.output_path('doc.xml.out.naf', 'out', ('.naf',), '.folia.xml'), os.path.join('out','doc.xml.out.folia.xml') )
+
+    def test004_docid(self):
+        """Batch - Document IDs derived from filenames are valid NCNames"""
+        self.assertEqual( derive_docid('corpus/101354_Apple_releases_iPhone_SDK,_announces.xml'), '_101354_Apple_releases_iPhone_SDK__announces' )
+        self.assertEqual( derive_docid('potgrond.txt.out.naf'), 'potgrond' )
+        for filename in ('caf\u00e9\u0301.naf', '\u0663\u0664-doc.naf', '\u00b2x.naf', '-doc.naf', '.naf'):
+            docid = derive_docid(filename)
+            self.assertTrue( re.match(r'^[A-Za-z_][A-Za-z0-9_.-]*$', docid), docid )
+            folia.Document(id=docid)
+        self.assertEqual( derive_docid('caf\u00e9.naf'), 'caf_' )
+
+
+def warn_twice(inputfile, outputfile):
+    """A conversion that writes two warnings, one at a time"""
+    for i in range(2):
+        print("WARNING: warning " + str(i) + " of " + os.path.basename(inputfile), file=sys.stderr)
+
+class Writes(object):
+    """A stream that records every write"""
+    def __init__(self):
+        self.writes = []
+    def write(self, data):
+        self.writes.append(data)
+    def flush(self):
+        pass
+
+
+class Batch_ConvertTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test001_workers(self):
+        """Batch - Documents are converted by worker processes, a broken document fails on its own and is reported"""
+        broken = os.path.join(self.directory, 'broken.naf')
+        with open(broken, 'w') as f:
+            f.write('<NAF xml:lang="en"><text><wf id="w1"')
+        inputfiles = [ os.path.join(EXAMPLE_PATH, "100911_Northrop_Grumman_and_Airbus_parent_EADS_defeat_Boeing.naf.xml"), os.path.join(EXAMPLE_PATH, "potgrond.txt.out.naf"), broken ]
+        jobs = [ (inputfile, batch.output_path(os.path.basename(inputfile), os.path.join(self.directory, 'out'), ('.naf.xml', '.naf'), '.folia.xml')) for inputfile in inputfiles ]
+        begintime = time.time()
+        results = batch.convert_batch(jobs, convert_file, 2)
+        duration = time.time() - begintime
+        self.assertEqual( sorted( (inputfile, outputfile) for inputfile, outputfile, _, _ in results ), sorted(jobs) )
+        errors = { inputfile: error for inputfile, _, _, error in results }
+        for inputfile, outputfile in jobs[:2]:
+            self.assertIsNone( errors[inputfile] )
+            self.assertEqual( etree.parse(outputfile).getroot().get('{http://www.w3.org/XML/1998/namespace}id'), derive_docid(inputfile) )
+        self.assertTrue( errors[broken].startswith('XMLSyntaxError: ') )
+
+        stream = io.StringIO()
+        batch.print_summary(results, duration, slowest=2, stream=stream)
+        lines = stream.getvalue().splitlines()
+        self.assertTrue( lines[0].startswith("Converted 2 of 3 documents in " + "%.2f" % duration + "s (") )
+        self.assertTrue( lines[0].endswith(" documents/s), 1 failed") )
+        self.assertEqual( lines[1], "Slowest documents:" )
+        slowest = sorted(results, key=lambda result: result[2], reverse=True)[:2]
+        self.assertEqual( lines[2:4], [ "\t" + "%.2f" % documentduration + "s\t" + inputfile for inputfile, _, documentduration, _ in slowest ] )
+        self.assertEqual( lines[4:], ["Failed documents:", "\t" + broken + "\t" + errors[broken]] )
+
+    def test002_warnings(self):
+        """Batch - The warnings of a document are written at once, headed by the document"""
+        stream = Writes()
+        stderr = sys.stderr
+        sys.stderr = stream
+        try:
+            results = batch.convert_batch([ (os.path.join(self.directory, name), os.path.join(self.directory, name + '.out')) for name in ('a.naf', 'b.naf') ], warn_twice, 1)
+        finally:
+            sys.stderr = stderr
+        self.assertEqual( [ error for _, _, _, error in results ], [None, None] )
+        self.assertEqual( stream.writes, [ os.path.join(self.directory, name) + ":\nWARNING: warning 0 of " + name + "\nWARNING: warning 1 of " + name + "\n" for name in ('a.naf', 'b.naf') ] )
+
+
+if __name__ == '__main__':
+    unittest.main()
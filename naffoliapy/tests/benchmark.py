@@ -0,0 +1,49 @@
+#!/usr/bin/env python3
+
+import os
+import unittest
+from naffoliapy import benchmark
+
+EXAMPLE_PATH = os.path.join(os.path.split(__file__)[0], "../../examples/")
+
+
+def results(**metrics):
+    suite = { 'failures': [], 'tokens_per_second': 1000.0, 'latency_p50': 0.5, 'latency_p95': 1.0, 'peak_memory': 100 * 1024 * 1024 }
+    suite.update(metrics)
+    return { 'suites': { 'meantime_dutch': suite } }
+
+class Benchmark_Test(unittest.TestCase):
+
+    def test001_percentile(self):
+        """Benchmark - Nearest-rank percentiles"""
+        values = list(range(1, 101))
+        self.assertEqual( benchmark.percentile(values, 50), 50 )
+        self.assertEqual( benchmark.percentile(values, 95), 95 )
+        self.assertEqual( benchmark.percentile(values, 100), 100 )
+        self.assertEqual( benchmark.percentile([3.0], 99), 3.0 )
+        self.assertIsNone( benchmark.percentile([], 50) )
+
+    def test002_compare(self):
+        """Benchmark - Slowdowns beyond the tolerance are regressions"""
+        baseline = results()
+        self.assertEqual( benchmark.compare(results(tokens_per_second=900.0, latency_p95=1.1), baseline, 0.2), [] )
+        self.assertEqual( benchmark.compare(results(tokens_per_second=5000.0, latency_p50=0.1), baseline, 0.2), [] )
+        regressions = benchmark.compare(results(tokens_per_second=700.0, peak_memory=200 * 1024 * 1024), baseline, 0.2)
+        self.assertEqual( len(regressions), 2 )
+        self.assertTrue( regressions[0].startswith('meantime_dutch: tokens_per_second') )
+        self.assertEqual( len(benchmark.compare(results(failures=['doc.naf: Exception']), baseline, 0.2)), 1 )
+
+    def test003_run(self):
+        """Benchmark - Running a suite reports throughput, latency and memory"""
+        inputfiles = benchmark.suite_inputs('examples_folia')
+        self.assertIn( os.path.abspath(os.path.join(EXAMPLE_PATH, "potgrond.frog.folia.xml")), [ os.path.abspath(inputfile) for inputfile in inputfiles ] )
+        metrics = benchmark.run_suite('folia2naf', [ os.path.join(EXAMPLE_PATH, "potgrond.frog.folia.xml") ])
+        self.assertEqual( metrics['documents'], 1 )
+        self.assertEqual( metrics['tokens'], 83 )
+        self.assertTrue( metrics['tokens_per_second'] > 0 )
+        self.assertTrue( metrics['latency_p50'] <= metrics['latency_max'] )
+        self.assertTrue( metrics['peak_memory'] > 0 )
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+
+import os
+import threading
+import unittest
+from naffoliapy import bulk
+from naffoliapy.naf2folia import naf2folia
+from naffoliapy.diagnostics import WarningCollector
+from pynlpl.formats import folia
+
+EXAMPLE_PATH = os.path.join(os.path.split(__file__)[0], "../../examples/")
+CORPUS_PATH = os.path.join(os.path.split(__file__)[0], "../../corpora/meantime_dutch_naf/")
+
+#documents with span annotations whose words are not in document order, which pynlpl keeps in a peculiar order
+DOCUMENTS = [
+    os.path.join(EXAMPLE_PATH, "100911_Northrop_Grumman_and_Airbus_parent_EADS_defeat_Boeing.naf.xml"),
+    os.path.join(CORPUS_PATH, "apple-out", "58383_Cisco_sues_Apple.xml.out.naf"),
+]
+
+
+class Bulk_Test(unittest.TestCase):
+
+    def test001_identical(self):
+        """Bulk - Building with deferred validation gives the same FoLiA document as building with the checks"""
+        for naffile in DOCUMENTS:
+            if not os.path.exists(naffile):
+                continue
+            expected = naf2folia(naffile, 'd', collector=WarningCollector()).xmlstring()
+            self.assertEqual( naf2folia(naffile, 'd', collector=WarningCollector(), bulk=True).xmlstring(), expected )
+            self.assertEqual( naf2folia(naffile, 'd', collector=WarningCollector(), bulk=True, validate=False).xmlstring(), expected )
+
+    def test002_validate(self):
+        """Bulk - The skipped checks are made on the finished document"""
+        doc = folia.Document(id='example')
+        doc.declare(folia.PosAnnotation, 'tagset')
+        with bulk.bulk_build():
+            sentence = doc.append(folia.Text(doc, id='example.text')).append(folia.Sentence, id='example.s1')
+            word = sentence.append(folia.Word, id='example.s1.w1')
+            word.append(folia.TextContent, 'huis')
+            word.append(folia.PosAnnotation, cls='N', set='tagset')
+            bulk.validate(doc)
+            word.append(folia.PosAnnotation, cls='ADJ', set='tagset')
+        with self.assertRaises(folia.DuplicateAnnotationError):
+            bulk.validate(doc)
+        word.data.pop()
+        word.data.append(folia.Sentence(doc, id='example.s2'))
+        word.data[-1].parent = word
+        with self.assertRaises(ValueError):
+            bulk.validate(doc)
+
+    def test003_scope(self):
+        """Bulk - The checks are only skipped within bulk_build(), in the thread that started it"""
+        doc = folia.Document(id='example')
+        doc.declare(folia.PosAnnotation, 'tagset')
+        word = doc.append(folia.Text(doc, id='example.text')).append(folia.Sentence, id='example.s1').append(folia.Word, id='example.s1.w1')
+        word.append(folia.PosAnnotation, cls='N', set='tagset')
+        results = []
+        def append():
+            try:
+                word.append(folia.PosAnnotation, cls='ADJ', set='tagset')
+                results.append(None)
+            except folia.DuplicateAnnotationError as e:
+                results.append(e)
+        with bulk.bulk_build():
+            self.assertTrue( bulk.active() )
+            thread = threading.Thread(target=append)
+            thread.start()
+            thread.join()
+        self.assertFalse( bulk.active() )
+        self.assertIsInstance( results[0], folia.DuplicateAnnotationError )
+        with self.assertRaises(folia.DuplicateAnnotationError):
+            word.append(folia.PosAnnotation, cls='ADJ', set='tagset')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+
+import os
+import shutil
+import tempfile
+import unittest
+from naffoliapy.cache import ConversionCache
+from naffoliapy.naf2folia import convert_file
+from naffoliapy.folia2naf import convert_file_to_naf
+from naffoliapy.diagnostics import WarningCollector
+
+EXAMPLE_PATH = os.path.join(os.path.split(__file__)[0], "../../examples/")
+
+
+def read(filename):
+    with open(filename, 'rb') as f:
+        return f.read()
+
+class Cache_Test(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.cache = ConversionCache(os.path.join(self.tmpdir, 'cache'))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test001_key(self):
+        """Cache - Keys depend on the input, the converter version and the options"""
+        naffile = os.path.join(self.tmpdir, 'doc.naf')
+        shutil.copyfile(os.path.join(EXAMPLE_PATH, "potgrond.txt.out.naf"), naffile)
+        key = self.cache.key(naffile, 'naf2folia', '0.1', {'layers': ['text']})
+        self.assertEqual( key, self.cache.key(naffile, 'naf2folia', '0.1', {'layers': ['text']}) )
+        self.assertNotEqual( key, self.cache.key(naffile, 'naf2folia', '0.2', {'layers': ['text']}) )
+        self.assertNotEqual( key, self.cache.key(naffile, 'naf2folia', '0.1', {'layers': ['terms']}) )
+        with open(naffile, 'ab') as f:
+            f.write(b'\n')
+        self.assertNotEqual( key, self.cache.key(naffile, 'naf2folia', '0.1', {'layers': ['text']}) )
+
+    def test002_hit(self):
+        """Cache - A document that was converted before is copied from the cache, with its warnings"""
+        naffile = os.path.join(EXAMPLE_PATH, "potgrond.txt.out.naf")
+        first = os.path.join(self.tmpdir, 'first.folia.xml')
+        second = os.path.join(self.tmpdir, 'second.folia.xml')
+        summary = convert_file(naffile, first, collector=WarningCollector(), cache=self.cache)
+        self.assertEqual( len(self.cache.entries()), 1 )
+        collector = WarningCollector()
+        self.assertEqual( convert_file(naffile, second, collector=collector, cache=self.cache), summary )
+        self.assertEqual( collector.summary(), summary )
+        self.assertEqual( read(first), read(second) )
+        self.assertEqual( len(self.cache.entries()), 1 )
+        convert_file(naffile, second, layers='text', collector=WarningCollector(), cache=self.cache)
+        self.assertEqual( len(self.cache.entries()), 2 )
+        foliafile = os.path.join(EXAMPLE_PATH, "potgrond.frog.folia.xml")
+        convert_file_to_naf(foliafile, first, collector=WarningCollector(), cache=self.cache)
+        convert_file_to_naf(foliafile, second, collector=WarningCollector(), cache=self.cache)
+        self.assertEqual( read(first), read(second) )
+        self.assertEqual( len(self.cache.entries()), 3 )
+
+    def test003_evict(self):
+        """Cache - The least recently used entries are removed when the cache gets too large"""
+        outputfile = os.path.join(self.tmpdir, 'output')
+        inputs = []
+        for i in range(3):
+            inputfile = os.path.join(self.tmpdir, 'input' + str(i))
+            with open(inputfile, 'wb') as f:
+                f.write(str(i).encode('ascii'))
+            inputs.append(inputfile)
+        with open(outputfile, 'wb') as f:
+            f.write(b'x' * 1000)
+        cache = ConversionCache(self.cache.directory, maxsize=2500)
+        keys = [ cache.key(inputfile, 'test', '1') for inputfile in inputs ]
+        for i, key in enumerate(keys[:2]):
+            cache.put(key, outputfile, warnings=None)
+            os.utime(cache.path(key, '.data'), (i, i))
+        self.assertIsNotNone( cache.get(keys[0], outputfile) ) #now the most recently used
+        cache.put(keys[2], outputfile)
+        self.assertEqual( sorted( key for key, _, _, _ in cache.entries() ), sorted([keys[0], keys[2]]) )
+        self.assertIsNone( cache.get(keys[1], outputfile) )
+        self.assertEqual( cache.evict(1000), 1 )
+        self.assertEqual( len(cache.entries()), 1 )
+
+    def test004_verify(self):
+        """Cache - Damaged entries are found by the integrity check and removed on repair"""
+        naffile = os.path.join(EXAMPLE_PATH, "potgrond.txt.out.naf")
+        convert_file(naffile, os.path.join(self.tmpdir, 'out.folia.xml'), collector=WarningCollector(), cache=self.cache)
+        convert_file(naffile, os.path.join(self.tmpdir, 'out.folia.xml'), layers='text', collector=WarningCollector(), cache=self.cache)
+        self.assertEqual( self.cache.verify(), [] )
+        key, datafile, _, _ = self.cache.entries()[0]
+        with open(datafile, 'r+b') as f:
+            f.write(b'X')
+        self.assertEqual( self.cache.verify(), [(key, "checksum mismatch")] )
+        self.assertEqual( self.cache.verify(repair=True), [(key, "checksum mismatch")] )
+        self.assertEqual( self.cache.verify(), [] )
+        self.assertEqual( len(self.cache.entries()), 1 )
+
+
+if __name__ == '__main__':
+    unittest.main()
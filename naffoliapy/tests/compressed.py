@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+
+import os
+import shutil
+import tempfile
+import unittest
+from naffoliapy import compression
+from naffoliapy.batch import output_path
+from naffoliapy.naf2folia import convert_file
+from naffoliapy.folia2naf import convert_file_to_naf
+from naffoliapy.diagnostics import WarningCollector
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+EXAMPLE_PATH = os.path.join(os.path.split(__file__)[0], "../../examples/")
+
+#formats that can be tested here, zstandard is optional
+FORMATS = [ format for format in compression.FORMATS if format != 'zst' or zstandard is not None ]
+
+
+def read(filename):
+    with open(filename, 'rb') as f:
+        return f.read()
+
+def write_compressed(data, filename, format):
+    with compression.open_output(filename, format) as f:
+        f.write(data)
+
+def read_decompressed(filename):
+    with compression.open_input(filename) as f:
+        return f.read()
+
+def without_timestamps(nafdata):
+    return b'\n'.join( line for line in nafdata.split(b'\n') if b'imestamp=' not in line )
+
+class Compression_Test(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test001_detection(self):
+        """Compression - Formats are recognised by their first bytes, output formats by their extension"""
+        data = b'<NAF/>' * 100
+        for format in FORMATS:
+            compressed = compression.compress(data, format)
+            self.assertEqual( compression.detect_bytes(compressed), format )
+            self.assertEqual( compression.decompress(compressed), data )
+            filename = os.path.join(self.tmpdir, 'document.' + format)
+            write_compressed(data, filename, None)
+            self.assertEqual( compression.detect(filename), format )
+            self.assertEqual( read_decompressed(filename), data )
+        self.assertEqual( compression.detect_bytes(data), None )
+        self.assertEqual( compression.decompress(data), data )
+        self.assertEqual( compression.split_extension('doc.naf.gz'), ('doc.naf', 'gz') )
+        self.assertEqual( compression.output_format('doc.folia.xml'), None )
+        self.assertEqual( compression.output_format('doc.folia.xml', 'xz'), 'xz' )
+        self.assertEqual( output_path(os.path.join('sub', 'doc.naf.gz'), 'out', ('.naf',), '.folia.xml'), os.path.join('out', 'sub', 'doc.folia.xml') )
+
+    def test002_naf2folia(self):
+        """Compression - Compressed NAF documents give the same FoLiA documents, compressed on request, in both converters"""
+        naffile = os.path.join(EXAMPLE_PATH, "potgrond.txt.out.naf")
+        for stream in (False, True):
+            plainfile = os.path.join(self.tmpdir, 'plain.folia.xml')
+            convert_file(naffile, plainfile, 'potgrond', stream, collector=WarningCollector())
+            for format in FORMATS:
+                #the input filename does not tell it is compressed
+                compressedfile = os.path.join(self.tmpdir, 'potgrond.naf')
+                write_compressed(read(naffile), compressedfile, format)
+                foliafile = os.path.join(self.tmpdir, 'potgrond.folia.xml.' + format)
+                convert_file(compressedfile, foliafile, 'potgrond', stream, collector=WarningCollector())
+                self.assertEqual( compression.detect(foliafile), format )
+                self.assertEqual( read_decompressed(foliafile), read(plainfile) )
+                foliafile = os.path.join(self.tmpdir, 'potgrond.folia.xml')
+                convert_file(compressedfile, foliafile, 'potgrond', stream, collector=WarningCollector(), compress=format)
+                self.assertEqual( read_decompressed(foliafile), read(plainfile) )
+
+    def test003_folia2naf(self):
+        """Compression - Compressed FoLiA documents give the same NAF documents, compressed on request, in both converters"""
+        inputfolia = os.path.join(EXAMPLE_PATH, "potgrond.frog.folia.xml")
+        for stream in (False, True):
+            plainfile = os.path.join(self.tmpdir, 'plain.naf')
+            convert_file_to_naf(inputfolia, plainfile, stream, collector=WarningCollector())
+            for format in FORMATS:
+                compressedfile = os.path.join(self.tmpdir, 'potgrond.folia.xml.' + format)
+                write_compressed(read(inputfolia), compressedfile, None)
+                convert_file_to_naf(compressedfile, None, stream, collector=WarningCollector(), compress=format)
+                outputnaf = os.path.join(self.tmpdir, 'potgrond.folia.xml.naf.' + format)
+                self.assertEqual( compression.detect(outputnaf), format )
+                self.assertEqual( without_timestamps(read_decompressed(outputnaf)), without_timestamps(read(plainfile)) )
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+
+import os
+import io
+import json
+import tempfile
+import unittest
+from lxml import etree
+from naffoliapy.naf2folia import naf2folia, convert_file
+from naffoliapy.diagnostics import WarningCollector
+
+EXAMPLE_PATH = os.path.join(os.path.split(__file__)[0], "../../examples/")
+
+
+class Diagnostics_Test(unittest.TestCase):
+
+    def test001_collector(self):
+        """Warnings - Grouped by category, identical warnings counted, limited per category"""
+        stream = io.StringIO()
+        collector = WarningCollector(limit=2, stream=stream)
+        for i in range(5):
+            collector.warn('misaligned-offset', "token w" + str(i))
+        collector.warn('confidence-range', "confidence 2.0")
+        collector.warn('confidence-range', "confidence 2.0")
+        self.assertEqual( len(collector), 7 )
+        summary = collector.summary()
+        self.assertEqual( summary['total'], 7 )
+        self.assertEqual( list(summary['categories']), ['misaligned-offset', 'confidence-range'] )
+        self.assertEqual( summary['categories']['misaligned-offset']['count'], 5 )
+        self.assertEqual( summary['categories']['misaligned-offset']['suppressed'], 3 )
+        self.assertEqual( summary['categories']['confidence-range']['messages'], [{'message': "confidence 2.0", 'count': 2}] )
+        self.assertEqual( stream.getvalue().count("\n"), 3 )
+        collector.flush()
+        self.assertIn( "3 more warning(s) of category 'misaligned-offset'", stream.getvalue() )
+        json.dumps(summary)
+
+    def test002_conversion(self):
+        """Warnings - Misaligned tokens are collected rather than written to stderr, and returned with the conversion"""
+        nafdoc = etree.parse(os.path.join(EXAMPLE_PATH, "potgrond.txt.out.naf"))
+        tokens = list(nafdoc.find('text'))
+        for token in tokens:
+            token.set('offset', str(int(token.get('offset')) + 1000))
+        with tempfile.NamedTemporaryFile(suffix='.naf') as f, tempfile.NamedTemporaryFile(suffix='.folia.xml') as out:
+            nafdoc.write(f.name)
+            collector = WarningCollector(limit=5)
+            naf2folia(f.name, "potgrond", collector=collector)
+            misaligned = collector.summary()['categories']['misaligned-offset']
+            self.assertEqual( misaligned['count'], len(tokens) )
+            self.assertEqual( len(misaligned['messages']), 5 )
+            summary = convert_file(f.name, out.name, collector=WarningCollector())
+            self.assertEqual( summary['categories']['misaligned-offset']['count'], len(tokens) )
+            summary = convert_file(f.name, out.name, stream=True, collector=WarningCollector())
+            self.assertEqual( summary['categories']['misaligned-offset']['count'], len(tokens) )
+
+
+if __name__ == '__main__':
+    unittest.main()
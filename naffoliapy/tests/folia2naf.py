@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+
+import gc
+import os
+import re
+import copy
+import time
+import weakref
+import unittest
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+from lxml import etree
+from naffoliapy.folia2naf import folia2naf, RawTextBuilder, FoLiA2NAFConverter
+from naffoliapy.profiling import Profiler, current_memory
+from naffoliapy.diagnostics import WarningCollector
+from pynlpl.formats import folia
+
+EXAMPLE_PATH = os.path.join(os.path.split(__file__)[0], "../../examples/")
+
+FROG_FILE = os.path.join(EXAMPLE_PATH, "potgrond.frog.folia.xml")
+UCTO_FILE = os.path.join(EXAMPLE_PATH, "100911_Northrop_Grumman_and_Airbus_parent_EADS_defeat_Boeing.folia.xml")
+
+NSFOLIA = '{http://ilk.uvt.nl/folia}'
+XMLID = '{http://www.w3.org/XML/1998/namespace}id'
+
+
+def processors(naf_obj):
+    return sorted( (lps.get_layer(), lp.get_name()) for lps in naf_obj.get_linguisticProcessors() for lp in lps )
+
+class FoLiA2NAF_StateTest(unittest.TestCase):
+
+    def test001_no_leakage(self):
+        """State - Converting a document does not affect the conversion of the next"""
+        fresh = processors(folia2naf(UCTO_FILE))
+        folia2naf(FROG_FILE)
+        self.assertEqual( processors(folia2naf(UCTO_FILE)), fresh )
+        self.assertEqual( set( layer for layer, _ in fresh ), {'text'} )
+
+    def test002_concurrent(self):
+        """State - Concurrent conversions in threads give the same result as serial ones"""
+        inputfiles = [FROG_FILE, UCTO_FILE] * 4
+        serial = [ processors(folia2naf(inputfile)) for inputfile in inputfiles ]
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            concurrent = list(executor.map(lambda inputfile: processors(folia2naf(inputfile)), inputfiles))
+        self.assertEqual( serial, concurrent )
+
+    def test003_profiler(self):
+        """State - Every stage of the conversion is measured"""
+        profiler = Profiler()
+        naf_obj = folia2naf(FROG_FILE, profiler)
+        self.assertEqual( list(profiler.stages), ['load', 'text', 'raw', 'deps', 'chunks', 'entities', 'header'] )
+        self.assertEqual( profiler.stages['text']['count'], len(list(naf_obj.get_tokens())) )
+        self.assertEqual( profiler.stages['deps']['count'], len(list(naf_obj.get_dependencies())) )
+
+    def test004_released(self):
+        """State - A converter and its documents are freed after the conversion"""
+        folia_obj = folia.Document(file=FROG_FILE)
+        converter = FoLiA2NAFConverter(folia_obj, collector=WarningCollector())
+        naf_obj = converter.convert()
+        references = [ weakref.ref(obj) for obj in (converter, folia_obj, naf_obj) ]
+        del converter, folia_obj, naf_obj
+        gc.collect()
+        self.assertEqual( [ reference() for reference in references ], [None, None, None] )
+
+    def test005_flat_memory(self):
+        """State - Memory stops growing when many documents are converted in one process"""
+        for _ in range(3):
+            folia2naf(FROG_FILE, collector=WarningCollector())
+        gc.collect()
+        before = current_memory()
+        for _ in range(15):
+            folia2naf(FROG_FILE, collector=WarningCollector())
+        gc.collect()
+        #keeping the 15 NAF documents alone would add about 10 MB
+        self.assertLess( current_memory() - before, 4 * 1024 * 1024 )
+
+
+def build_raw(words, text=None):
+    #synthetic document: (text, space, paragraph) for every word
+    builder = RawTextBuilder(text, 'doc.text')
+    offsets = [ builder.add(word, space, paragraph) for word, space, paragraph in words ]
+    return builder.finish(), offsets
+
+def synthetic_words(count):
+    return [ ('w' + str(i % 1000), i % 7 != 0, str(i // 100000)) for i in range(count) ]
+
+class FoLiA2NAF_RawTest(unittest.TestCase):
+
+    def test001_offsets(self):
+        """Raw text - Token offsets point into the raw text, across paragraphs"""
+        naf_obj = folia2naf(FROG_FILE)
+        raw = naf_obj.root.find('raw').text
+        tokens = list(naf_obj.get_tokens())
+        self.assertTrue( len(set( token.get_para() for token in tokens )) > 1 )
+        for token in tokens:
+            offset = int(token.get_offset())
+            self.assertEqual( raw[offset:offset+int(token.get_length())], token.get_text() )
+
+    def test002_textcontent(self):
+        """Raw text - The text content of the text body is used as raw text as long as the words match it"""
+        text = "Hello,  world!\n\nBye now "
+        raw, offsets = build_raw([('Hello', False, '1'), (',', True, '1'), ('world', False, '1'), ('!', True, '1'), ('Bye', True, '2'), ('now', True, '2')], text)
+        self.assertEqual( raw, text )
+        self.assertEqual( offsets, [0, 5, 8, 13, 16, 20] )
+        raw, offsets = build_raw([('Hello', False, '1'), (',', True, '1'), ('planet', False, '1'), ('!', True, '1'), ('Bye', True, '2')], text)
+        self.assertEqual( raw, "Hello, planet! \n\nBye" )
+        self.assertEqual( offsets, [0, 5, 7, 13, 17] )
+
+    def test003_linear(self):
+        """Raw text - Building the raw text of millions of tokens takes linear time"""
+        durations = []
+        for count in (250000, 2000000):
+            words = synthetic_words(count)
+            begintime = time.time()
+            raw, offsets = build_raw(words)
+            durations.append(time.time() - begintime)
+            for i in range(0, count, 9973):
+                self.assertEqual( raw[offsets[i]:offsets[i]+len(words[i][0])], words[i][0] )
+            textraw, textoffsets = build_raw(words, raw)
+            self.assertEqual( textraw, raw )
+            self.assertEqual( textoffsets, offsets )
+        #eight times as many tokens, quadratic growth would be 64 times as slow
+        self.assertLess( durations[1], durations[0] * 20 )
+
+
+class SelectingConverter(FoLiA2NAFConverter):
+    '''Walks the document as the converter did before visit(): the words of the sentences of the paragraphs, and select() for the annotations'''
+
+    def visit(self, element, annotationtypes, inparagraph=False, insentence=False):
+        for para in element.paragraphs():
+            self.naf_para += 1
+            for sent in para.sentences():
+                self.naf_sent += 1
+                for word in sent.words():
+                    self.word_count += 1
+                    self.add_word(*self.word_to_naf(word, self.word_count, str(self.naf_sent), str(self.naf_para), annotationtypes))
+        for Class in self.span_annotations:
+            self.annotations[Class].extend(element.select(Class))
+
+def naf_output(Converter, folia_obj):
+    #the time stamps differ between conversions
+    naf_obj = Converter(folia_obj, collector=WarningCollector()).convert()
+    return re.sub(rb'[Tt]imestamp="[^"]*"', b'', etree.tostring(naf_obj.root))
+
+def irregular_document():
+    """The Frog example with a sentence outside the paragraphs, entities outside the paragraphs and a non-authoritative entities layer"""
+    root = etree.parse(FROG_FILE).getroot()
+    text = root.find(NSFOLIA + 'text')
+    paragraph = text.find(NSFOLIA + 'p')
+    sentence = paragraph.find(NSFOLIA + 's')
+    outside = copy.deepcopy(sentence)
+    for layer in list(outside):
+        if layer.tag in (NSFOLIA + 'chunking', NSFOLIA + 'entities', NSFOLIA + 'dependencies'):
+            outside.remove(layer)
+    for element in outside.iter():
+        if element.get(XMLID):
+            element.set(XMLID, element.get(XMLID).replace('potgrond.p.1.s.1', 'potgrond.outside.s.1'))
+    text.insert(text.index(paragraph) + 1, outside)
+    def entity(layer, entityid, cls, wordids):
+        element = etree.SubElement(layer, NSFOLIA + 'entity', {XMLID: entityid, 'class': cls, 'set': 'http://ilk.uvt.nl/folia/sets/frog-ner-nl'})
+        for wordid in wordids:
+            etree.SubElement(element, NSFOLIA + 'wref', id=wordid)
+    entity(etree.SubElement(text, NSFOLIA + 'entities', {XMLID: 'potgrond.entities'}), 'potgrond.entity.outside', 'org', ['potgrond.p.1.s.1.w.4', 'potgrond.p.1.s.1.w.5'])
+    alternative = etree.SubElement(sentence, NSFOLIA + 'altlayers', {XMLID: 'potgrond.p.1.s.1.altlayers'})
+    entity(etree.SubElement(alternative, NSFOLIA + 'entities'), 'potgrond.entity.alternative', 'per', ['potgrond.p.1.s.1.w.7'])
+    return folia.Document(string=etree.tostring(root, encoding='unicode'))
+
+class FoLiA2NAF_WalkTest(unittest.TestCase):
+
+    def test001_unchanged(self):
+        """Walk - The single walk gives the same NAF as the walk over the paragraphs and select()"""
+        folia_obj = folia.Document(file=FROG_FILE)
+        for Class in (folia.Dependency, folia.Chunk, folia.Entity):
+            self.assertTrue( list(folia_obj.select(Class)) )
+        self.assertEqual( naf_output(FoLiA2NAFConverter, folia_obj), naf_output(SelectingConverter, folia_obj) )
+
+    def test002_irregular(self):
+        """Walk - Words outside paragraphs are left out, annotations outside paragraphs are kept, non-authoritative ones are left out, as by select()"""
+        folia_obj = irregular_document()
+        self.assertEqual( naf_output(FoLiA2NAFConverter, folia_obj), naf_output(SelectingConverter, folia_obj) )
+        converter = FoLiA2NAFConverter(folia_obj, collector=WarningCollector())
+        naf_obj = converter.convert()
+        self.assertNotIn( 'potgrond.outside.s.1.w.1', converter.fid2tid )
+        self.assertEqual( len(list(naf_obj.get_tokens())), len(list(folia_obj.words())) - len(list(folia_obj['potgrond.outside.s.1'].words())) )
+        entities = [ entity.id for entity in converter.annotations[folia.Entity] ]
+        self.assertIn( 'potgrond.entity.outside', entities )
+        self.assertNotIn( 'potgrond.entity.alternative', entities )
+        self.assertEqual( entities, [ entity.id for entity in folia_obj.select(folia.Entity) ] )
+
+    def test003_annotation_lookups(self):
+        """Walk - The POS and lemma annotation of every word are looked up once"""
+        lookups = Counter()
+        annotation = folia.Word.annotation
+        def counting_annotation(word, *args, **kwargs):
+            lookups[word.id] += 1
+            return annotation(word, *args, **kwargs)
+        folia_obj = folia.Document(file=FROG_FILE)
+        with mock.patch.object(folia.Word, 'annotation', counting_annotation):
+            naf_obj = FoLiA2NAFConverter(folia_obj, collector=WarningCollector()).convert()
+        self.assertEqual( sorted(lookups), sorted( word.id for word in folia_obj.words() ) )
+        self.assertEqual( set(lookups.values()), {2} )
+        self.assertEqual( len(lookups), len(list(naf_obj.get_tokens())) )
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+
+import os
+import io
+import unittest
+from lxml import etree
+from naffoliapy.folia2naf import folia2naf
+from naffoliapy.foliastream import folia2naf_stream, _copy_cdata
+from naffoliapy.diagnostics import WarningCollector
+
+EXAMPLE_PATH = os.path.join(os.path.split(__file__)[0], "../../examples/")
+
+FROG_FILE = os.path.join(EXAMPLE_PATH, "potgrond.frog.folia.xml")
+UCTO_FILE = os.path.join(EXAMPLE_PATH, "100911_Northrop_Grumman_and_Airbus_parent_EADS_defeat_Boeing.folia.xml")
+
+
+def canonical(root):
+    #the timestamps of the converter's own processors differ between runs
+    for lp in root.iter('lp'):
+        for attribute in ('timestamp', 'beginTimestamp', 'endTimestamp', 'hostname'):
+            lp.attrib.pop(attribute, None)
+    for node in root.iter():
+        node.tail = None
+        if node.text is not None and not node.text.strip():
+            node.text = None
+    return etree.tostring(root, method='c14n')
+
+def stream(inputfolia):
+    f = io.BytesIO()
+    folia2naf_stream(inputfolia, f)
+    return etree.fromstring(f.getvalue())
+
+class FoLiA2NAF_StreamTest(unittest.TestCase):
+
+    def test001_frog(self):
+        """Streaming - Tokens, terms, dependencies, chunks and entities are the same as in the non-streaming conversion"""
+        self.assertEqual( canonical(stream(FROG_FILE)), canonical(folia2naf(FROG_FILE).root) )
+
+    def test002_ucto(self):
+        """Streaming - Tokens and raw text are the same as in the non-streaming conversion"""
+        self.assertEqual( canonical(stream(UCTO_FILE)), canonical(folia2naf(UCTO_FILE).root) )
+
+    def test003_cdata(self):
+        """Streaming - Raw text containing the CDATA end marker, across chunk boundaries"""
+        for text in ('a]]>b', ']]>', 'a]', 'a]]', 'a]]]>b]]'):
+            for chunksize in (1, 2, 3, 100):
+                f = io.BytesIO()
+                f.write(b'<raw>')
+                _copy_cdata(io.StringIO(text), f, chunksize)
+                f.write(b'</raw>')
+                self.assertEqual( etree.fromstring(f.getvalue()).text, text )
+
+    def test004_warnings(self):
+        """Streaming - The warnings are the same as in the non-streaming conversion, also about the FoLiA version"""
+        for inputfolia in (FROG_FILE, UCTO_FILE):
+            streaming = WarningCollector()
+            folia2naf_stream(inputfolia, io.BytesIO(), streaming)
+            collector = WarningCollector()
+            folia2naf(inputfolia, collector=collector)
+            self.assertEqual( streaming.summary(), collector.summary() )
+        self.assertEqual( [ message['message'] for message in collector.summary()['categories']['folia-version']['messages'] ], ['FoLiA input did not have a version indicated.'] )
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+
+import io
+import os
+import gzip
+import unittest
+from naffoliapy.foliawriter import naf2folia_direct
+from naffoliapy.naf2folia import naf2folia, naf2folia_bytes
+from naffoliapy.diagnostics import WarningCollector
+from pynlpl.formats import folia
+
+EXAMPLE_PATH = os.path.join(os.path.split(__file__)[0], "../../examples/")
+CORPUS_PATH = os.path.join(os.path.split(__file__)[0], "../../corpora/meantime_dutch_naf/")
+
+DOCUMENTS = [
+    os.path.join(EXAMPLE_PATH, "100911_Northrop_Grumman_and_Airbus_parent_EADS_defeat_Boeing.naf.xml"),
+    os.path.join(CORPUS_PATH, "apple-out", "58383_Cisco_sues_Apple.xml.out.naf"),
+]
+
+def direct(naffile, layers=None, compress=None):
+    collector = WarningCollector()
+    out = io.BytesIO()
+    naf2folia_direct(naffile, out, 'd', layers, collector=collector, compress=compress)
+    return out.getvalue(), collector.summary()
+
+
+class FoLiAWriter_Test(unittest.TestCase):
+
+    def test001_identical(self):
+        """FoLiA writer - Writing the FoLiA XML directly gives the same document as serialising the FoLiA document"""
+        for naffile in DOCUMENTS:
+            if not os.path.exists(naffile):
+                continue
+            for layers in (None, ['text'], ['text', 'terms'], ['text', 'entities', 'srl']):
+                collector = WarningCollector()
+                expected = naf2folia(naffile, 'd', layers, collector=collector).xmlstring().encode('utf-8')
+                data, summary = direct(naffile, layers)
+                self.assertEqual( data, expected )
+                self.assertEqual( summary, collector.summary() )
+
+    def test002_output(self):
+        """FoLiA writer - The direct writer compresses its output and is available through naf2folia_bytes()"""
+        naffile = DOCUMENTS[0]
+        expected = naf2folia(naffile, 'd', collector=WarningCollector()).xmlstring().encode('utf-8')
+        self.assertEqual( gzip.decompress(direct(naffile, compress='gz')[0]), expected )
+        with open(naffile, 'rb') as f:
+            self.assertEqual( naf2folia_bytes(f.read(), 'd', direct=True), expected )
+
+    def test003_checks(self):
+        """FoLiA writer - The checks pynlpl makes on the FoLiA document are kept"""
+        with open(DOCUMENTS[0], 'r', encoding='utf-8') as f:
+            naf = f.read()
+        #two words with the same ID
+        duplicate = naf.replace('id="w2"', 'id="w1"', 1)
+        with self.assertRaises(folia.DuplicateIDError):
+            direct(io.BytesIO(duplicate.encode('utf-8')))
+        with self.assertRaises(folia.DuplicateIDError):
+            naf2folia(io.BytesIO(duplicate.encode('utf-8')), 'd', collector=WarningCollector())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+
+import os
+import shutil
+import tempfile
+import unittest
+from lxml import etree
+from pynlpl.formats import folia
+from naffoliapy.naf2folia import naf2folia
+from naffoliapy.incremental import naf2folia_incremental, FINGERPRINT_PREFIX
+from naffoliapy.diagnostics import WarningCollector
+
+EXAMPLE_PATH = os.path.join(os.path.split(__file__)[0], "../../examples/")
+NS = '{' + folia.NSFOLIA + '}'
+
+
+def drop_layers(naffile, outputfile, tags):
+    """Writes a copy of a NAF document without some layers, as an earlier step of the pipeline would have"""
+    tree = etree.parse(naffile)
+    root = tree.getroot()
+    for tag in tags:
+        root.remove(root.find(tag))
+        for processors in root.find('nafHeader').findall('linguisticProcessors'):
+            if processors.get('layer') == tag:
+                processors.getparent().remove(processors)
+    tree.write(outputfile, encoding='utf-8')
+
+def canonical(foliafile):
+    """The document without fingerprints, with sorted declarations and annotation layers, and with explicit sets left out"""
+    root = etree.parse(foliafile).getroot()
+    metadata = root.find(NS + 'metadata')
+    annotations = metadata.find(NS + 'annotations')
+    annotations[:] = sorted(annotations, key=etree.tostring)
+    for meta in list(metadata):
+        if (meta.get('id') or '').startswith(FINGERPRINT_PREFIX):
+            metadata.remove(meta)
+    for element in root.iter():
+        element.tail = None
+        if element.text and not element.text.strip():
+            element.text = None
+        if element.get('set') is not None and element.tag != NS + 'annotations' and element.getparent() is not annotations:
+            del element.attrib['set']
+    for element in list(root.iter(NS + 's', NS + 'text')):
+        element[:] = [ child for child in element if child.tag in (NS + 't', NS + 'p', NS + 's', NS + 'w') ] + sorted(( child for child in element if child.tag not in (NS + 't', NS + 'p', NS + 's', NS + 'w') ), key=etree.tostring)
+    return etree.tostring(root, method='c14n')
+
+class Incremental_Test(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.naffile = os.path.join(EXAMPLE_PATH, "potgrond.txt.out.naf")
+        self.foliafile = os.path.join(self.tmpdir, 'potgrond.folia.xml')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test001_new_layers(self):
+        """Incremental - Layers added to the NAF document are converted and patched in, like a full conversion"""
+        stagefile = os.path.join(self.tmpdir, 'stage.naf')
+        drop_layers(self.naffile, stagefile, ['srl', 'coreferences'])
+        converted = naf2folia_incremental(stagefile, self.foliafile, 'potgrond', collector=WarningCollector())
+        self.assertIn( 'text', converted )
+        converted = naf2folia_incremental(self.naffile, self.foliafile, 'potgrond', collector=WarningCollector())
+        self.assertEqual( converted, ['coreferences', 'srl'] )
+        foliadoc = folia.Document(file=self.foliafile)
+        self.assertTrue( list(foliadoc.select(folia.SemanticRolesLayer)) )
+        self.assertTrue( list(foliadoc.select(folia.CoreferenceLayer)) )
+        fullfile = os.path.join(self.tmpdir, 'full.folia.xml')
+        naf2folia(self.naffile, 'potgrond', collector=WarningCollector()).save(fullfile)
+        self.assertEqual( canonical(self.foliafile), canonical(fullfile) )
+
+    def test002_unchanged(self):
+        """Incremental - Nothing is converted when no layer changed"""
+        naf2folia_incremental(self.naffile, self.foliafile, 'potgrond', collector=WarningCollector())
+        with open(self.foliafile, 'rb') as f:
+            before = f.read()
+        self.assertEqual( naf2folia_incremental(self.naffile, self.foliafile, 'potgrond', collector=WarningCollector()), [] )
+        with open(self.foliafile, 'rb') as f:
+            self.assertEqual( f.read(), before )
+
+    def test003_layer_selection(self):
+        """Incremental - Layers that are no longer selected are removed, a changed text means a full conversion"""
+        naf2folia_incremental(self.naffile, self.foliafile, 'potgrond', collector=WarningCollector())
+        converted = naf2folia_incremental(self.naffile, self.foliafile, 'potgrond', ['terms', 'srl'], collector=WarningCollector())
+        self.assertEqual( converted, [] )
+        foliadoc = folia.Document(file=self.foliafile)
+        self.assertTrue( list(foliadoc.select(folia.SemanticRolesLayer)) )
+        self.assertFalse( list(foliadoc.select(folia.EntitiesLayer)) )
+        self.assertNotIn( FINGERPRINT_PREFIX + 'entities', foliadoc.metadata )
+        stagefile = os.path.join(self.tmpdir, 'stage.naf')
+        drop_layers(self.naffile, stagefile, ['raw'])
+        converted = naf2folia_incremental(stagefile, self.foliafile, 'potgrond', ['terms', 'srl'], collector=WarningCollector())
+        self.assertEqual( converted, ['text', 'terms', 'srl'] )
+
+
+if __name__ == '__main__':
+    unittest.main()
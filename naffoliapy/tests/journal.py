@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import shutil
+import tempfile
+import subprocess
+import unittest
+from naffoliapy import batch
+from naffoliapy.journal import Journal
+
+EXAMPLE_PATH = os.path.join(os.path.split(__file__)[0], "../../examples/")
+PACKAGE_PATH = os.path.abspath(os.path.join(os.path.split(__file__)[0], "../.."))
+
+
+def write(filename, data):
+    with open(filename, 'w') as f:
+        f.write(data)
+
+def run(argv):
+    """Runs a converter as a command, returns its exit status and what it wrote to stderr"""
+    environment = dict(os.environ, PYTHONPATH=PACKAGE_PATH + os.pathsep + os.environ.get('PYTHONPATH', ''))
+    process = subprocess.Popen([sys.executable, '-W', 'ignore', '-m'] + argv, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, env=environment)
+    _, errors = process.communicate()
+    return process.returncode, errors.decode('utf-8')
+
+
+class Journal_Test(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.jobs = []
+        for i in range(5):
+            inputfile = os.path.join(self.directory, 'doc' + str(i) + '.txt')
+            write(inputfile, 'document ' + str(i))
+            self.jobs.append( (inputfile, os.path.join(self.directory, 'out', 'doc' + str(i) + '.txt')) )
+        self.journalfile = os.path.join(self.directory, 'out', 'journal.jsonl')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test001_shard(self):
+        """Journal - Shards divide the inputs by a stable hash of their relative path"""
+        self.assertEqual( batch.parse_shard('2/4'), (2, 4) )
+        for value in ('0/4', '5/4', '2', 'a/b'):
+            with self.assertRaises(ValueError):
+                batch.parse_shard(value)
+        self.assertEqual( [ batch.shard_of(relpath, 4) for relpath in ('a/doc1.naf', 'a/doc2.naf', 'b/doc3.naf') ], [4, 3, 1] )
+        inputs = [ ('/corpus/' + str(i) + '.naf', str(i) + '.naf') for i in range(100) ]
+        shards = [ batch.select_shard(inputs, shard, 3) for shard in (1, 2, 3) ]
+        self.assertEqual( sorted(sum(shards, [])), sorted(inputs) )
+        self.assertTrue( all(shards) )
+
+    def test002_resume(self):
+        """Journal - Converted documents are skipped if their input and output did not change"""
+        with Journal(self.journalfile, {'option': 1}) as journal:
+            results = batch.convert_batch(journal.pending(self.jobs[:3]), shutil.copyfile, 1, journal)
+        self.assertEqual( len(results), 3 )
+        with Journal(self.journalfile, {'option': 1}) as journal:
+            self.assertEqual( journal.pending(self.jobs), self.jobs[3:] )
+        #a changed output, a changed input, another option
+        write(self.jobs[0][1], 'changed')
+        write(self.jobs[1][0], 'changed')
+        with Journal(self.journalfile, {'option': 1}) as journal:
+            self.assertEqual( journal.pending(self.jobs), self.jobs[:2] + self.jobs[3:] )
+        with Journal(self.journalfile, {'option': 2}) as journal:
+            self.assertEqual( journal.pending(self.jobs), self.jobs )
+
+    def test003_interrupted(self):
+        """Journal - A record that was not completely written is ignored"""
+        with Journal(self.journalfile) as journal:
+            batch.convert_batch(self.jobs[:2], shutil.copyfile, 1, journal)
+        with open(self.journalfile, 'rb+') as f:
+            f.truncate(os.path.getsize(self.journalfile) - 10)
+        with Journal(self.journalfile) as journal:
+            self.assertEqual( journal.pending(self.jobs), self.jobs[1:] )
+            batch.convert_batch(journal.pending(self.jobs), shutil.copyfile, 1, journal)
+        with Journal(self.journalfile) as journal:
+            self.assertEqual( journal.pending(self.jobs), [] )
+
+    def test004_folia2naf(self):
+        """Journal - Batch conversions are resumed from the command line"""
+        inputfile = os.path.join(EXAMPLE_PATH, "potgrond.frog.folia.xml")
+        outputdir = os.path.join(self.directory, 'naf')
+        argv = ['naffoliapy.folia2naf', '--outputdir', outputdir, '--journal', self.journalfile, inputfile]
+        status, _ = run(argv)
+        self.assertEqual( status, 0 )
+        self.assertTrue( os.path.exists(os.path.join(outputdir, 'potgrond.frog.naf')) )
+        status, errors = run(argv)
+        self.assertEqual( status, 0 )
+        self.assertIn( "Skipping 1 documents converted earlier", errors )
+        self.assertIn( "Converted 0 of 0 documents", errors )
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,9 +1,13 @@
 #!/usr/bin/env python3
 
 import os
+import shutil
+import tempfile
 import unittest
+from lxml import etree
 import KafNafParserPy as naf
-from naffoliapy.naf2folia import naf2folia
+from naffoliapy.naf2folia import naf2folia, load_naf, select_layers, NAFResolver, LayerRegistry, ResourceHandler, register_resource_handler, RESOURCE_HANDLERS, token_table
+from naffoliapy.profiling import Profiler
 from pynlpl.formats import folia
 
 EXAMPLE_PATH = os.path.join(os.path.split(__file__)[0], "../../examples/")
@@ -32,6 +36,158 @@ class NAF2FoLiA_SanityTest(unittest.TestCase):
             self.assertEqual( docid + '.' + naf_token.get_id() , folia_token.id )
             self.assertEqual( naf_token.get_text(), folia_token.text() )
 
+    def test003_resolver(self):
+        """Resolver - Testing term and token IDs resolve to the FoLiA words and sentences they were converted to"""
+        resolver = NAFResolver(nafdoc, foliadoc)
+        for naf_term in nafdoc.get_terms():
+            words = resolver.term(naf_term.get_id())
+            self.assertEqual( [ word.id for word in words ], [ docid + '.' + w_id for w_id in naf_term.get_span().get_span_ids() ] )
+            self.assertEqual( [ word.id for word in resolver.span(naf_term.get_span()) ], [ word.id for word in words ] )
+            for word in words:
+                self.assertIs( resolver.sentence(word), word.sentence() )
+        self.assertEqual( resolver.term('nonexisting'), [] )
+        with self.assertRaises(KeyError):
+            resolver.tokens(['nonexisting'])
+
+    def test004_layerregistry(self):
+        """Layer registry - Testing a layer is added once per sentence, class and set"""
+        doc = folia.Document(id='test')
+        for Class in (folia.Entity, folia.Chunk):
+            for annotationset in ('a', 'b'):
+                doc.declare(Class, annotationset)
+        sentence = doc.append(folia.Text(doc, id='test.text')).append(folia.Sentence, id='test.s.1')
+        registry = LayerRegistry()
+        layer = registry.get(sentence, folia.EntitiesLayer, 'a')
+        self.assertIs( registry.get(sentence, folia.EntitiesLayer, 'a'), layer )
+        self.assertIsNot( registry.get(sentence, folia.EntitiesLayer, 'b'), layer )
+        self.assertIsNot( registry.get(sentence, folia.ChunkingLayer, 'a'), layer )
+        self.assertEqual( len(list(sentence.select(folia.AbstractAnnotationLayer))), 3 )
+
+    def test005_resourcehandler(self):
+        """External references - Testing a registered resource handler takes over senses, resources are classified once"""
+        class TestHandler(ResourceHandler):
+            def __init__(self):
+                self.classified = []
+            def matches_sense(self, resource):
+                self.classified.append(resource)
+                return resource == 'ODWN'
+            def sense(self, naf_exref, reference):
+                return reference.upper(), {}
+        handler = TestHandler()
+        register_resource_handler(handler)
+        try:
+            doc = naf2folia(os.path.join(EXAMPLE_PATH,"potgrond.txt.out.naf"), "potgrond")
+        finally:
+            RESOURCE_HANDLERS.remove(handler)
+        self.assertEqual( sorted(handler.classified), sorted(set(handler.classified)) )
+        senses = [ sense for sense in doc.select(folia.SenseAnnotation) if sense.set.endswith('naf_sense_ODWN.foliaset.xml') ]
+        self.assertTrue( senses )
+        for sense in senses:
+            self.assertEqual( sense.cls, sense.cls.upper() )
+            self.assertEqual( list(sense.select(folia.Feature)), [] )
+
+    def test005_resourcehandler_alignment(self):
+        """External references - Testing a resource handler that only matches a resource gets the default alignments"""
+        resource = 'ODWN-ORBN-LMF-1.2'
+        class TestHandler(ResourceHandler):
+            def matches_alignment(self, candidate):
+                return candidate == resource
+        handler = TestHandler()
+        register_resource_handler(handler)
+        try:
+            doc = naf2folia(os.path.join(EXAMPLE_PATH,"potgrond.txt.out.naf"), "potgrond")
+        finally:
+            RESOURCE_HANDLERS.remove(handler)
+        alignments = [ alignment for alignment in doc.select(folia.Alignment) if alignment.cls == resource ]
+        self.assertTrue( alignments )
+        for alignment in alignments:
+            self.assertEqual( alignment.format, "application/unknown" )
+            self.assertEqual( [ reference.type for reference in alignment.data if isinstance(reference, folia.AlignReference) ], ["unknown"] )
+
+    def test006_layers(self):
+        """Layer selection - Only the selected layers are converted, the others are not read"""
+        naffile = os.path.join(EXAMPLE_PATH,"potgrond.txt.out.naf")
+        full = naf2folia(naffile, "potgrond")
+        entities = lambda doc: [ (entity.id, entity.set, entity.cls) for entity in doc.select(folia.Entity) ]
+        #break the semantic role layer, it should not matter if it is not selected
+        nafdoc = etree.parse(naffile)
+        for target in nafdoc.find('srl').iter('target'):
+            target.set('id', 'nonexisting')
+        with tempfile.NamedTemporaryFile(suffix='.naf') as f:
+            nafdoc.write(f.name)
+            with self.assertRaises(Exception):
+                naf2folia(f.name, "potgrond")
+            doc = naf2folia(f.name, "potgrond", layers='text,terms,entities')
+        self.assertEqual( entities(doc), [ entity for entity in entities(full) if 'naf_entities' in entity[1] ] )
+        pos = lambda doc: [ (pos.set, pos.cls) for word in doc.words() for pos in word.select(folia.PosAnnotation, recursive=False) ]
+        self.assertTrue( pos(full) )
+        self.assertEqual( pos(doc), pos(full) )
+        for Class in (folia.Chunk, folia.Predicate, folia.CoreferenceChain, folia.Dependency):
+            self.assertEqual( list(doc.select(Class)), [] )
+        doc = naf2folia(naffile, "potgrond", layers=['entities'])
+        self.assertEqual( list(doc.select(folia.PosAnnotation)), [] )
+        self.assertEqual( [ word.id for word in doc.words() ], [ word.id for word in full.words() ] )
+        with self.assertRaises(ValueError):
+            naf2folia(naffile, "potgrond", layers='text,nonexisting')
+
+    def test007_profiler(self):
+        """Profiling - Every converted layer is measured and reported to the callback"""
+        finished = []
+        profiler = Profiler(callback=finished.append)
+        doc = naf2folia(os.path.join(EXAMPLE_PATH,"potgrond.txt.out.naf"), "potgrond", layers='text,terms,entities,srl', profiler=profiler)
+        self.assertEqual( list(profiler.stages), ['load', 'text', 'terms', 'resolver', 'entities', 'srl'] )
+        self.assertEqual( [ stage['name'] for stage in finished ], list(profiler.stages) )
+        self.assertEqual( profiler.stages['text']['count'], len(list(doc.words())) )
+        self.assertEqual( profiler.stages['entities']['count'], len(list(doc.select(folia.Entity))) )
+        report = profiler.report(document='potgrond')
+        self.assertEqual( report['document'], 'potgrond' )
+        for stage in report['stages']:
+            self.assertEqual( stage['calls'], 1 )
+            self.assertTrue( stage['seconds'] >= 0 )
+
+    def test008_tokentable(self):
+        """Token table - Testing the table holds what the KafNafParserPy tokens and terms give, and is built once"""
+        table = token_table(nafdoc)
+        self.assertIs( token_table(nafdoc), table )
+        naf_tokens = list(nafdoc.get_tokens())
+        self.assertEqual( len(table), len(naf_tokens) )
+        for index, naf_token in enumerate(naf_tokens):
+            self.assertEqual( table.ids[index], naf_token.get_id() )
+            self.assertEqual( table.texts[index], naf_token.get_text() )
+            self.assertEqual( table.offsets[index], int(naf_token.get_offset()) )
+            self.assertEqual( table.lengths[index], int(naf_token.get_length()) )
+            self.assertEqual( table.labels[table.sentences[index]], naf_token.get_sent() )
+            self.assertEqual( table.labels[table.paragraphs[index]], naf_token.get_para() )
+        naf_terms = list(nafdoc.get_terms())
+        self.assertEqual( len(table.terms), len(naf_terms) )
+        for term, naf_term in zip(table.terms, naf_terms):
+            self.assertEqual( (term.id, list(term.span), term.pos, term.lemma), (naf_term.get_id(), naf_term.get_span().get_span_ids(), naf_term.get_pos(), naf_term.get_lemma()) )
+            self.assertEqual( term.node is not None, bool(list(naf_term.get_external_references())) or naf_term.get_sentiment() is not None )
+
+    def test009_docid(self):
+        """Document ID - A filename that is not a valid ID gives a derived one rather than an error"""
+        directory = tempfile.mkdtemp()
+        try:
+            naffile = os.path.join(directory, "1 potgrond.naf")
+            shutil.copyfile(os.path.join(EXAMPLE_PATH,"potgrond.txt.out.naf"), naffile)
+            self.assertEqual( naf2folia(naffile, layers='text').id, "_1_potgrond" )
+        finally:
+            shutil.rmtree(directory)
+
+    def test010_load(self):
+        """Layer selection - The document is loaded with the selected layers only, from a single parse"""
+        naffile = os.path.join(EXAMPLE_PATH,"potgrond.txt.out.naf")
+        nafparser = load_naf(naffile, select_layers('text,terms,entities'))
+        self.assertIsInstance( nafparser, naf.KafNafParser )
+        self.assertEqual( nafparser.get_filename(), naffile )
+        tags = [ node.tag for node in nafparser.root ]
+        self.assertEqual( [ tag for tag in tags if tag in ('text', 'terms', 'entities', 'deps', 'chunks', 'srl', 'coreferences') ], ['text', 'terms', 'entities'] )
+        self.assertIs( nafparser.root, nafparser.tree.getroot() )
+        full = naf.KafNafParser(naffile)
+        self.assertEqual( [ term.get_id() for term in nafparser.get_terms() ], [ term.get_id() for term in full.get_terms() ] )
+        self.assertEqual( [ entity.get_id() for entity in nafparser.get_entities() ], [ entity.get_id() for entity in full.get_entities() ] )
+        self.assertIsNone( nafparser.srl_layer )
+
 
 if __name__ == '__main__':
     unittest.main()
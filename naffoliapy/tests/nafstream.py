@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+
+import os
+import io
+import gc
+import shutil
+import warnings
+import tempfile
+import unittest
+import tracemalloc
+from lxml import etree
+from naffoliapy.naf2folia import naf2folia
+from naffoliapy.nafstream import naf2folia_stream, NAFSurvey, LayerCursor, SENTENCE_LAYERS
+from pynlpl.formats import folia
+
+EXAMPLE_PATH = os.path.join(os.path.split(__file__)[0], "../../examples/")
+
+naffile = os.path.join(EXAMPLE_PATH,"potgrond.txt.out.naf")
+docid = "potgrond"
+foliadoc = naf2folia(naffile, docid)
+
+def stream(naffile, layers=None):
+    f = io.BytesIO()
+    naf2folia_stream(naffile, f, docid, layers)
+    return folia.Document(string=f.getvalue().decode('utf-8'))
+
+streameddoc = stream(naffile)
+
+def synthetic(filename, sentences, words=20):
+    """Writes a NAF document of a given size, with tokens, terms, entities and dependencies"""
+    with open(filename, 'w') as f:
+        f.write('<?xml version="1.0" encoding="UTF-8"?>\n<NAF xml:lang="en" version="v3"><nafHeader/><text>')
+        for i in range(sentences * words):
+            f.write('<wf id="w%d" sent="%d" para="1" offset="%d" length="4">word</wf>' % (i + 1, i // words + 1, i * 5))
+        f.write('</text><terms>')
+        for i in range(sentences * words):
+            f.write('<term id="t%d" lemma="word" pos="N"><span><target id="w%d"/></span></term>' % (i + 1, i + 1))
+        f.write('</terms><entities>')
+        for i in range(0, sentences * words, 10):
+            f.write('<entity id="e%d" type="ORG"><references><span><target id="t%d"/><target id="t%d"/></span></references></entity>' % (i + 1, i + 1, i + 2))
+        f.write('</entities><deps>')
+        for i in range(sentences * words):
+            if (i + 1) % words:
+                f.write('<dep from="t%d" to="t%d" rfunc="mod"/>' % (i + 1, i + 2))
+        f.write('</deps></NAF>\n')
+
+def peakmemory(naffile):
+    """Peak memory use of what the streaming converter keeps for the whole document: the survey and the layer cursors"""
+    tracemalloc.start()
+    try:
+        survey = NAFSurvey(naffile)
+        cursors = [ LayerCursor(naffile, layername, tag, wrapper, survey.placement[layername]) for layername, tag, wrapper, _, _ in SENTENCE_LAYERS if survey.nonempty(layername) ]
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+def annotations(doc):
+    return [ (element.__class__.__name__, element.id, element.set, element.cls, [ word.id for word in element.wrefs() ]) for element in doc.select(folia.AbstractSpanAnnotation) ]
+
+class NAF2FoLiA_StreamTest(unittest.TestCase):
+    def test001_sanity(self):
+        """Streaming - Testing if result is a proper FoLiA document"""
+        self.assertEqual( streameddoc.id, docid)
+        self.assertEqual( streameddoc.text(), foliadoc.text() )
+
+    def test002_structure(self):
+        """Streaming - Testing paragraph, sentence and word equality with the non-streaming converter"""
+        for Class in (folia.Paragraph, folia.Sentence, folia.Word):
+            self.assertEqual( [ element.id for element in streameddoc.select(Class) ], [ element.id for element in foliadoc.select(Class) ] )
+        for word, streamedword in zip(foliadoc.words(), streameddoc.words()):
+            self.assertEqual( word.text(), streamedword.text() )
+            self.assertEqual( word.space, streamedword.space )
+            self.assertEqual( [ (pos.set, pos.cls) for pos in word.select(folia.PosAnnotation) ], [ (pos.set, pos.cls) for pos in streamedword.select(folia.PosAnnotation) ] )
+            self.assertEqual( word.lemma(), streamedword.lemma() )
+
+    def test003_annotations(self):
+        """Streaming - Testing span annotation equality with the non-streaming converter"""
+        self.assertTrue( annotations(foliadoc) )
+        self.assertEqual( annotations(streameddoc), annotations(foliadoc) )
+
+    def test004_order(self):
+        """Streaming - Testing layers whose elements are not in document order"""
+        nafdoc = etree.parse(naffile)
+        for layer in (nafdoc.find('entities'), nafdoc.find('srl')):
+            layer[:] = reversed(list(layer))
+        with tempfile.NamedTemporaryFile(suffix='.naf') as f:
+            nafdoc.write(f.name)
+            reordereddoc = stream(f.name)
+        self.assertEqual( sorted(annotations(reordereddoc)), sorted(annotations(foliadoc)) )
+
+    def test005_layers(self):
+        """Streaming - Testing layer selection gives the same result as the non-streaming converter"""
+        layers = 'text,terms,entities'
+        self.assertEqual( annotations(stream(naffile, layers)), annotations(naf2folia(naffile, docid, layers)) )
+
+    def test006_memory(self):
+        """Streaming - Testing the memory kept for the whole document grows by a few bytes per token"""
+        directory = tempfile.mkdtemp()
+        try:
+            peaks = []
+            for sentences in (100, 400):
+                filename = os.path.join(directory, str(sentences) + '.naf')
+                synthetic(filename, sentences)
+                peaks.append(peakmemory(filename))
+        finally:
+            shutil.rmtree(directory)
+        #300 sentences of 20 tokens more
+        self.assertTrue( (peaks[1] - peaks[0]) / 6000 < 48, peaks )
+
+    def test007_files(self):
+        """Streaming - Testing the document is closed by layers that are not read to the end"""
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter('always', ResourceWarning)
+            stream(naffile, 'text,terms,entities')
+            gc.collect()
+        self.assertEqual( [ str(warning.message) for warning in caught if issubclass(warning.category, ResourceWarning) ], [] )
+
+    def test008_no_offsets(self):
+        """Streaming - Testing tokens without offset and length, as the non-streaming converter accepts"""
+        nafdoc = etree.parse(naffile)
+        for wf in nafdoc.find('text'):
+            del wf.attrib['offset']
+            del wf.attrib['length']
+        with tempfile.NamedTemporaryFile(suffix='.naf') as f:
+            nafdoc.write(f.name)
+            offsetless = stream(f.name, 'text,terms')
+            expected = naf2folia(f.name, docid, 'text,terms')
+        self.assertEqual( [ (word.id, word.text(), word.space) for word in offsetless.words() ], [ (word.id, word.text(), word.space) for word in expected.words() ] )
+
+
+if __name__ == '__main__':
+    unittest.main()
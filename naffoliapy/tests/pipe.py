@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+
+import os
+import io
+import sys
+import subprocess
+import unittest
+from pynlpl.formats import folia
+from naffoliapy import pipe
+from naffoliapy.naf2folia import naf2folia_bytes
+from naffoliapy.folia2naf import folia2naf_bytes
+from naffoliapy.diagnostics import WarningCollector
+
+EXAMPLE_PATH = os.path.join(os.path.split(__file__)[0], "../../examples/")
+PACKAGE_PATH = os.path.abspath(os.path.join(os.path.split(__file__)[0], "../.."))
+
+
+def read(filename):
+    with open(filename, 'rb') as f:
+        return f.read()
+
+def run(argv, payload):
+    """Runs a converter as a command in a pipeline, returns its exit status and output"""
+    environment = dict(os.environ, PYTHONPATH=PACKAGE_PATH + os.pathsep + os.environ.get('PYTHONPATH', ''))
+    process = subprocess.Popen([sys.executable, '-W', 'ignore', '-m'] + argv, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, env=environment)
+    output, _ = process.communicate(payload)
+    return process.returncode, output
+
+class Pipe_Test(unittest.TestCase):
+
+    def test001_frames(self):
+        """Pipe - Framed documents are read back as they were written, in both framings"""
+        documents = [b'<a/>', b'<b>\n</b>', b'']
+        for framing in pipe.FRAMINGS:
+            stream = io.BytesIO()
+            for document in documents:
+                pipe.write_frame(stream, document, framing)
+            stream.seek(0)
+            self.assertEqual( list(pipe.read_frames(stream, framing)), documents )
+        self.assertEqual( list(pipe.read_frames(io.BytesIO(b'<a/>\0\n<b/>\n'), 'nul')), [b'<a/>', b'<b/>\n'] )
+        with self.assertRaises(IOError):
+            list(pipe.read_frames(io.BytesIO(b'10\n<a/>'), 'length'))
+
+    def test002_convert_frames(self):
+        """Pipe - A failing document gives an empty frame, the others are converted"""
+        instream = io.BytesIO(b'<a/>\0<broken\0<c/>\0')
+        outstream = io.BytesIO()
+        def convert(document, number):
+            if document.startswith(b'<broken'):
+                raise ValueError("broken")
+            return document.upper()
+        self.assertEqual( pipe.convert_frames(convert, 'nul', instream, outstream), (3, 1) )
+        self.assertEqual( outstream.getvalue(), b'<A/>\0\0<C/>\0' )
+
+    def test003_bytes(self):
+        """Pipe - Converting documents held in memory, the document ID comes from the public ID of the NAF document"""
+        payload = read(os.path.join(EXAMPLE_PATH, "potgrond.txt.out.naf")).replace(b'<nafHeader>', b'<nafHeader><public publicId="potgrond.txt"/>', 1)
+        foliadoc = folia.Document(string=naf2folia_bytes(payload, layers='text', collector=WarningCollector()))
+        self.assertEqual( foliadoc.id, 'potgrond' )
+        self.assertEqual( len(list(foliadoc.words())), 83 )
+        output = folia2naf_bytes(read(os.path.join(EXAMPLE_PATH, "potgrond.frog.folia.xml")), WarningCollector())
+        self.assertTrue( output.startswith(b"<?xml") )
+        self.assertIn( b'<terms>', output )
+
+    def test004_commands(self):
+        """Pipe - Both converters read from stdin and write to stdout, single and framed"""
+        status, output = run(['naffoliapy.naf2folia', '--layers', 'text', '-'], read(os.path.join(EXAMPLE_PATH, "potgrond.txt.out.naf")))
+        self.assertEqual( status, 0 )
+        self.assertEqual( len(list(folia.Document(string=output).words())), 83 )
+        foliapayload = read(os.path.join(EXAMPLE_PATH, "potgrond.frog.folia.xml"))
+        status, output = run(['naffoliapy.folia2naf', '--framed', 'length'], b''.join( str(len(foliapayload)).encode('ascii') + b'\n' + foliapayload for _ in range(2) ))
+        self.assertEqual( status, 0 )
+        frames = list(pipe.read_frames(io.BytesIO(output), 'length'))
+        self.assertEqual( len(frames), 2 )
+        self.assertIn( b'<NAF', frames[1] )
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import json
+import shutil
+import tempfile
+import threading
+import unittest
+from pynlpl.formats import folia
+from naffoliapy import server
+
+EXAMPLE_PATH = os.path.join(os.path.split(__file__)[0], "../../examples/")
+
+
+HEAVY_MODULES = ('lxml.etree', 'KafNafParserPy', 'pynlpl.formats.folia', 'rdflib')
+
+def read(filename):
+    with open(filename, 'rb') as f:
+        return f.read()
+
+def loaded_modules():
+    #Runs in a worker process
+    return [ name for name in HEAVY_MODULES if name in sys.modules ]
+
+class Server_Test(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.tmpdir = tempfile.mkdtemp()
+        cls.socketpath = os.path.join(cls.tmpdir, 'server.sock')
+        cls.conversion = server.ConversionServer(workers=1)
+        cls.httpserver = server.make_server(cls.conversion, cls.socketpath)
+        cls.thread = threading.Thread(target=cls.httpserver.serve_forever)
+        cls.thread.start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.httpserver.shutdown()
+        cls.httpserver.server_close()
+        cls.thread.join()
+        cls.conversion.shutdown()
+        shutil.rmtree(cls.tmpdir)
+
+    def test000_warm(self):
+        """Server - The workers have loaded the converters before the first request"""
+        self.assertEqual( self.conversion.executor.submit(loaded_modules).result(), list(HEAVY_MODULES) )
+
+    def test001_health(self):
+        """Server - Health endpoint"""
+        status, _, body = server.request('GET', '/health', socketpath=self.socketpath)
+        self.assertEqual( status, 200 )
+        self.assertEqual( json.loads(body.decode('utf-8'))['status'], 'ok' )
+
+    def test002_naf2folia(self):
+        """Server - Converting NAF to FoLiA, with the document ID derived from the filename"""
+        output, warnings = server.convert('naf2folia', read(os.path.join(EXAMPLE_PATH, "potgrond.txt.out.naf")), socketpath=self.socketpath, filename='potgrond.txt.out.naf', layers='text,terms')
+        foliadoc = folia.Document(string=output.decode('utf-8'))
+        self.assertEqual( foliadoc.id, 'potgrond' )
+        self.assertEqual( len(list(foliadoc.words())), 83 )
+        self.assertTrue( warnings > 0 ) #the raw layer of the example is misaligned
+
+    def test003_folia2naf(self):
+        """Server - Converting FoLiA to NAF"""
+        output, _ = server.convert('folia2naf', read(os.path.join(EXAMPLE_PATH, "potgrond.frog.folia.xml")), socketpath=self.socketpath)
+        self.assertIn( b'<NAF', output )
+        self.assertIn( b'<terms>', output )
+
+    def test004_errors(self):
+        """Server - Unusable documents and unknown endpoints give an error, the queue keeps count"""
+        with self.assertRaises(server.ConversionError):
+            server.convert('folia2naf', b'<not a document', socketpath=self.socketpath)
+        status, _, _ = server.request('GET', '/nonexisting', socketpath=self.socketpath)
+        self.assertEqual( status, 404 )
+        status, _, body = server.request('GET', '/queue', socketpath=self.socketpath)
+        queue = json.loads(body.decode('utf-8'))
+        self.assertEqual( queue['queued'], 0 )
+        self.assertTrue( queue['failed'] >= 1 )
+
+
+if __name__ == '__main__':
+    unittest.main()
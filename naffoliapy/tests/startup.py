@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import json
+import subprocess
+import unittest
+
+#modules that take most of the import time, they should only be imported when a conversion runs
+HEAVY_MODULES = ('lxml.etree', 'KafNafParserPy', 'pynlpl.formats.folia', 'rdflib')
+
+#import time of the converter modules, without their heavy dependencies, in seconds
+IMPORT_TIME_LIMIT = 0.25
+
+PACKAGE_PATH = os.path.abspath(os.path.join(os.path.split(__file__)[0], "../.."))
+
+SCRIPT = """
+import sys, time, json
+begintime = time.time()
+import naffoliapy.naf2folia, naffoliapy.folia2naf, naffoliapy.batch, naffoliapy.cache, naffoliapy.server
+duration = time.time() - begintime
+sys.argv = %r
+try:
+    %s
+except SystemExit:
+    pass
+print(json.dumps({'duration': duration, 'imported': [ name for name in %r if name in sys.modules ]}))
+"""
+
+
+def run(argv, statement):
+    """Runs a statement in a fresh interpreter, returns the import time of the package and the heavy modules it imported"""
+    environment = dict(os.environ, PYTHONPATH=PACKAGE_PATH + os.pathsep + os.environ.get('PYTHONPATH', ''))
+    output = subprocess.check_output([sys.executable, '-W', 'ignore', '-c', SCRIPT % (argv, statement, HEAVY_MODULES)], env=environment, stderr=subprocess.DEVNULL)
+    return json.loads(output.decode('utf-8').strip().splitlines()[-1])
+
+class Startup_Test(unittest.TestCase):
+
+    def test001_import(self):
+        """Startup - Importing the package does not import the heavy dependencies"""
+        result = run(['python'], 'pass')
+        self.assertEqual( result['imported'], [] )
+        self.assertLess( result['duration'], IMPORT_TIME_LIMIT )
+
+    def test002_help(self):
+        """Startup - Help and argument errors do not import the heavy dependencies"""
+        self.assertEqual( run(['naf2folia', '--help'], 'naffoliapy.naf2folia.main()')['imported'], [] )
+        self.assertEqual( run(['naf2folia', '--layers', 'nonexisting', 'document.naf'], 'naffoliapy.naf2folia.main()')['imported'], [] )
+        self.assertEqual( run(['folia2naf', '--help'], 'naffoliapy.folia2naf.main()')['imported'], [] )
+
+    def test003_conversion(self):
+        """Startup - The heavy dependencies are imported when a conversion runs"""
+        naffile = os.path.join(PACKAGE_PATH, "examples", "potgrond.txt.out.naf")
+        result = run(['python'], 'naffoliapy.naf2folia.naf2folia(%r, layers="text")' % naffile)
+        self.assertIn( 'pynlpl.formats.folia', result['imported'] )
+        self.assertIn( 'KafNafParserPy', result['imported'] )
+
+
+if __name__ == '__main__':
+    unittest.main()
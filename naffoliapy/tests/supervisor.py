@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+
+import os
+import json
+import time
+import shutil
+import tempfile
+import unittest
+from naffoliapy import batch
+from naffoliapy.supervisor import Quarantine, memory_supported
+
+
+def convert(inputfile, outputfile):
+    """A conversion that misbehaves as its input document asks, and writes the process ID of the worker otherwise"""
+    with open(inputfile) as f:
+        behaviour = f.read()
+    with open(outputfile, 'w') as f:
+        f.write('incomplete')
+    if behaviour == 'loop':
+        time.sleep(60)
+    elif behaviour == 'memory':
+        data = [ bytearray(1024 * 1024) for _ in range(1000) ]
+        time.sleep(60)
+    elif behaviour == 'crash':
+        os._exit(3)
+    elif behaviour == 'error':
+        raise ValueError("Unexpected input")
+    with open(outputfile, 'w') as f:
+        f.write(str(os.getpid()))
+
+
+class Supervisor_Test(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def jobs(self, behaviours):
+        jobs = []
+        for i, behaviour in enumerate(behaviours):
+            inputfile = os.path.join(self.directory, 'doc' + str(i) + '.txt')
+            with open(inputfile, 'w') as f:
+                f.write(behaviour)
+            jobs.append( (inputfile, os.path.join(self.directory, 'doc' + str(i) + '.out')) )
+        return jobs
+
+    def test001_limits(self):
+        """Supervisor - Documents that hit a limit or crash their worker fail and are quarantined, the others are converted"""
+        behaviours = ['ok', 'loop', 'ok', 'crash', 'error', 'ok'] + (['memory'] if memory_supported() else [])
+        jobs = self.jobs(behaviours)
+        quarantine = Quarantine(os.path.join(self.directory, 'quarantine'))
+        begintime = time.time()
+        results = batch.convert_batch(jobs, convert, 2, timeout=2, maxmemory=200 * 1024 * 1024 if memory_supported() else None, quarantine=quarantine)
+        self.assertTrue( time.time() - begintime < 30 )
+        errors = { inputfile: error for inputfile, _, _, error in results }
+        self.assertEqual( len(errors), len(jobs) )
+        for (inputfile, outputfile), behaviour in zip(jobs, behaviours):
+            if behaviour == 'ok':
+                self.assertIsNone( errors[inputfile] )
+            else:
+                self.assertIsNotNone( errors[inputfile] )
+            if behaviour in ('loop', 'crash', 'memory'):
+                self.assertFalse( os.path.exists(outputfile) )
+        self.assertTrue( errors[jobs[1][0]].startswith('Timeout:') )
+        self.assertTrue( errors[jobs[3][0]].startswith('WorkerDied:') )
+        self.assertTrue( errors[jobs[4][0]].startswith('ValueError:') )
+        if memory_supported():
+            self.assertTrue( errors[jobs[6][0]].startswith('MemoryLimit:') )
+        with open(quarantine.logfile) as f:
+            quarantined = [ json.loads(line) for line in f ]
+        self.assertEqual( sorted( os.path.basename(record['input']) for record in quarantined ), sorted( os.path.basename(inputfile) for (inputfile, _), behaviour in zip(jobs, behaviours) if behaviour in ('loop', 'crash', 'memory') ) )
+        for record in quarantined:
+            self.assertTrue( os.path.exists(os.path.join(quarantine.directory, record['copy'])) )
+
+    def test002_recycle(self):
+        """Supervisor - Workers are replaced after a number of documents"""
+        jobs = self.jobs(['ok'] * 6)
+        results = batch.convert_batch(jobs, convert, 1, recycle=2)
+        self.assertTrue( all( error is None for _, _, _, error in results ) )
+        pids = set()
+        for _, outputfile in jobs:
+            with open(outputfile) as f:
+                pids.add(f.read())
+        self.assertEqual( len(pids), 3 )
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -34,10 +34,15 @@ setup(
         'console_scripts': [
             'folia2naf = naffoliapy.folia2naf:main',
             'naf2folia = naffoliapy.naf2folia:main',
+            'naffoliapy-benchmark = naffoliapy.benchmark:main',
+            'naffoliapy-cache = naffoliapy.cache:main',
+            'naffoliapy-server = naffoliapy.server:main',
+            'naffoliapy-client = naffoliapy.server:client_main',
         ]
     },
     zip_safe=False,
     include_package_data=True,
     package_data = {'naffoliapy': ['../examples/100911_Northrop_Grumman_and_Airbus_parent_EADS_defeat_Boeing.naf.xml']},
-    install_requires=['pynlpl >= 1.2.7', 'KafNafParserPy >= 1.88', 'lxml >= 2.2','docutils']
+    install_requires=['pynlpl >= 1.2.7', 'KafNafParserPy >= 1.88', 'lxml >= 2.2','docutils'],
+    extras_require={'zstd': ['zstandard']}
 )